@@ -0,0 +1,102 @@
+"""
+Perfiles de base de datos, elegidos por la variable de entorno GPQ_DB.
+
+sqlite (por defecto)
+    Archivo GPQ_DB_NAME (db.sqlite3). Al abrir cada conexión se aplica
+    cache/mmap amplios; el busy timeout hace que un escritor espere el
+    lock en vez de fallar con "database is locked", y las transacciones
+    IMMEDIATE toman el lock de escritura al empezar, porque la espera no
+    aplica cuando una transacción de lectura intenta pasar a escritura.
+    WAL (los lectores no bloquean al escritor) queda guardado en el
+    archivo, así que se activa una sola vez al desplegar con
+    `manage.py activar_wal`, no en cada conexión: el db.sqlite3 del
+    repositorio no cambia solo por abrirlo. synchronous=NORMAL se aplica
+    solo si el archivo ya está en WAL (ajustar_sincronizacion); con el
+    journal de rollback queda FULL, porque NORMAL sin WAL puede
+    corromper la base ante un corte de energía.
+
+postgresql
+    GPQ_DB_NAME, GPQ_DB_USER, GPQ_DB_PASSWORD, GPQ_DB_HOST, GPQ_DB_PORT.
+    Conexiones persistentes por GPQ_DB_CONN_MAX_AGE, o un pool de
+    psycopg 3 si GPQ_DB_POOL indica su tamaño máximo.
+
+En ambos casos GPQ_DB_CONN_MAX_AGE (segundos, 600 por defecto) mantiene
+la conexión entre solicitudes del mismo worker.
+"""
+from django.core.exceptions import ImproperlyConfigured
+
+PRAGMAS_SQLITE = (
+    "PRAGMA cache_size=-65536",      # 64 MB
+    "PRAGMA mmap_size=268435456",    # 256 MB
+    "PRAGMA temp_store=MEMORY",
+)
+
+# segundos que un escritor espera el lock de SQLite
+ESPERA_BLOQUEO_SQLITE = 20
+
+
+def perfil_sqlite(entorno, base_dir):
+    return {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": entorno.get("GPQ_DB_NAME") or base_dir / "db.sqlite3",
+        "CONN_MAX_AGE": int(entorno.get("GPQ_DB_CONN_MAX_AGE", 600)),
+        "OPTIONS": {
+            "timeout": ESPERA_BLOQUEO_SQLITE,
+            "transaction_mode": "IMMEDIATE",
+            "init_command": ";".join(PRAGMAS_SQLITE),
+        },
+    }
+
+
+def ajustar_sincronizacion(sender, connection, **kwargs):
+    """
+    Receiver de connection_created (conectado en GpqapiConfig.ready):
+    synchronous=NORMAL solo sobre un archivo en WAL.
+    """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode")
+        if cursor.fetchone()[0].lower() == "wal":
+            cursor.execute("PRAGMA synchronous=NORMAL")
+
+
+def perfil_postgresql(entorno, base_dir):
+    config = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": entorno.get("GPQ_DB_NAME", "gpq"),
+        "USER": entorno.get("GPQ_DB_USER", ""),
+        "PASSWORD": entorno.get("GPQ_DB_PASSWORD", ""),
+        "HOST": entorno.get("GPQ_DB_HOST", ""),
+        "PORT": entorno.get("GPQ_DB_PORT", ""),
+        "CONN_MAX_AGE": int(entorno.get("GPQ_DB_CONN_MAX_AGE", 600)),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {},
+    }
+    pool = int(entorno.get("GPQ_DB_POOL", 0))
+    if pool:
+        # el pool ya reutiliza las conexiones; Django exige CONN_MAX_AGE=0
+        config["CONN_MAX_AGE"] = 0
+        config["OPTIONS"]["pool"] = {
+            "min_size": min(2, pool),
+            "max_size": pool,
+            "timeout": 10,
+        }
+    return config
+
+
+PERFILES = {
+    "sqlite": perfil_sqlite,
+    "postgresql": perfil_postgresql,
+}
+
+
+def configurar(entorno, base_dir):
+    """DATABASES según GPQ_DB."""
+    nombre = entorno.get("GPQ_DB", "sqlite")
+    if nombre not in PERFILES:
+        raise ImproperlyConfigured(
+            f"GPQ_DB={nombre!r} no es un perfil válido; use "
+            f"{' o '.join(sorted(PERFILES))}."
+        )
+    return {"default": PERFILES[nombre](entorno, base_dir)}
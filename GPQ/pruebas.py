@@ -0,0 +1,21 @@
+"""
+Runner de `manage.py test` (TEST_RUNNER en settings).
+
+Las pruebas no registran métricas: GPQ_METRICAS_DB queda vacío durante
+toda la corrida para no escribir en el metricas.sqlite3 real. Las que
+prueban /api/metrics/ apuntan a un archivo temporal con override_settings.
+"""
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class GPQTestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._sin_metricas = override_settings(GPQ_METRICAS_DB="")
+        self._sin_metricas.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._sin_metricas.disable()
+        super().teardown_test_environment(**kwargs)
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from GPQ import basedatos
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -50,11 +53,73 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
+    'PAGE_SIZE': 10,
+    # filtros y orden declarados en cada viewset (GPQAPI/filtros.py)
+    'DEFAULT_FILTER_BACKENDS': ['GPQAPI.filtros.FiltroIndexado'],
+}
+
+# Minutos de vigencia del token de /api/sesiones-firma/
+GPQ_SESION_FIRMA_MINUTOS = 15
+
+# Archivo SQLite compartido por los workers donde se suman las métricas
+# de /api/metrics/. Vacío para no registrarlas (así corren las pruebas,
+# ver GPQ/pruebas.py).
+GPQ_METRICAS_DB = os.environ.get(
+    'GPQ_METRICAS_DB', str(BASE_DIR / 'metricas.sqlite3')
+)
+
+TEST_RUNNER = 'GPQ.pruebas.GPQTestRunner'
+
+# Caché local de cada worker. Las claves de los dossieres de jarabe y de
+# los grupos del tablero llevan la versión guardada en la base, así que no
+# hace falta una caché compartida para no servir datos viejos.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'gpq',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+# Segundos que un dossier de jarabe sin cambios queda en la caché
+GPQ_DOSSIER_SEGUNDOS = 3600
+
+# Segundos que un grupo del resumen del tablero sin cambios queda en la
+# caché
+GPQ_TABLERO_SEGUNDOS = 30
+
+# Logs en JSON, una línea por evento, con el id de correlación de la
+# solicitud. GPQ_LOG_LEVEL=DEBUG muestra el detalle de firmas y
+# aprobaciones; en INFO esos mensajes no se construyen.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'correlacion': {'()': 'GPQAPI.eventos.FiltroCorrelacion'},
+    },
+    'formatters': {
+        'json': {'()': 'GPQAPI.eventos.FormatoJSON'},
+    },
+    'handlers': {
+        'consola': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+            'filters': ['correlacion'],
+        },
+    },
+    'loggers': {
+        'GPQAPI': {
+            'handlers': ['consola'],
+            'level': os.environ.get('GPQ_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
 }
 
 
 MIDDLEWARE = [
+    'GPQAPI.middleware.CorrelacionMiddleware',
+    'GPQAPI.middleware.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,13 +151,11 @@ WSGI_APPLICATION = 'GPQ.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# GPQ_DB=sqlite (por defecto, con espera ante bloqueos; WAL se activa una
+# vez con `manage.py activar_wal`) o GPQ_DB=postgresql; ver
+# GPQ/basedatos.py para las demás variables.
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
+DATABASES = basedatos.configurar(os.environ, BASE_DIR)
 
 
 # Password validation
@@ -1,6 +1,23 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.db.backends.signals import connection_created
 
 
 class GpqapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'GPQAPI'
+
+    def ready(self):
+        from GPQ import basedatos
+
+        from . import busqueda, dossier, tablero
+        from .filtros import revisar_filtros
+
+        checks.register(revisar_filtros)
+        connection_created.connect(
+            basedatos.ajustar_sincronizacion,
+            dispatch_uid="gpq-sincronizacion-sqlite",
+        )
+        busqueda.conectar()
+        dossier.conectar()
+        tablero.conectar()
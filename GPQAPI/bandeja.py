@@ -0,0 +1,176 @@
+"""
+Bandeja de firmas pendientes de cada firmante.
+
+El rol del perfil define qué falta firmar:
+
+JEFE_SECCION, JEFE_PRODUCCION, QUIMICO_FARMACEUTICO
+    planillas de fabricación, envase primario y envase secundario sin el
+    campo de firma del rol (RegistroFirma.CAMPOS_FIRMA_PLANILLA);
+INSPECTOR_CALIDAD
+    controles de calidad sin firma_control_calidad.
+
+Cada campo de firma encabeza un índice (firma, fecha, id), así que "firma
+IS NULL" ordenado por (fecha, id) se lee del índice sin ordenar. Una
+página son una consulta por tabla (las primeras `limite` + 1 filas desde
+el cursor) mezcladas por (fecha, tipo, id), de la más antigua a la más
+nueva; los conteos de todas las tablas son una consulta más (UNION ALL de
+un COUNT por tabla).
+
+El cursor es la última fila entregada codificada en base64; con él cada
+tabla sigue por su índice, sin OFFSET, así que una página profunda cuesta
+lo mismo que la primera.
+"""
+import base64
+import datetime
+import heapq
+import json
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import models
+from django.db.models import Count, Q, Value
+
+from .models import (
+    ControlCalidad,
+    PlanillaEnvasePrimario,
+    PlanillaEnvaseSecundarioEmpaque,
+    PlanillaFabricacion,
+    RegistroFirma,
+)
+
+Fuente = namedtuple(
+    "Fuente", ["tipo", "modelo", "campo_firma", "campo_fecha", "titulo"]
+)
+
+# tipo igual al campo de planilla de RegistroFirma, como en firmas-masivas
+PLANILLAS = (
+    ("planilla_fabricacion", PlanillaFabricacion),
+    ("planilla_envase_primario", PlanillaEnvasePrimario),
+    ("planilla_envase_secundario_empaque", PlanillaEnvaseSecundarioEmpaque),
+)
+
+FUENTES_POR_ROL = {
+    rol: [
+        Fuente(
+            tipo, modelo, campo, "fecha_creacion",
+            ("serie", "numero_planilla"),
+        )
+        for tipo, modelo in PLANILLAS
+    ]
+    for rol, campo in RegistroFirma.CAMPOS_FIRMA_PLANILLA.items()
+}
+FUENTES_POR_ROL["INSPECTOR_CALIDAD"] = [
+    Fuente(
+        "control_calidad", ControlCalidad, "firma_control_calidad",
+        "fecha_verificacion", ("codigo_control_calidad",),
+    ),
+]
+
+
+def fuentes(rol):
+    """Fuentes pendientes del rol (de cualquier forma escrito), o []."""
+    return FUENTES_POR_ROL.get(RegistroFirma.normalizar_tipo_firma(rol), [])
+
+
+# ===========================================================
+# CURSOR
+# ===========================================================
+def escribir_cursor(fecha, orden, pk):
+    texto = json.dumps([fecha.isoformat(), orden, pk])
+    # sin el relleno "=", que en la URL quedaría como %3D
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip("=")
+
+
+def leer_cursor(cursor):
+    """(fecha en ISO, orden de la fuente, id); ValueError si no es válido."""
+    try:
+        fecha, orden, pk = json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        )
+        datetime.datetime.fromisoformat(fecha)
+    except (TypeError, ValueError) as exc:
+        raise ValueError("Cursor no válido.") from exc
+    if not isinstance(orden, int) or not isinstance(pk, int):
+        raise ValueError("Cursor no válido.")
+    return fecha, orden, pk
+
+
+def _despues(fuente, orden, cursor):
+    """Filas de la fuente que van después del cursor en (fecha, orden, id)."""
+    fecha, orden_cursor, pk = cursor
+    campo = fuente.modelo._meta.get_field(fuente.campo_fecha)
+    try:
+        fecha = campo.to_python(fecha)
+    except DjangoValidationError as exc:
+        raise ValueError("Cursor no válido.") from exc
+    if orden > orden_cursor:
+        return Q(**{f"{fuente.campo_fecha}__gte": fecha})
+    if orden < orden_cursor:
+        return Q(**{f"{fuente.campo_fecha}__gt": fecha})
+    return Q(**{f"{fuente.campo_fecha}__gt": fecha}) | Q(
+        **{fuente.campo_fecha: fecha, "id__gt": pk}
+    )
+
+
+# ===========================================================
+# CONSULTAS
+# ===========================================================
+def _pendientes(fuente):
+    return fuente.modelo.objects.filter(
+        **{f"{fuente.campo_firma}__isnull": True}
+    )
+
+
+def conteos(rol):
+    """{tipo: pendientes} del rol, en una consulta."""
+    lista = fuentes(rol)
+    if not lista:
+        return {}
+    consultas = [
+        _pendientes(fuente).order_by().annotate(
+            indice=Value(i, output_field=models.IntegerField()),
+        ).values("indice").annotate(total=Count("pk"))
+        for i, fuente in enumerate(lista)
+    ]
+    resultado = {fuente.tipo: 0 for fuente in lista}
+    for fila in consultas[0].union(*consultas[1:], all=True):
+        resultado[lista[fila["indice"]].tipo] = fila["total"]
+    return resultado
+
+
+def _filas(fuente, orden, limite, cursor):
+    consulta = _pendientes(fuente)
+    if cursor is not None:
+        consulta = consulta.filter(_despues(fuente, orden, cursor))
+    for fila in consulta.order_by(fuente.campo_fecha, "id").values(
+        "id", fuente.campo_fecha, *fuente.titulo, "producto__nombre",
+    )[:limite]:
+        fecha = fila[fuente.campo_fecha]
+        yield (fecha, orden, fila["id"]), {
+            "tipo": fuente.tipo,
+            "id": fila["id"],
+            "titulo": "-".join(
+                str(fila[c]) for c in fuente.titulo if fila[c]
+            ),
+            "producto": fila["producto__nombre"],
+            "fecha": fecha,
+        }
+
+
+def pagina(rol, limite=20, cursor=None):
+    """
+    (filas, cursor siguiente o None): las `limite` firmas pendientes más
+    antiguas del rol después de `cursor` (ver leer_cursor).
+    """
+    lista = fuentes(rol)
+    # cada tabla entrega limite + 1 para saber si hay otra página
+    por_fuente = [
+        list(_filas(fuente, orden, limite + 1, cursor))
+        for orden, fuente in enumerate(lista)
+    ]
+    mezcla = list(heapq.merge(*por_fuente, key=lambda par: par[0]))
+    filas = [fila for _, fila in mezcla[:limite]]
+    siguiente = None
+    if len(mezcla) > limite:
+        siguiente = escribir_cursor(*mezcla[limite - 1][0])
+    return filas, siguiente
@@ -0,0 +1,249 @@
+"""
+Búsqueda de texto completo sobre el catálogo: materias primas, productos,
+materiales de envase y planillas con firmas.
+
+Cada objeto es una fila de la tabla gpq_busqueda (creada en la migración
+0057) con un título y un texto:
+
+sqlite
+    Tabla virtual FTS5 con tokenizer unicode61 sin tildes e índices de
+    prefijo; el ranking es bm25 con el título pesando más que el texto.
+postgresql
+    Tabla con una columna tsvector generada (título con peso A, texto con
+    peso B) e índice GIN; el ranking es ts_rank.
+
+La clave de cada fila es id * 8 + código del tipo, así guardar y quitar
+un objeto son una sola sentencia por clave. Los receivers de post_save y
+post_delete (conectados en GpqapiConfig.ready) mantienen el índice en la
+misma transacción que el cambio; las eliminaciones en cascada también
+pasan por post_delete. bulk_create y QuerySet.update no emiten señales:
+quien inserta en masa llama a indexar(), y reindexar() (comando
+reindexar_busqueda) reconstruye todo.
+
+Cada palabra de la consulta se busca como prefijo y todas deben estar,
+de modo que "acido cit" encuentra "Ácido cítrico" y "REC-0049" los batch
+REC-004900 a REC-004999.
+"""
+import re
+from collections import namedtuple
+
+from django.apps import apps as django_apps
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+
+Fuente = namedtuple(
+    "Fuente", ["tipo", "codigo", "modelo", "titulo", "texto", "separador"],
+    defaults=[" "],
+)
+
+FUENTES = [
+    Fuente("materia_prima", 1, "MateriaPrima", ("nombre",), ("batch",)),
+    Fuente("producto", 2, "Producto", ("nombre",), ()),
+    Fuente(
+        "material_envase_primario", 3, "MaterialEnvasePrimario",
+        ("nombre",), ("codigo", "codigo_calidad"),
+    ),
+    Fuente(
+        "material_envase_secundario_empaque", 4,
+        "MaterialEnvaseSecundarioEmpaque",
+        ("nombre",), ("codigo", "codigo_calidad"),
+    ),
+    Fuente(
+        "planilla_fabricacion", 5, "PlanillaFabricacion",
+        ("serie", "numero_planilla"), ("batch_standart",), "-",
+    ),
+    Fuente(
+        "planilla_envase_primario", 6, "PlanillaEnvasePrimario",
+        ("serie", "numero_planilla"), ("batch_standart",), "-",
+    ),
+    Fuente(
+        "planilla_envase_secundario_empaque", 7,
+        "PlanillaEnvaseSecundarioEmpaque",
+        ("serie", "numero_planilla"), ("batch_standart",), "-",
+    ),
+]
+
+FUENTE_POR_TIPO = {fuente.tipo: fuente for fuente in FUENTES}
+# por nombre de clase, el sender de las señales
+FUENTE_POR_MODELO = {fuente.modelo: fuente for fuente in FUENTES}
+
+LOTE = 2000
+
+SQL = {
+    "sqlite": {
+        "guardar": (
+            "INSERT OR REPLACE INTO gpq_busqueda "
+            "(rowid, tipo, objeto_id, titulo, texto) "
+            "VALUES (%s, %s, %s, %s, %s)"
+        ),
+        "quitar": "DELETE FROM gpq_busqueda WHERE rowid = %s",
+        "vaciar": "DELETE FROM gpq_busqueda",
+        # ORDER BY rank usa el bm25 con pesos configurado en la tabla
+        "buscar": (
+            "SELECT tipo, objeto_id, titulo, -rank FROM gpq_busqueda "
+            "WHERE gpq_busqueda MATCH %s{tipos} ORDER BY rank LIMIT %s"
+        ),
+        "tipos": " AND tipo IN ({marcas})",
+    },
+    "postgresql": {
+        "guardar": (
+            "INSERT INTO gpq_busqueda (clave, tipo, objeto_id, titulo, texto) "
+            "VALUES (%s, %s, %s, %s, %s) "
+            "ON CONFLICT (clave) DO UPDATE SET tipo = EXCLUDED.tipo, "
+            "objeto_id = EXCLUDED.objeto_id, titulo = EXCLUDED.titulo, "
+            "texto = EXCLUDED.texto"
+        ),
+        "quitar": "DELETE FROM gpq_busqueda WHERE clave = %s",
+        "vaciar": "TRUNCATE gpq_busqueda",
+        "buscar": (
+            "SELECT tipo, objeto_id, titulo, ts_rank(vector, consulta) "
+            "AS rango FROM gpq_busqueda, "
+            "to_tsquery('simple', %s) AS consulta "
+            "WHERE vector @@ consulta{tipos} "
+            "ORDER BY rango DESC, clave LIMIT %s"
+        ),
+        "tipos": " AND tipo IN ({marcas})",
+    },
+}
+
+
+def _sql(nombre):
+    return SQL[connection.vendor][nombre]
+
+
+def _clave(fuente, pk):
+    return pk * 8 + fuente.codigo
+
+
+def _unir(fuente, valores):
+    return fuente.separador.join(str(v) for v in valores if v)
+
+
+def _fila(fuente, pk, valores):
+    n = len(fuente.titulo)
+    return (
+        _clave(fuente, pk), fuente.tipo, pk,
+        _unir(fuente, valores[:n]), " ".join(str(v) for v in valores[n:] if v),
+    )
+
+
+def _fila_objeto(obj):
+    fuente = FUENTE_POR_MODELO[type(obj).__name__]
+    campos = fuente.titulo + fuente.texto
+    return _fila(fuente, obj.pk, [getattr(obj, c) for c in campos])
+
+
+# ===========================================================
+# ESCRITURA
+# ===========================================================
+def indexar(objetos):
+    """Agrega o actualiza las instancias en el índice (una sentencia)."""
+    filas = [_fila_objeto(obj) for obj in objetos]
+    if filas:
+        with connection.cursor() as cursor:
+            cursor.executemany(_sql("guardar"), filas)
+
+
+def quitar(objetos):
+    claves = [
+        (_clave(FUENTE_POR_MODELO[type(obj).__name__], obj.pk),)
+        for obj in objetos
+    ]
+    if claves:
+        with connection.cursor() as cursor:
+            cursor.executemany(_sql("quitar"), claves)
+
+
+def reindexar():
+    """Reconstruye el índice completo leyendo cada modelo por bloques."""
+    total = 0
+    with connection.cursor() as cursor:
+        cursor.execute(_sql("vaciar"))
+        for fuente in FUENTES:
+            modelo = django_apps.get_model("GPQAPI", fuente.modelo)
+            filas = []
+            for pk, *valores in (
+                modelo.objects.order_by("pk")
+                .values_list("pk", *fuente.titulo, *fuente.texto)
+                .iterator(chunk_size=LOTE)
+            ):
+                filas.append(_fila(fuente, pk, valores))
+                if len(filas) >= LOTE:
+                    cursor.executemany(_sql("guardar"), filas)
+                    total += len(filas)
+                    filas = []
+            if filas:
+                cursor.executemany(_sql("guardar"), filas)
+                total += len(filas)
+    return total
+
+
+# ===========================================================
+# CONSULTA
+# ===========================================================
+def _terminos(texto):
+    return re.findall(r"\w+", texto.lower())
+
+
+def _consulta(terminos):
+    if connection.vendor == "postgresql":
+        return " & ".join(f"{t}:*" for t in terminos)
+    return " ".join(f'"{t}"*' for t in terminos)
+
+
+def buscar(texto, tipos=None, limite=20):
+    """
+    Resultados ordenados por relevancia: dicts con tipo, id, titulo y
+    rango (mayor es mejor). Una sola consulta sobre el índice.
+    """
+    terminos = _terminos(texto)
+    if not terminos:
+        return []
+    parametros = [_consulta(terminos)]
+    filtro_tipos = ""
+    if tipos:
+        filtro_tipos = _sql("tipos").format(
+            marcas=", ".join(["%s"] * len(tipos))
+        )
+        parametros += list(tipos)
+    parametros.append(limite)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            _sql("buscar").format(tipos=filtro_tipos), parametros
+        )
+        return [
+            {"tipo": tipo, "id": pk, "titulo": titulo, "rango": rango}
+            for tipo, pk, titulo, rango in cursor.fetchall()
+        ]
+
+
+# ===========================================================
+# SINCRONIZACIÓN
+# ===========================================================
+def _al_guardar(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    fuente = FUENTE_POR_MODELO[sender.__name__]
+    # firmar o cambiar el estado no toca los campos indexados
+    if update_fields is not None and not (
+        set(update_fields) & set(fuente.titulo + fuente.texto)
+    ):
+        return
+    indexar([instance])
+
+
+def _al_eliminar(sender, instance, **kwargs):
+    quitar([instance])
+
+
+def conectar():
+    for fuente in FUENTES:
+        modelo = django_apps.get_model("GPQAPI", fuente.modelo)
+        post_save.connect(
+            _al_guardar, sender=modelo,
+            dispatch_uid=f"busqueda-guardar-{fuente.tipo}",
+        )
+        post_delete.connect(
+            _al_eliminar, sender=modelo,
+            dispatch_uid=f"busqueda-eliminar-{fuente.tipo}",
+        )
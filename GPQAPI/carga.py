@@ -0,0 +1,518 @@
+"""
+Medición de carga de la API.
+
+Recorre el stack completo (middleware, autenticación por sesión con CSRF,
+DRF, ORM) sobre una base sembrada con `manage.py generar_datos`, en el
+mismo proceso (django.test.Client, un cliente por hilo) o contra un
+servidor local por HTTP. En modo HTTP la preparación lee la misma base
+que usa el servidor, así que ambos deben apuntar al mismo settings.
+
+Escenarios:
+    listar          GET de la primera página de las tres planillas
+    firmar          firmas concurrentes con token de sesión de firma
+    stock           upserts concurrentes de StockMateriaPrimaViewSet.create
+    pedido_bodega   creación de planillas de fabricación PEDIDO_BODEGA
+    mixto           los cuatro anteriores según MEZCLA
+
+Por escenario y operación se informa rendimiento (ops/s), latencia
+p50/p95/p99 y errores por clase; "database is locked" de SQLite se
+cuenta aparte como bloqueo_db.
+"""
+import datetime
+import http.client
+import importlib
+import json
+import platform
+import random
+import subprocess
+import threading
+import time
+import urllib.parse
+from collections import Counter, deque
+
+import django
+from django.conf import settings
+from django.contrib.auth import (
+    BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY,
+)
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from .management.commands.generar_datos import PASSWORD_FIRMANTES
+from .models import (
+    UsuarioPersonalizado,
+    RegistroFirma,
+    Producto,
+    TipoProducto,
+    PlanillaFabricacion,
+    PlanillaEnvasePrimario,
+    PlanillaEnvaseSecundarioEmpaque,
+    StockMateriaPrima,
+)
+
+ESCENARIOS = ("listar", "firmar", "stock", "pedido_bodega", "mixto")
+
+# peso de cada operación en el escenario mixto
+MEZCLA = {"listar": 7, "firmar": 1, "stock": 1, "pedido_bodega": 1}
+
+# (alcance de la sesión de firma, modelo, basename del router)
+PLANILLAS = [
+    ("planilla_fabricacion", PlanillaFabricacion, "planillafabricacion"),
+    (
+        "planilla_envase_primario", PlanillaEnvasePrimario,
+        "planillaenvaseprimario",
+    ),
+    (
+        "planilla_envase_secundario_empaque",
+        PlanillaEnvaseSecundarioEmpaque,
+        "planillaenvasesecundarioempaque",
+    ),
+]
+
+# materias sobre las que compiten los upserts de stock
+MATERIAS_EN_DISPUTA = 20
+
+# pares (planilla, rol) pendientes que se preparan para firmar
+MAXIMO_FIRMAS = 20000
+
+
+# ===========================================================
+# CLIENTES
+# ===========================================================
+def abrir_sesion_web(usuario):
+    """
+    Sesión de Django ya autenticada (lo mismo que deja un login) y un
+    token CSRF, para que cada solicitud pase por SessionAuthentication
+    sin calcular el hash de la contraseña.
+    """
+    motor = importlib.import_module(settings.SESSION_ENGINE)
+    sesion = motor.SessionStore()
+    sesion[SESSION_KEY] = usuario._meta.pk.value_to_string(usuario)
+    sesion[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    sesion[HASH_SESSION_KEY] = usuario.get_session_auth_hash()
+    sesion.create()
+    return sesion.session_key, get_random_string(32)
+
+
+class ClienteEnProceso:
+    """Solicitudes por el handler de Django, sin red."""
+
+    def __init__(self, clave_sesion, csrf):
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != "*"]
+        self.cliente = Client(
+            # un host que acepte ALLOWED_HOSTS también con DEBUG=False
+            SERVER_NAME=hosts[0].lstrip(".") if hosts else "localhost",
+            enforce_csrf_checks=True,
+            raise_request_exception=False,
+        )
+        self.cliente.cookies[settings.SESSION_COOKIE_NAME] = clave_sesion
+        self.cliente.cookies[settings.CSRF_COOKIE_NAME] = csrf
+        self.csrf = csrf
+
+    def solicitar(self, metodo, ruta, datos=None):
+        """Devuelve (estado, cuerpo, texto de la excepción o "")."""
+        response = self.cliente.generic(
+            metodo, ruta,
+            json.dumps(datos) if datos is not None else "",
+            content_type="application/json",
+            **{settings.CSRF_HEADER_NAME: self.csrf},
+        )
+        if response.streaming:
+            cuerpo = b"".join(response.streaming_content)
+        else:
+            cuerpo = response.content
+        exc_info = getattr(response, "exc_info", None)
+        error = repr(exc_info[1]) if exc_info else ""
+        return response.status_code, cuerpo, error
+
+    def cerrar(self):
+        pass
+
+
+class ClienteHTTP:
+    """Solicitudes a un servidor local, con una conexión keep-alive."""
+
+    TIMEOUT = 30
+
+    def __init__(self, url, clave_sesion, csrf):
+        partes = urllib.parse.urlsplit(url)
+        self.host = partes.hostname
+        self.puerto = partes.port
+        self.base = partes.path.rstrip("/")
+        self.cabeceras = {
+            "Content-Type": "application/json",
+            "Cookie": (
+                f"{settings.SESSION_COOKIE_NAME}={clave_sesion}; "
+                f"{settings.CSRF_COOKIE_NAME}={csrf}"
+            ),
+            "X-CSRFToken": csrf,
+        }
+        self.conexion = None
+
+    def solicitar(self, metodo, ruta, datos=None):
+        if self.conexion is None:
+            self.conexion = http.client.HTTPConnection(
+                self.host, self.puerto, timeout=self.TIMEOUT
+            )
+        cuerpo = json.dumps(datos).encode() if datos is not None else None
+        try:
+            self.conexion.request(
+                metodo, self.base + ruta, body=cuerpo, headers=self.cabeceras
+            )
+            response = self.conexion.getresponse()
+            contenido = response.read()
+        except (OSError, http.client.HTTPException) as exc:
+            self.cerrar()
+            return 0, b"", repr(exc)
+        if response.will_close:
+            self.cerrar()
+        return response.status, contenido, ""
+
+    def cerrar(self):
+        if self.conexion is not None:
+            self.conexion.close()
+            self.conexion = None
+
+
+def clasificar_error(estado, cuerpo, error):
+    """Clase de error de una respuesta, o None si fue exitosa."""
+    if "database is locked" in error or (
+        estado >= 500 and b"database is locked" in cuerpo
+    ):
+        return "bloqueo_db"
+    if estado == 0:
+        return "conexion"
+    if estado >= 500:
+        return "http_5xx"
+    if estado >= 400:
+        return "http_4xx"
+    return None
+
+
+# ===========================================================
+# RESULTADOS
+# ===========================================================
+def percentil(ordenados, p):
+    """Percentil por rango más cercano de una lista ya ordenada."""
+    if not ordenados:
+        return None
+    rango = max(int(-(-p * len(ordenados) // 100)), 1)
+    return ordenados[rango - 1]
+
+
+def resumir(muestras, segundos):
+    """muestras: [(latencia_s, clase_error o None)]"""
+    latencias = sorted(latencia * 1000 for latencia, _ in muestras)
+    errores = Counter(clase for _, clase in muestras if clase)
+    total = len(muestras)
+    return {
+        "operaciones": total,
+        "exitosas": total - sum(errores.values()),
+        "errores": dict(sorted(errores.items())),
+        "tasa_error": round(sum(errores.values()) / total, 4) if total else 0,
+        "rendimiento_ops_s": round(total / segundos, 2) if segundos else 0,
+        "latencia_ms": {
+            "p50": percentil(latencias, 50),
+            "p95": percentil(latencias, 95),
+            "p99": percentil(latencias, 99),
+            "max": latencias[-1] if latencias else None,
+            "media": sum(latencias) / total if total else None,
+        },
+    }
+
+
+def _variacion(antes, ahora):
+    if not antes or ahora is None:
+        return "-"
+    return f"{(ahora - antes) / antes * 100:+.1f}%"
+
+
+def comparar(anterior, actual):
+    """Líneas con la variación de rendimiento y p95 por escenario."""
+    lineas = []
+    for escenario, datos in actual["escenarios"].items():
+        previo = anterior.get("escenarios", {}).get(escenario)
+        if not previo:
+            continue
+        antes, ahora = previo["total"], datos["total"]
+        ops = (antes["rendimiento_ops_s"], ahora["rendimiento_ops_s"])
+        p95 = (antes["latencia_ms"]["p95"], ahora["latencia_ms"]["p95"])
+        if None in p95:
+            lineas.append(f"{escenario}: sin latencias para comparar")
+            continue
+        lineas.append(
+            f"{escenario}: {ops[0]} -> {ops[1]} ops/s "
+            f"({_variacion(*ops)}), p95 {p95[0]:.1f} -> {p95[1]:.1f} ms "
+            f"({_variacion(*p95)})"
+        )
+    return lineas
+
+
+# ===========================================================
+# MEDICIÓN
+# ===========================================================
+class MedicionCarga:
+    """
+    Prepara los datos de los escenarios desde la base sembrada y los
+    ejecuta con `hilos` clientes concurrentes durante `duracion` segundos
+    (o hasta `operaciones` solicitudes, lo que ocurra primero).
+    """
+
+    def __init__(self, prefijo="S0", url=None, hilos=4, duracion=10.0,
+                 operaciones=None, semilla=0, password=None):
+        self.prefijo = prefijo
+        self.url = url
+        self.hilos = hilos
+        self.duracion = duracion
+        self.operaciones = operaciones
+        self.semilla = semilla
+        self.password = password or PASSWORD_FIRMANTES
+        self._lock = threading.Lock()
+        self._pedidos = 0
+
+    # ---------------------------------------------------------
+    # Preparación
+    # ---------------------------------------------------------
+    def preparar(self):
+        firmantes = list(
+            UsuarioPersonalizado.objects.filter(
+                username__startswith=f"{self.prefijo}-",
+                perfilusuario__rol__in=RegistroFirma.CAMPOS_FIRMA_PLANILLA,
+            ).select_related("perfilusuario").order_by("id")
+        )
+        if not firmantes:
+            raise ValueError(
+                f"No hay firmantes con el prefijo {self.prefijo}; siembre "
+                "la base con manage.py generar_datos."
+            )
+        self.usuario = firmantes[0]
+        self.sesion_web = abrir_sesion_web(self.usuario)
+        cliente = self.cliente()
+
+        # un token de sesión de firma por firmante (un solo PBKDF2 cada uno)
+        tokens = {}
+        for firmante in firmantes:
+            estado, cuerpo, error = cliente.solicitar(
+                "POST", reverse("sesionfirma-list"),
+                {"rut": firmante.rut, "password": self.password},
+            )
+            if estado != 201:
+                raise ValueError(
+                    f"No se pudo abrir la sesión de firma de "
+                    f"{firmante.username}: {estado} {cuerpo[:200]!r} {error}"
+                )
+            tokens.setdefault(firmante.perfilusuario.rol, []).append(
+                json.loads(cuerpo)["token"]
+            )
+        cliente.cerrar()
+
+        rng = random.Random(self.semilla)
+        pendientes = []
+        for _, modelo, basename in PLANILLAS:
+            for rol, campo in RegistroFirma.CAMPOS_FIRMA_PLANILLA.items():
+                ids = modelo.objects.filter(
+                    serie__startswith=f"{self.prefijo}-",
+                    **{f"{campo}__isnull": True},
+                ).values_list("id", flat=True)[:MAXIMO_FIRMAS // 9]
+                pendientes.extend(
+                    (basename, pk, rng.choice(tokens[rol])) for pk in ids
+                )
+        rng.shuffle(pendientes)
+        self.firmas_pendientes = deque(pendientes)
+
+        self.materias = list(
+            StockMateriaPrima.objects.filter(
+                materia_prima__nombre__startswith=f"{self.prefijo} ",
+                materia_prima__estado_aprobacion="APROBADO",
+            ).order_by("id").values_list("materia_prima_id", flat=True)
+        )
+        if not self.materias:
+            raise ValueError(
+                f"No hay materias primas aprobadas con stock ({self.prefijo})"
+            )
+        self.materias_en_disputa = self.materias[:MATERIAS_EN_DISPUTA]
+        self.productos = list(
+            Producto.objects.filter(
+                nombre__startswith=f"{self.prefijo} "
+            ).values_list("id", flat=True)
+        )
+        self.tipos = list(
+            TipoProducto.objects.filter(
+                nombre__startswith=f"{self.prefijo} "
+            ).values_list("id", flat=True)
+        )
+
+    def cliente(self):
+        clave, csrf = self.sesion_web
+        if self.url:
+            return ClienteHTTP(self.url, clave, csrf)
+        return ClienteEnProceso(clave, csrf)
+
+    # ---------------------------------------------------------
+    # Operaciones: cada una devuelve (método, ruta, datos) o None
+    # ---------------------------------------------------------
+    def op_listar(self, rng):
+        _, _, basename = rng.choice(PLANILLAS)
+        return "GET", reverse(f"{basename}-list"), None
+
+    def op_firmar(self, rng):
+        try:
+            basename, pk, token = self.firmas_pendientes.popleft()
+        except IndexError:
+            return None
+        return (
+            "POST", reverse(f"{basename}-firmar", args=[pk]),
+            {"token": token},
+        )
+
+    def op_stock(self, rng):
+        return "POST", reverse("stockmateriaprima-list"), {
+            "materia_prima": rng.choice(self.materias_en_disputa),
+            "cantidad_disponible": str(rng.randrange(500, 5000)),
+        }
+
+    def op_pedido_bodega(self, rng):
+        with self._lock:
+            self._pedidos += 1
+            numero = self._pedidos
+        hoy = datetime.date.today()
+        return "POST", reverse("planillafabricacion-list"), {
+            "tipo_movimiento": "PEDIDO_BODEGA",
+            "producto": rng.choice(self.productos),
+            "tipo_producto": rng.choice(self.tipos),
+            "materia_prima": rng.choice(self.materias),
+            "cantidad_entregada": "1.00",
+            "serie": f"{self.prefijo}-CARGA",
+            "numero_planilla": str(numero),
+            "fecha_emision": hoy.isoformat(),
+            "fecha_vencimiento": (
+                hoy + datetime.timedelta(days=730)
+            ).isoformat(),
+            "rendimiento_teorico": "100",
+            "periodo_eficacia": 24,
+            "cantidad_estuches": "10",
+        }
+
+    def _siguiente(self, escenario, rng):
+        if escenario == "mixto":
+            escenario = rng.choices(
+                list(MEZCLA), weights=list(MEZCLA.values())
+            )[0]
+            solicitud = getattr(self, f"op_{escenario}")(rng)
+            if solicitud is None:
+                # sin firmas pendientes el mixto sigue con lecturas
+                escenario = "listar"
+                solicitud = self.op_listar(rng)
+        else:
+            solicitud = getattr(self, f"op_{escenario}")(rng)
+        return (escenario, solicitud) if solicitud else None
+
+    # ---------------------------------------------------------
+    # Ejecución
+    # ---------------------------------------------------------
+    def correr(self, escenario):
+        muestras = []
+        restantes = [self.operaciones]
+        fin = time.perf_counter() + self.duracion
+
+        def tomar_turno():
+            with self._lock:
+                if restantes[0] is None:
+                    return True
+                if restantes[0] <= 0:
+                    return False
+                restantes[0] -= 1
+                return True
+
+        def trabajador(numero):
+            rng = random.Random(f"{self.semilla}-{escenario}-{numero}")
+            cliente = self.cliente()
+            try:
+                while time.perf_counter() < fin and tomar_turno():
+                    siguiente = self._siguiente(escenario, rng)
+                    if siguiente is None:
+                        break
+                    operacion, (metodo, ruta, datos) = siguiente
+                    inicio = time.perf_counter()
+                    estado, cuerpo, error = cliente.solicitar(
+                        metodo, ruta, datos
+                    )
+                    muestras.append((
+                        operacion,
+                        time.perf_counter() - inicio,
+                        clasificar_error(estado, cuerpo, error),
+                    ))
+            finally:
+                cliente.cerrar()
+
+        inicio = time.perf_counter()
+        if self.hilos == 1:
+            # en el hilo actual: ve la transacción en curso (tests)
+            trabajador(0)
+        else:
+            def en_hilo(numero):
+                try:
+                    trabajador(numero)
+                finally:
+                    connections.close_all()
+
+            hilos = [
+                threading.Thread(target=en_hilo, args=(n,))
+                for n in range(self.hilos)
+            ]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+        segundos = time.perf_counter() - inicio
+
+        por_operacion = {}
+        for operacion, latencia, clase in muestras:
+            por_operacion.setdefault(operacion, []).append((latencia, clase))
+        return {
+            "segundos": round(segundos, 3),
+            "total": resumir(
+                [(latencia, clase) for _, latencia, clase in muestras],
+                segundos,
+            ),
+            "por_operacion": {
+                operacion: resumir(lista, segundos)
+                for operacion, lista in sorted(por_operacion.items())
+            },
+        }
+
+    def ejecutar(self, escenarios=ESCENARIOS):
+        self.preparar()
+        return {
+            "metadatos": self.metadatos(),
+            "escenarios": {
+                escenario: self.correr(escenario) for escenario in escenarios
+            },
+        }
+
+    def metadatos(self):
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=settings.BASE_DIR, capture_output=True, text=True,
+                timeout=5,
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        return {
+            "fecha": timezone.now().isoformat(),
+            "commit": commit,
+            "modo": "http" if self.url else "en_proceso",
+            "url": self.url,
+            "base_datos": connection.vendor,
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "hilos": self.hilos,
+            "duracion_s": self.duracion,
+            "operaciones": self.operaciones,
+            "semilla": self.semilla,
+            "prefijo": self.prefijo,
+        }
@@ -0,0 +1,357 @@
+"""
+Dossier de liberación de un lote de jarabe en una sola respuesta.
+
+Reúne el jarabe, su producto, las tres planillas que agrupa, los
+materiales que consumen, sus controles de calidad (el de cada planilla y
+el vigente de cada material) y todas las firmas con la identidad y el
+rol de quien firmó. Se arma con tres consultas fijas:
+
+1. el jarabe con producto, planillas, materiales y controles de las
+   planillas con su inspector (select_related, un SELECT con LEFT JOIN);
+2. los controles vigentes de los materiales que no son ya los de las
+   planillas, con su inspector (se omite si no hay);
+3. las firmas: las registradas sobre las planillas más las que referencian
+   planillas, controles y materia prima, con usuario y perfil.
+
+El resultado queda en la caché bajo una clave con Jarabe.version_dossier.
+Los receivers de abajo (conectados en GpqapiConfig.ready) suben esa
+versión cuando cambia cualquier registro del dossier, también el producto
+y el nombre, RUT o rol de quien firmó, con un UPDATE al confirmar la
+transacción; RegistroFirma.firmar_planillas lo pide para sus update().
+Como la versión se lee de la base en cada solicitud, una caché por
+worker nunca entrega un dossier viejo: a lo sumo, quien lea entre el
+commit y el UPDATE guarda datos nuevos bajo la versión anterior.
+"""
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, pre_delete
+
+from .models import (
+    ControlCalidad,
+    Jarabe,
+    MateriaPrima,
+    MaterialEnvasePrimario,
+    PerfilUsuario,
+    PlanillaEnvase,
+    PlanillaEnvasePrimario,
+    PlanillaFabricacion,
+    Producto,
+    RegistroFirma,
+    UsuarioPersonalizado,
+)
+from .serializers import (
+    ControlCalidadSerializer,
+    JarabeSerializer,
+    MateriaPrimaSerializer,
+    MaterialEnvasePrimarioSerializer,
+    PlanillaEnvasePrimarioSerializer,
+    PlanillaEnvaseSerializer,
+    PlanillaFabricacionSerializer,
+    ProductoSerializer,
+    RegistroFirmaSerializer,
+)
+
+# firmas de cada planilla (campo del jarabe, campos de firma)
+FIRMAS_PLANILLA = (
+    ("planilla_fabricacion", (
+        "firma_jefe_seccion", "firma_jefe_produccion",
+        "firma_quimico_farmaceutico",
+    )),
+    ("planilla_envase", ("firma_jefe_seccion", "firma_jefe_produccion")),
+    ("planilla_envase_primario", (
+        "firma_jefe_seccion", "firma_jefe_produccion",
+        "firma_quimico_farmaceutico",
+    )),
+)
+
+
+def clave(jarabe):
+    return f"gpq:dossier-jarabe:{jarabe.pk}:{jarabe.version_dossier}"
+
+
+def obtener(jarabe):
+    """Dossier de la caché, o armado y guardado si cambió la versión."""
+    datos = cache.get(clave(jarabe))
+    if datos is None:
+        datos = armar(jarabe.pk)
+        cache.set(clave(jarabe), datos, settings.GPQ_DOSSIER_SEGUNDOS)
+    return datos
+
+
+def armar(jarabe_id):
+    jarabe = Jarabe.objects.select_related(
+        "producto",
+        "planilla_fabricacion__control_calidad__inspector",
+        "planilla_fabricacion__materia_prima",
+        "planilla_envase",
+        "planilla_envase_primario__control_calidad__inspector",
+        "planilla_envase_primario__material_envase_primario",
+    ).get(pk=jarabe_id)
+    pf = jarabe.planilla_fabricacion
+    pe = jarabe.planilla_envase
+    pep = jarabe.planilla_envase_primario
+    materia = pf.materia_prima if pf else None
+    material_ep = pep.material_envase_primario if pep else None
+
+    # controles de las planillas (ya cargados) y vigentes de los materiales
+    controles = {
+        planilla.control_calidad_id: planilla.control_calidad
+        for planilla in (pf, pep) if planilla
+    }
+    vigentes = {
+        material.control_calidad_vigente_id
+        for material in (materia, material_ep)
+        if material and material.control_calidad_vigente_id
+    } - set(controles)
+    if vigentes:
+        controles.update(
+            (control.pk, control)
+            for control in ControlCalidad.objects.select_related(
+                "inspector"
+            ).filter(pk__in=vigentes)
+        )
+
+    firmas_ids = {
+        getattr(planilla, f"{campo}_id")
+        for planilla, (_, campos) in zip((pf, pe, pep), FIRMAS_PLANILLA)
+        if planilla
+        for campo in campos
+    }
+    firmas_ids |= {c.firma_control_calidad_id for c in controles.values()}
+    if materia:
+        firmas_ids.add(materia.firma_inspector_calidad_id)
+    firmas_ids.discard(None)
+    condicion = Q(pk__in=firmas_ids)
+    if pf:
+        condicion |= Q(planilla_fabricacion=pf.pk)
+    if pep:
+        condicion |= Q(planilla_envase_primario=pep.pk)
+    firmas = list(
+        RegistroFirma.objects.select_related("usuario__perfilusuario")
+        .filter(condicion).order_by("timestamp_firma", "id")
+    )
+
+    return {
+        "jarabe": JarabeSerializer(jarabe).data,
+        "producto": ProductoSerializer(jarabe.producto).data,
+        "planillas": {
+            "fabricacion": (
+                PlanillaFabricacionSerializer(pf).data if pf else None
+            ),
+            "envase": PlanillaEnvaseSerializer(pe).data if pe else None,
+            "envase_primario": (
+                PlanillaEnvasePrimarioSerializer(pep).data if pep else None
+            ),
+        },
+        "materiales": {
+            "materia_prima": (
+                MateriaPrimaSerializer(materia).data if materia else None
+            ),
+            "material_envase_primario": (
+                MaterialEnvasePrimarioSerializer(material_ep).data
+                if material_ep else None
+            ),
+        },
+        "controles_calidad": [
+            ControlCalidadSerializer(controles[pk]).data
+            for pk in sorted(controles)
+        ],
+        "firmas": [_firma(firma) for firma in firmas],
+    }
+
+
+def _firma(firma):
+    datos = RegistroFirmaSerializer(firma).data
+    perfil = getattr(firma.usuario, "perfilusuario", None)
+    datos["usuario_rol"] = perfil.rol if perfil else None
+    return datos
+
+
+# ===========================================================
+# INVALIDACIÓN
+# ===========================================================
+def _condicion(pares):
+    """Q de los jarabes con alguno de los pares, un __in por lookup."""
+    por_lookup = {}
+    for lookup, valor in pares:
+        por_lookup.setdefault(lookup, set()).add(valor)
+    condicion = Q()
+    for lookup in sorted(por_lookup):
+        filtro = {f"{lookup}__in": sorted(por_lookup[lookup])}
+        if "__" in lookup:
+            # cada camino con JOIN en su propia subconsulta: todos en un
+            # mismo SELECT multiplican las filas (firmas x controles x ...)
+            condicion |= Q(
+                pk__in=Jarabe.objects.filter(**filtro).values("pk")
+            )
+        else:
+            condicion |= Q(**filtro)
+    return condicion
+
+
+def invalidar(pares):
+    """
+    Sube la versión del dossier de los jarabes afectados al confirmar la
+    transacción en curso (un UPDATE por llamada; si se deshace el
+    savepoint donde se pidió, no corre).
+    """
+    if not pares:
+        return
+    transaction.on_commit(
+        partial(Jarabe.invalidar_dossieres, _condicion(pares))
+    )
+
+
+def _pares_firma(firma, eliminando):
+    pares = []
+    if firma.planilla_fabricacion_id:
+        pares.append(("planilla_fabricacion", firma.planilla_fabricacion_id))
+    if firma.planilla_envase_primario_id:
+        pares.append(
+            ("planilla_envase_primario", firma.planilla_envase_primario_id)
+        )
+    if eliminando:
+        # las referencias pasan a NULL con update(), sin señales
+        pares += [
+            (f"{campo_jarabe}__{campo}", firma.pk)
+            for campo_jarabe, campos in FIRMAS_PLANILLA
+            for campo in campos
+        ] + [
+            (f"{ruta}__firma_control_calidad", firma.pk)
+            for ruta in (
+                "planilla_fabricacion__control_calidad",
+                "planilla_envase_primario__control_calidad",
+            )
+        ] + [
+            ("planilla_fabricacion__materia_prima__firma_inspector_calidad",
+             firma.pk),
+        ]
+    return pares
+
+
+def _pares_control(control, eliminando):
+    pares = [
+        ("planilla_fabricacion__control_calidad", control.pk),
+        ("planilla_envase_primario__control_calidad", control.pk),
+    ]
+    # puede pasar a ser (o dejar de ser) el vigente de sus materiales
+    for campo, pk in control._materiales_relacionados():
+        if campo == "materia_prima":
+            pares.append(("planilla_fabricacion__materia_prima", pk))
+        elif campo == "material_envase_primario":
+            pares.append(
+                ("planilla_envase_primario__material_envase_primario", pk)
+            )
+    return pares
+
+
+# caminos desde el jarabe hasta cada firma del dossier (ver armar)
+RUTAS_FIRMA = (
+    "planilla_fabricacion__registrofirma",
+    "planilla_envase_primario__registrofirma",
+    *(
+        f"{campo_jarabe}__{campo}"
+        for campo_jarabe, campos in FIRMAS_PLANILLA
+        for campo in campos
+    ),
+    "planilla_fabricacion__materia_prima__firma_inspector_calidad",
+)
+# caminos hasta cada control de calidad del dossier
+RUTAS_CONTROL = (
+    "planilla_fabricacion__control_calidad",
+    "planilla_envase_primario__control_calidad",
+    "planilla_fabricacion__materia_prima__control_calidad_vigente",
+    "planilla_envase_primario__material_envase_primario"
+    "__control_calidad_vigente",
+)
+
+
+def _pares_firmante(usuario_id):
+    """Jarabes con alguna firma de ese usuario: su nombre y rol se muestran."""
+    return [
+        (f"{ruta}__usuario", usuario_id) for ruta in RUTAS_FIRMA
+    ] + [
+        (f"{ruta}__firma_control_calidad__usuario", usuario_id)
+        for ruta in RUTAS_CONTROL
+    ]
+
+
+def _pares_usuario(usuario, eliminando):
+    # también es el inspector que muestra cada control
+    return _pares_firmante(usuario.pk) + [
+        (f"{ruta}__inspector", usuario.pk) for ruta in RUTAS_CONTROL
+    ]
+
+
+PARES = {
+    Jarabe: lambda jarabe, eliminando: [("pk", jarabe.pk)],
+    Producto: lambda producto, eliminando: [("producto", producto.pk)],
+    UsuarioPersonalizado: _pares_usuario,
+    PerfilUsuario: lambda perfil, eliminando: _pares_firmante(
+        perfil.usuario_id
+    ),
+    PlanillaFabricacion: lambda planilla, eliminando: [
+        ("planilla_fabricacion", planilla.pk)
+    ],
+    PlanillaEnvase: lambda planilla, eliminando: [
+        ("planilla_envase", planilla.pk)
+    ],
+    PlanillaEnvasePrimario: lambda planilla, eliminando: [
+        ("planilla_envase_primario", planilla.pk)
+    ],
+    MateriaPrima: lambda materia, eliminando: [
+        ("planilla_fabricacion__materia_prima", materia.pk)
+    ],
+    MaterialEnvasePrimario: lambda material, eliminando: [
+        ("planilla_envase_primario__material_envase_primario", material.pk)
+    ],
+    ControlCalidad: _pares_control,
+    RegistroFirma: _pares_firma,
+}
+
+# un registro recién creado todavía no es parte de ningún dossier
+NUEVOS_SIN_DOSSIER = {
+    Jarabe, PlanillaFabricacion, PlanillaEnvase, PlanillaEnvasePrimario,
+    MateriaPrima, MaterialEnvasePrimario, Producto, UsuarioPersonalizado,
+}
+
+# campos que aparecen en el dossier, cuando no son todos: el login guarda
+# solo last_login y no toca ningún dossier
+CAMPOS_MOSTRADOS = {
+    UsuarioPersonalizado: {"first_name", "last_name", "rut"},
+    PerfilUsuario: {"rol", "usuario"},
+}
+
+
+def _al_guardar(sender, instance, created=False, raw=False,
+                update_fields=None, **kwargs):
+    if raw or (created and sender in NUEVOS_SIN_DOSSIER):
+        return
+    campos = CAMPOS_MOSTRADOS.get(sender)
+    if (
+        campos is not None and update_fields is not None
+        and not set(update_fields) & campos
+    ):
+        return
+    invalidar(PARES[sender](instance, False))
+
+
+def _al_eliminar(sender, instance, **kwargs):
+    # pre_delete: antes de que SET_NULL suelte a los jarabes
+    invalidar(PARES[sender](instance, True))
+
+
+def conectar():
+    for modelo in PARES:
+        post_save.connect(
+            _al_guardar, sender=modelo,
+            dispatch_uid=f"dossier-guardar-{modelo.__name__}",
+        )
+        pre_delete.connect(
+            _al_eliminar, sender=modelo,
+            dispatch_uid=f"dossier-eliminar-{modelo.__name__}",
+        )
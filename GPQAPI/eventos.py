@@ -0,0 +1,55 @@
+"""
+Registro estructurado de eventos.
+
+Cada línea de log sale como un objeto JSON con el id de correlación de la
+solicitud en curso (lo asigna CorrelacionMiddleware), de modo que una
+firma o una aprobación se puede seguir de punta a punta. Los mensajes
+usan el formato perezoso de logging ("... %s", valor): con el nivel
+apagado no se arma el texto ni se evalúan sus argumentos.
+"""
+import contextvars
+import json
+import logging
+import re
+import uuid
+
+id_correlacion = contextvars.ContextVar("id_correlacion", default="-")
+
+# atributos propios de LogRecord; el resto viene de `extra=`
+_ATRIBUTOS_RECORD = set(vars(logging.makeLogRecord({}))) | {
+    "message", "asctime", "id_correlacion",
+}
+
+_ID_VALIDO = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+def nuevo_id_correlacion(entrante=None):
+    """Usa el id recibido si es seguro de registrar; si no, genera uno."""
+    if entrante and _ID_VALIDO.match(entrante):
+        return entrante
+    return uuid.uuid4().hex
+
+
+class FiltroCorrelacion(logging.Filter):
+    def filter(self, record):
+        record.id_correlacion = id_correlacion.get()
+        return True
+
+
+class FormatoJSON(logging.Formatter):
+    def format(self, record):
+        datos = {
+            "timestamp": self.formatTime(record, "%Y-%m-%dT%H:%M:%S%z"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+            "id_correlacion": getattr(
+                record, "id_correlacion", id_correlacion.get()
+            ),
+        }
+        for clave, valor in vars(record).items():
+            if clave not in _ATRIBUTOS_RECORD:
+                datos[clave] = valor
+        if record.exc_info:
+            datos["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(datos, default=str, ensure_ascii=False)
@@ -0,0 +1,282 @@
+"""
+Exportación de planillas y firmas para auditoría, en CSV y XLSX.
+
+Las filas salen de una sola consulta (los firmantes se unen con JOIN en
+la misma consulta) que se recorre con iterator(chunk_size=...): el
+servidor nunca tiene más de un bloque de filas en memoria, y cada bloque
+se escribe y se entrega al StreamingHttpResponse antes de leer el
+siguiente, así que la memoria no crece con el rango de fechas.
+
+El XLSX se arma a mano con zipfile sobre una salida que no admite seek
+(un .xlsx es un zip con XML dentro): las celdas van como inlineStr, sin
+tabla de strings compartidos, para poder escribir la hoja de corrido.
+"""
+import csv
+import datetime
+import re
+import zipfile
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Concat
+
+from .models import RegistroFirma
+
+# filas que se leen de la base y se escriben por cada trozo entregado
+FILAS_POR_BLOQUE = 2000
+
+FORMATOS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    ),
+}
+
+
+# ===========================================================
+# COLUMNAS
+# ===========================================================
+def nombre_completo(ruta_usuario):
+    """Nombre y apellido del usuario, resueltos en la misma consulta."""
+    return Concat(
+        F(f"{ruta_usuario}__first_name"),
+        Value(" "),
+        F(f"{ruta_usuario}__last_name"),
+        output_field=CharField(),
+    )
+
+
+def columnas_firmantes():
+    columnas = []
+    for rol, campo in RegistroFirma.CAMPOS_FIRMA_PLANILLA.items():
+        rol = rol.lower()
+        columnas += [
+            (f"{rol}_nombre", nombre_completo(f"{campo}__usuario")),
+            (f"{rol}_rut", f"{campo}__usuario__rut"),
+            (f"{rol}_fecha", f"{campo}__timestamp_firma"),
+        ]
+    return columnas
+
+
+def columnas_planilla(campo_material, campo_codigo):
+    """Columnas comunes de las tres planillas con firmas."""
+    return [
+        ("id", "id"),
+        ("serie", "serie"),
+        ("numero_planilla", "numero_planilla"),
+        ("fecha_emision", "fecha_emision"),
+        ("fecha_vencimiento", "fecha_vencimiento"),
+        ("producto", "producto__nombre"),
+        ("tipo_producto", "tipo_producto__nombre"),
+        ("material", f"{campo_material}__nombre"),
+        ("material_codigo", f"{campo_material}__{campo_codigo}"),
+        ("control_calidad", "control_calidad__codigo_control_calidad"),
+        ("tipo_movimiento", "tipo_movimiento"),
+        ("cantidad_estuches", "cantidad_estuches"),
+        ("cantidad_entregada", "cantidad_entregada"),
+        ("estado_aprobacion", "estado_aprobacion"),
+        ("usuario_creacion", "usuario_creacion"),
+        ("fecha_creacion", "fecha_creacion"),
+    ] + columnas_firmantes()
+
+
+COLUMNAS_PLANILLA_FABRICACION = columnas_planilla("materia_prima", "batch")
+COLUMNAS_PLANILLA_ENVASE_PRIMARIO = columnas_planilla(
+    "material_envase_primario", "codigo"
+)
+COLUMNAS_PLANILLA_ENVASE_SECUNDARIO = columnas_planilla(
+    "material_envase_secundario_empaque", "codigo"
+)
+
+COLUMNAS_REGISTRO_FIRMA = [
+    ("id", "id"),
+    ("tipo_firma", "tipo_firma"),
+    ("usuario_nombre", nombre_completo("usuario")),
+    ("usuario_rut", "usuario__rut"),
+    ("timestamp_firma", "timestamp_firma"),
+    ("codigo_verificacion", "codigo_verificacion"),
+    ("firma_hash", "firma_hash"),
+    ("planilla_fabricacion", "planilla_fabricacion_id"),
+    ("planilla_envase_primario", "planilla_envase_primario_id"),
+    (
+        "planilla_envase_secundario_empaque",
+        "planilla_envase_secundario_empaque_id",
+    ),
+    ("sesion_firma", "sesion_firma_id"),
+    ("ip_address", "ip_address"),
+]
+
+
+def filas(queryset, columnas, bloque=FILAS_POR_BLOQUE):
+    """Tuplas de valores en el orden de columnas, leídas por bloques."""
+    return queryset.values_list(
+        *(expresion for _, expresion in columnas)
+    ).iterator(chunk_size=bloque)
+
+
+def _texto(valor):
+    if valor is None:
+        return ""
+    if isinstance(valor, (datetime.datetime, datetime.date)):
+        return valor.isoformat()
+    if isinstance(valor, str):
+        # nombre_completo deja " " cuando no hay firmante
+        return valor.strip()
+    return str(valor)
+
+
+def _agrupar(filas_, bloque):
+    grupo = []
+    for fila in filas_:
+        grupo.append(fila)
+        if len(grupo) >= bloque:
+            yield grupo
+            grupo = []
+    if grupo:
+        yield grupo
+
+
+# ===========================================================
+# CSV
+# ===========================================================
+class _Linea:
+    """Destino de csv.writer que devuelve lo escrito en vez de guardarlo."""
+
+    def write(self, texto):
+        return texto
+
+
+def generar_csv(encabezados, filas_, bloque=FILAS_POR_BLOQUE):
+    escritor = csv.writer(_Linea())
+    # BOM para que Excel detecte UTF-8 al abrir el archivo
+    yield ("\ufeff" + escritor.writerow(encabezados)).encode("utf-8")
+    for grupo in _agrupar(filas_, bloque):
+        yield "".join(
+            escritor.writerow([_texto(v) for v in fila]) for fila in grupo
+        ).encode("utf-8")
+
+
+# ===========================================================
+# XLSX
+# ===========================================================
+_XML = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+_CONTENT_TYPES = _XML + (
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'content-types">'
+    '<Default Extension="rels" ContentType="application/'
+    'vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType='
+    '"application/vnd.openxmlformats-officedocument.spreadsheetml.'
+    'worksheet+xml"/>'
+    '</Types>'
+)
+
+_RELS = _XML + (
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+    'officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK = _XML + (
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+    '2006/main" xmlns:r="http://schemas.openxmlformats.org/'
+    'officeDocument/2006/relationships">'
+    '<sheets><sheet name="{hoja}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_WORKBOOK_RELS = _XML + (
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+    'officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+_HOJA_INICIO = _XML + (
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+    '2006/main"><sheetData>'
+)
+_HOJA_FIN = "</sheetData></worksheet>"
+
+# caracteres de control que XML 1.0 no admite
+_INVALIDOS_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _celda(valor):
+    if isinstance(valor, bool):
+        valor = "SI" if valor else "NO"
+    if isinstance(valor, (int, float, Decimal)):
+        return f"<c><v>{valor}</v></c>"
+    texto = _INVALIDOS_XML.sub("", _texto(valor))
+    return (
+        '<c t="inlineStr"><is><t xml:space="preserve">'
+        f"{escape(texto)}</t></is></c>"
+    )
+
+
+def _fila_xml(valores):
+    return "<row>" + "".join(_celda(v) for v in valores) + "</row>"
+
+
+class _Salida:
+    """Archivo de solo escritura, sin seek, que acumula hasta vaciarse."""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b"".join(self._partes)
+        self._partes = []
+        return datos
+
+
+def generar_xlsx(encabezados, filas_, hoja="Datos",
+                 bloque=FILAS_POR_BLOQUE):
+    salida = _Salida()
+    # sin seek, zipfile escribe los tamaños en un descriptor al final de
+    # cada entrada en vez de volver a la cabecera
+    with zipfile.ZipFile(salida, "w", zipfile.ZIP_DEFLATED) as libro:
+        libro.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        libro.writestr("_rels/.rels", _RELS)
+        libro.writestr("xl/workbook.xml", _WORKBOOK.format(hoja=escape(hoja)))
+        libro.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        with libro.open(
+            "xl/worksheets/sheet1.xml", "w", force_zip64=True
+        ) as hoja_xml:
+            hoja_xml.write(
+                (_HOJA_INICIO + _fila_xml(encabezados)).encode("utf-8")
+            )
+            for grupo in _agrupar(filas_, bloque):
+                hoja_xml.write(
+                    "".join(_fila_xml(fila) for fila in grupo).encode("utf-8")
+                )
+                yield salida.vaciar()
+            hoja_xml.write(_HOJA_FIN.encode("utf-8"))
+    yield salida.vaciar()
+
+
+def generar(formato, columnas, queryset, hoja="Datos",
+            bloque=FILAS_POR_BLOQUE):
+    """Trozos de bytes del archivo en el formato pedido."""
+    encabezados = [encabezado for encabezado, _ in columnas]
+    filas_ = filas(queryset, columnas, bloque)
+    if formato == "xlsx":
+        return generar_xlsx(encabezados, filas_, hoja=hoja, bloque=bloque)
+    return generar_csv(encabezados, filas_, bloque=bloque)
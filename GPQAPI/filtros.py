@@ -0,0 +1,248 @@
+"""
+Filtros y orden declarativos para los viewsets, solo sobre campos con
+índice.
+
+Cada viewset declara los parámetros que acepta:
+
+    filtros = {
+        # ?estado=EN_PROCESO  (varios valores separados por coma)
+        "estado": Exacto("estado_aprobacion"),
+        # ?fecha_emision_desde=2025-01-01&fecha_emision_hasta=2025-01-31
+        "fecha_emision": Rango("fecha_emision"),
+        # ?firmado_jefe_seccion=true|false
+        "firmado_jefe_seccion": Presente("firma_jefe_seccion"),
+    }
+    # ?ordering=-fecha_emision
+    ordenamientos = ("fecha_creacion", "fecha_emision")
+
+El orden agrega id en el mismo sentido, que es como están armados los
+índices compuestos (campo, id). Sin ?ordering= la paginación por cursor
+usa su propio orden y el resto de los listados ordena por id, para que
+las páginas sean estables.
+
+revisar_filtros (un system check) rechaza al iniciar cualquier filtro u
+orden cuyo campo no encabece un índice completo de la tabla: así cada
+listado filtrado es una sola consulta resuelta con un índice.
+"""
+import datetime
+
+from django.core import checks
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import models
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
+
+VERDADEROS = {"true", "1", "si"}
+FALSOS = {"false", "0", "no"}
+
+
+def filtrar_rango(queryset, campo, desde, hasta):
+    """
+    desde/hasta son fechas inclusivas. Sobre un DateTimeField se toman
+    días completos en la zona horaria del sitio, sin __date, para que la
+    consulta use el índice del campo.
+    """
+    campo_modelo = queryset.model._meta.get_field(campo)
+    if isinstance(campo_modelo, models.DateTimeField):
+        if desde:
+            queryset = queryset.filter(**{
+                f"{campo}__gte": timezone.make_aware(
+                    datetime.datetime.combine(desde, datetime.time.min)
+                )
+            })
+        if hasta:
+            queryset = queryset.filter(**{
+                f"{campo}__lt": timezone.make_aware(
+                    datetime.datetime.combine(
+                        hasta + datetime.timedelta(days=1),
+                        datetime.time.min,
+                    )
+                )
+            })
+        return queryset
+    if desde:
+        queryset = queryset.filter(**{f"{campo}__gte": desde})
+    if hasta:
+        queryset = queryset.filter(**{f"{campo}__lte": hasta})
+    return queryset
+
+
+# ===========================================================
+# FILTROS
+# ===========================================================
+class Filtro:
+    def __init__(self, campo):
+        self.campo = campo
+
+    def parametros(self, nombre):
+        """Parámetros de la query string que lee este filtro."""
+        return [nombre]
+
+    def aplicar(self, queryset, nombre, query_params):
+        raise NotImplementedError
+
+
+class Exacto(Filtro):
+    """?nombre=valor o ?nombre=v1,v2 (IN)."""
+
+    def convertir(self, queryset, nombre, texto):
+        campo = queryset.model._meta.get_field(self.campo)
+        try:
+            valor = campo.to_python(texto)
+        except DjangoValidationError as exc:
+            raise ValidationError({nombre: exc.messages})
+        if campo.choices and valor not in dict(campo.flatchoices):
+            raise ValidationError(
+                {nombre: [f"Valor no válido: {texto}."]}
+            )
+        return valor
+
+    def aplicar(self, queryset, nombre, query_params):
+        texto = query_params.get(nombre)
+        if not texto:
+            return queryset
+        valores = [
+            self.convertir(queryset, nombre, v.strip())
+            for v in texto.split(",") if v.strip()
+        ]
+        if len(valores) == 1:
+            return queryset.filter(**{self.campo: valores[0]})
+        return queryset.filter(**{f"{self.campo}__in": valores})
+
+
+class Rango(Filtro):
+    """?nombre_desde=AAAA-MM-DD&nombre_hasta=AAAA-MM-DD (inclusivas)."""
+
+    def parametros(self, nombre):
+        return [f"{nombre}_desde", f"{nombre}_hasta"]
+
+    def aplicar(self, queryset, nombre, query_params):
+        fechas = []
+        for parametro in self.parametros(nombre):
+            texto = query_params.get(parametro)
+            fecha = None
+            if texto:
+                try:
+                    fecha = parse_date(texto)
+                except ValueError:
+                    pass
+                if fecha is None:
+                    raise ValidationError(
+                        {parametro: ["Use el formato AAAA-MM-DD."]}
+                    )
+            fechas.append(fecha)
+        desde, hasta = fechas
+        if desde and hasta and hasta < desde:
+            raise ValidationError(
+                {f"{nombre}_hasta": ["No puede ser anterior a desde."]}
+            )
+        return filtrar_rango(queryset, self.campo, desde, hasta)
+
+
+class Presente(Filtro):
+    """?nombre=true|false: el campo (una firma, por ejemplo) tiene valor."""
+
+    def aplicar(self, queryset, nombre, query_params):
+        texto = query_params.get(nombre)
+        if not texto:
+            return queryset
+        texto = texto.strip().lower()
+        if texto not in VERDADEROS | FALSOS:
+            raise ValidationError({nombre: ["Use true o false."]})
+        return queryset.filter(
+            **{f"{self.campo}__isnull": texto in FALSOS}
+        )
+
+
+# ===========================================================
+# BACKEND
+# ===========================================================
+class FiltroIndexado(BaseFilterBackend):
+    """Aplica view.filtros y ?ordering= sobre view.ordenamientos."""
+
+    ordering_param = api_settings.ORDERING_PARAM
+
+    def get_ordering(self, request, queryset, view):
+        # CursorPagination la consulta para armar su cursor
+        texto = request.query_params.get(self.ordering_param)
+        if not texto:
+            return None
+        campo = texto.strip()
+        signo = "-" if campo.startswith("-") else ""
+        campo = campo.lstrip("-")
+        permitidos = getattr(view, "ordenamientos", ())
+        if campo not in permitidos:
+            raise ValidationError({
+                self.ordering_param: [
+                    f"Orden no permitido: {texto}. Opciones: "
+                    f"{', '.join(permitidos) or 'ninguna'}."
+                ]
+            })
+        if campo == "id":
+            return (f"{signo}id",)
+        return (f"{signo}{campo}", f"{signo}id")
+
+    def filter_queryset(self, request, queryset, view):
+        for nombre, filtro in getattr(view, "filtros", {}).items():
+            queryset = filtro.aplicar(queryset, nombre, request.query_params)
+        orden = self.get_ordering(request, queryset, view)
+        if orden:
+            return queryset.order_by(*orden)
+        if not queryset.ordered:
+            return queryset.order_by("id")
+        return queryset
+
+
+# ===========================================================
+# SYSTEM CHECK
+# ===========================================================
+def campos_indexados(modelo):
+    """Campos que encabezan algún índice completo (no parcial) del modelo."""
+    opts = modelo._meta
+    campos = {opts.pk.name}
+    for campo in opts.concrete_fields:
+        if campo.unique or campo.db_index:
+            campos.add(campo.name)
+    for indice in opts.indexes:
+        if indice.condition is None and indice.fields:
+            campos.add(indice.fields[0].lstrip("-"))
+    for grupo in opts.unique_together:
+        campos.add(grupo[0])
+    for restriccion in opts.constraints:
+        if (
+            isinstance(restriccion, models.UniqueConstraint)
+            and restriccion.condition is None
+            and restriccion.fields
+        ):
+            campos.add(restriccion.fields[0])
+    return campos
+
+
+def revisar_filtros(app_configs=None, **kwargs):
+    from .urls import router
+
+    errores = []
+    for prefijo, viewset, _ in router.registry:
+        modelo = viewset.queryset.model
+        indexados = campos_indexados(modelo)
+        declarados = [
+            (f"filtro {nombre}", filtro.campo)
+            for nombre, filtro in getattr(viewset, "filtros", {}).items()
+        ] + [
+            (f"orden {campo}", campo)
+            for campo in getattr(viewset, "ordenamientos", ())
+        ]
+        for descripcion, campo in declarados:
+            if campo not in indexados:
+                errores.append(checks.Error(
+                    f"{viewset.__name__}: {descripcion} usa "
+                    f"{modelo.__name__}.{campo}, que no encabeza ningún "
+                    f"índice.",
+                    hint="Agregue el índice o quite el filtro.",
+                    obj=viewset,
+                    id="GPQAPI.E001",
+                ))
+    return errores
@@ -0,0 +1,149 @@
+"""
+Importación masiva de materias primas desde el CSV de recepción.
+
+Columnas: nombre, batch, cantidad (con encabezado; el orden no importa y
+las columnas extra se ignoran). Primero se validan todas las filas: si
+alguna tiene errores no se inserta nada y el reporte indica la fila del
+archivo y el motivo. Si todas son válidas, las materias primas, su stock
+en la bodega principal MP y la ENTRADA de cada una en el libro de
+movimientos se insertan con bulk_create en una sola transacción, igual
+que dejaría un POST por fila a /api/materias-primas/.
+
+Un batch que ya existe, o que se repite en el archivo, es un error: así
+reimportar el mismo archivo no duplica el stock.
+"""
+import csv
+from collections import Counter
+
+from django.db import transaction
+
+from . import busqueda, tablero
+from .models import Bodega, MateriaPrima, MovimientoStock, StockMateriaPrima
+from .serializers import ImportacionMateriaPrimaSerializer
+
+COLUMNAS_MATERIA_PRIMA = ("nombre", "batch", "cantidad")
+
+# filas por INSERT (y batches por consulta de duplicados)
+LOTE_INSERCION = 1000
+
+
+def _leer(lineas):
+    """(número de fila del archivo, dict) de cada fila no vacía."""
+    lector = csv.DictReader(lineas)
+    faltantes = [
+        c for c in COLUMNAS_MATERIA_PRIMA if c not in (lector.fieldnames or ())
+    ]
+    if faltantes:
+        return None, {
+            "columnas": [f"Faltan columnas: {', '.join(faltantes)}."]
+        }
+    filas = []
+    for fila in lector:
+        valores = {
+            c: (fila.get(c) or "").strip() for c in COLUMNAS_MATERIA_PRIMA
+        }
+        if any(valores.values()):
+            filas.append((lector.line_num, valores))
+    if not filas:
+        return None, {"archivo": ["El archivo no tiene filas."]}
+    return filas, None
+
+
+def importar_materias_primas(lineas, usuario=""):
+    """
+    Valida e importa el CSV. `lineas` es un iterable de líneas de texto
+    (un archivo abierto con newline="", o codecs.iterdecode sobre un
+    archivo subido). Devuelve el reporte
+
+        {"filas": n, "importadas": n,
+         "errores": [{"fila": 3, "errores": {"cantidad": [...]}}]}
+    """
+    try:
+        filas, error = _leer(lineas)
+    except (UnicodeDecodeError, csv.Error) as exc:
+        filas, error = None, {"archivo": [f"CSV ilegible: {exc}"]}
+    if error:
+        return {"filas": 0, "importadas": 0,
+                "errores": [{"fila": 1, "errores": error}]}
+
+    serializer = ImportacionMateriaPrimaSerializer(
+        data=[valores for _, valores in filas], many=True
+    )
+    errores_por_fila = {}
+    if not serializer.is_valid():
+        errores = serializer.errors
+        # según la versión de DRF: lista alineada o dict por índice
+        if not isinstance(errores, dict):
+            errores = dict(enumerate(errores))
+        for indice, errores_fila in errores.items():
+            if errores_fila:
+                errores_por_fila[filas[indice][0]] = dict(errores_fila)
+
+    # batch repetido en el archivo o ya registrado (mp_batch_idx)
+    batches = Counter(valores["batch"] for _, valores in filas)
+    batches.pop("", None)
+    pendientes = list(batches)
+    existentes = set()
+    for inicio in range(0, len(pendientes), LOTE_INSERCION):
+        existentes.update(
+            MateriaPrima.objects.filter(
+                batch__in=pendientes[inicio:inicio + LOTE_INSERCION]
+            ).values_list("batch", flat=True)
+        )
+    for numero, valores in filas:
+        batch = valores["batch"]
+        if not batch:
+            continue
+        if batch in existentes:
+            motivo = "Ya existe una materia prima con este batch."
+        elif batches[batch] > 1:
+            motivo = "El batch se repite en el archivo."
+        else:
+            continue
+        errores_por_fila.setdefault(numero, {}).setdefault(
+            "batch", []
+        ).append(motivo)
+
+    if errores_por_fila:
+        return {
+            "filas": len(filas),
+            "importadas": 0,
+            "errores": [
+                {"fila": numero, "errores": errores}
+                for numero, errores in sorted(errores_por_fila.items())
+            ],
+        }
+
+    with transaction.atomic():
+        materias = MateriaPrima.objects.bulk_create(
+            [MateriaPrima(**datos) for datos in serializer.validated_data],
+            batch_size=LOTE_INSERCION,
+        )
+        # bulk_create no emite post_save
+        busqueda.indexar(materias)
+        bodega = Bodega.principal("MP")
+        StockMateriaPrima.objects.bulk_create(
+            [
+                StockMateriaPrima(
+                    bodega=bodega, materia_prima=materia,
+                    cantidad_disponible=materia.cantidad,
+                )
+                for materia in materias
+            ],
+            batch_size=LOTE_INSERCION,
+        )
+        # el saldo de cada stock sigue siendo la suma de sus movimientos
+        MovimientoStock.objects.bulk_create(
+            [
+                MovimientoStock(
+                    tipo="ENTRADA", bodega=bodega, materia_prima=materia,
+                    cantidad=materia.cantidad,
+                    referencia=f"MateriaPrima:{materia.id}",
+                    usuario=usuario,
+                )
+                for materia in materias
+            ],
+            batch_size=LOTE_INSERCION,
+        )
+        tablero.invalidar(["materiales", "stock"])
+    return {"filas": len(filas), "importadas": len(materias), "errores": []}
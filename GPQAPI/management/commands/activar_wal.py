@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Pasa la base SQLite a journal_mode=WAL. Se corre una vez por "
+        "archivo (al desplegar): el modo queda guardado en la cabecera "
+        "del archivo y vale para todas las conexiones siguientes, que "
+        "pasan además a synchronous=NORMAL (ver GPQ/basedatos.py)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", default="default",
+            help="Alias de la base en DATABASES (por defecto: default).",
+        )
+
+    def handle(self, *args, **opciones):
+        conexion = connections[opciones["database"]]
+        if conexion.vendor != "sqlite":
+            raise CommandError("journal_mode solo aplica al perfil sqlite.")
+        with conexion.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            modo = cursor.fetchone()[0]
+        if modo.lower() != "wal":
+            raise CommandError(f"SQLite quedó en journal_mode={modo}.")
+        self.stdout.write(self.style.SUCCESS("journal_mode=wal"))
@@ -0,0 +1,459 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from GPQAPI import busqueda
+from GPQAPI.models import (
+    UsuarioPersonalizado,
+    PerfilUsuario,
+    RegistroFirma,
+    TipoProducto,
+    Producto,
+    MateriaPrima,
+    MaterialEnvasePrimario,
+    MaterialEnvaseSecundarioEmpaque,
+    ControlCalidad,
+    PlanillaFabricacion,
+    PlanillaEnvase,
+    PlanillaEnvasePrimario,
+    PlanillaEnvaseSecundarioEmpaque,
+    Jarabe,
+    Bodega,
+    StockMateriaPrima,
+    StockMaterialEnvasePrimario,
+    StockMaterialEnvaseSecundarioEmpaque,
+    MovimientoStock,
+    SecuenciaCodigo,
+)
+
+ROLES_PLANILLA = ["JEFE_SECCION", "JEFE_PRODUCCION", "QUIMICO_FARMACEUTICO"]
+ROLES = ROLES_PLANILLA + ["INSPECTOR_CALIDAD"]
+
+# (campo en RegistroFirma / stock, modelo, prefijo de secuencia, bodega)
+MATERIALES = [
+    ("materia_prima", MateriaPrima, None, "MP"),
+    ("material_envase_primario", MaterialEnvasePrimario, "MEP", "EP"),
+    (
+        "material_envase_secundario_empaque",
+        MaterialEnvaseSecundarioEmpaque, "MES", "ES",
+    ),
+]
+
+# (campo en RegistroFirma, modelo, campo del material)
+PLANILLAS = [
+    ("planilla_fabricacion", PlanillaFabricacion, "materia_prima"),
+    (
+        "planilla_envase_primario", PlanillaEnvasePrimario,
+        "material_envase_primario",
+    ),
+    (
+        "planilla_envase_secundario_empaque",
+        PlanillaEnvaseSecundarioEmpaque,
+        "material_envase_secundario_empaque",
+    ),
+]
+
+STOCKS = {
+    "materia_prima": StockMateriaPrima,
+    "material_envase_primario": StockMaterialEnvasePrimario,
+    "material_envase_secundario_empaque": StockMaterialEnvaseSecundarioEmpaque,
+}
+
+PASSWORD_FIRMANTES = "firmante-sintetico"
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera un set de datos sintético y consistente (productos, "
+        "materiales con control de calidad y stock, planillas firmadas, "
+        "jarabes) con inserciones masivas. Con la misma --semilla sobre "
+        "una base vacía el resultado es idéntico."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--escala", type=int, default=1000,
+            help="Materiales y planillas por tipo (por defecto 1000).",
+        )
+        parser.add_argument("--productos", type=int)
+        parser.add_argument("--materiales", type=int)
+        parser.add_argument("--planillas", type=int)
+        parser.add_argument("--jarabes", type=int)
+        parser.add_argument(
+            "--firmantes", type=int, default=3,
+            help="Usuarios por rol (por defecto 3).",
+        )
+        parser.add_argument(
+            "--aprobadas", type=float, default=0.8,
+            help="Fracción de planillas con las tres firmas.",
+        )
+        parser.add_argument(
+            "--cc-aprobados", type=float, default=0.9,
+            help="Fracción de controles de calidad firmados.",
+        )
+        parser.add_argument("--semilla", type=int, default=0)
+        parser.add_argument(
+            "--lote", type=int, default=2000,
+            help="Filas por INSERT masivo.",
+        )
+        parser.add_argument(
+            "--prefijo",
+            help="Prefijo de nombres y códigos (por defecto S<semilla>).",
+        )
+
+    def handle(self, *args, **opciones):
+        escala = opciones["escala"]
+        self.rng = random.Random(opciones["semilla"])
+        self.lote = opciones["lote"]
+        self.prefijo = opciones["prefijo"] or f"S{opciones['semilla']}"
+        self.hoy = datetime.date(2025, 1, 1)
+        self.ahora = timezone.now()
+
+        n_productos = opciones["productos"] or max(escala // 10, 1)
+        n_materiales = opciones["materiales"] or escala
+        n_planillas = opciones["planillas"] or escala
+        n_jarabes = min(opciones["jarabes"] or n_planillas, n_planillas)
+
+        if TipoProducto.objects.filter(
+            nombre__startswith=f"{self.prefijo} "
+        ).exists():
+            raise CommandError(
+                f"Ya hay datos con el prefijo {self.prefijo}; use otra "
+                "--semilla o --prefijo."
+            )
+
+        inicio = time.perf_counter()
+        with transaction.atomic():
+            firmantes = self._firmantes(opciones["firmantes"])
+            tipos, productos = self._productos(n_productos)
+            materiales = {
+                campo: self._materiales(
+                    campo, modelo, secuencia, tipo_bodega, n_materiales,
+                    productos, firmantes["INSPECTOR_CALIDAD"],
+                    opciones["cc_aprobados"],
+                )
+                for campo, modelo, secuencia, tipo_bodega in MATERIALES
+            }
+            planillas = {
+                campo: self._planillas(
+                    campo, modelo, materiales[campo_material], n_planillas,
+                    tipos, productos, firmantes, opciones["aprobadas"],
+                )
+                for campo, modelo, campo_material in PLANILLAS
+            }
+            self._jarabes(n_jarabes, productos, tipos, planillas)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Datos generados con prefijo {self.prefijo} en "
+            f"{time.perf_counter() - inicio:.1f} s"
+        ))
+
+    # ---------------------------------------------------------
+    # Utilidades
+    # ---------------------------------------------------------
+    def _crear(self, modelo, objetos):
+        objetos = modelo.objects.bulk_create(objetos, batch_size=self.lote)
+        # bulk_create no emite post_save
+        if modelo.__name__ in busqueda.FUENTE_POR_MODELO:
+            busqueda.indexar(objetos)
+        return objetos
+
+    def _bloques(self, total):
+        for desde in range(0, total, self.lote):
+            yield range(desde, min(desde + self.lote, total))
+
+    def _hash(self):
+        return "%064x" % self.rng.getrandbits(256)
+
+    def _codigo(self):
+        return "%06d" % self.rng.randrange(10 ** 6)
+
+    def _firma(self, usuario, tipo_firma, **planilla):
+        return RegistroFirma(
+            usuario=usuario,
+            tipo_firma=tipo_firma,
+            firma_hash=self._hash(),
+            codigo_verificacion=self._codigo(),
+            **planilla,
+        )
+
+    def _cantidad(self, minimo, maximo):
+        return Decimal(self.rng.randrange(minimo * 100, maximo * 100)) / 100
+
+    def _informar(self, texto, cantidad):
+        self.stdout.write(f"  {texto}: {cantidad}")
+
+    # ---------------------------------------------------------
+    # Usuarios, productos y bodegas
+    # ---------------------------------------------------------
+    def _firmantes(self, por_rol):
+        password = make_password(PASSWORD_FIRMANTES)
+        # RUT ficticio con dígito verificador "S", correlativo a los
+        # firmantes sintéticos que ya existan
+        base = UsuarioPersonalizado.objects.filter(
+            rut__endswith="-S"
+        ).count()
+        usuarios = []
+        for i, (rol, j) in enumerate(
+            (rol, j) for rol in ROLES for j in range(por_rol)
+        ):
+            usuarios.append(UsuarioPersonalizado(
+                username=f"{self.prefijo}-{rol.lower()}-{j}",
+                rut=f"{base + i:08d}-S",
+                first_name="Firmante",
+                last_name=rol.title(),
+                password=password,
+            ))
+        usuarios = self._crear(UsuarioPersonalizado, usuarios)
+        self._crear(PerfilUsuario, [
+            PerfilUsuario(usuario=u, rol=ROLES[i // por_rol])
+            for i, u in enumerate(usuarios)
+        ])
+        self._informar("firmantes", len(usuarios))
+        return {
+            rol: usuarios[i * por_rol:(i + 1) * por_rol]
+            for i, rol in enumerate(ROLES)
+        }
+
+    def _productos(self, n):
+        tipos = self._crear(TipoProducto, [
+            TipoProducto(
+                nombre=f"{self.prefijo} {nombre}", descripcion=nombre
+            )
+            for nombre in ("Jarabe", "Suspensión", "Solución", "Gotas")
+        ])
+        productos = self._crear(Producto, [
+            Producto(
+                nombre=f"{self.prefijo} Producto {i}",
+                cantidad_teorica=100,
+                cantidad_real=self._cantidad(90, 100),
+                rendimiento=self._cantidad(90, 100),
+                fecha_emision=self.hoy,
+                fecha_vencimiento=self.hoy + datetime.timedelta(days=730),
+            )
+            for i in range(n)
+        ])
+        self._informar("productos", len(productos))
+        return tipos, productos
+
+    # ---------------------------------------------------------
+    # Materiales, control de calidad y stock
+    # ---------------------------------------------------------
+    def _materiales(self, campo, modelo, secuencia, tipo_bodega, n,
+                    productos, inspectores, fraccion_aprobados):
+        """
+        Crea los materiales con su control de calidad (firmado o no),
+        el stock en la bodega principal y el saldo inicial en el libro.
+        Devuelve los materiales aprobados, que usan las planillas.
+        """
+        bodega = Bodega.principal(tipo_bodega)
+        aprobados = []
+        for bloque in self._bloques(n):
+            firmado = [
+                self.rng.random() < fraccion_aprobados for _ in bloque
+            ]
+            inspector = [self.rng.choice(inspectores) for _ in bloque]
+            firmas = self._crear(RegistroFirma, [
+                self._firma(inspector[k], "INSPECTOR_CALIDAD")
+                for k in range(len(bloque)) if firmado[k]
+            ])
+            firma_de = iter(firmas)
+            firma = [next(firma_de) if f else None for f in firmado]
+
+            estado = {
+                "estado_aprobacion": "APROBADO",
+                "control_calidad": True,
+            }
+            pendiente = {
+                "estado_aprobacion": "PENDIENTE",
+                "control_calidad": False,
+            }
+            if secuencia is None:
+                objetos = [
+                    MateriaPrima(
+                        nombre=f"{self.prefijo} Materia {i}",
+                        cantidad=self._cantidad(100, 5000),
+                        batch=f"{self.prefijo}-MP-{i:07d}",
+                        firma_inspector_calidad=firma[k],
+                        **(estado if firma[k] else pendiente),
+                    )
+                    for k, i in enumerate(bloque)
+                ]
+            else:
+                codigos = SecuenciaCodigo.reservar(secuencia, len(bloque))
+                objetos = [
+                    modelo(
+                        codigo=f"{self.prefijo}-{secuencia}-{i:07d}",
+                        nombre=f"{self.prefijo} {modelo._meta.verbose_name} {i}",
+                        tipo_envase=self.rng.choice(
+                            ["Frasco", "Tapa", "Caja", "Etiqueta"]
+                        ),
+                        codigo_calidad=codigos[k],
+                        **(estado if firma[k] else pendiente),
+                    )
+                    for k, i in enumerate(bloque)
+                ]
+            objetos = self._crear(modelo, objetos)
+
+            codigos_cc = SecuenciaCodigo.reservar("CC", len(bloque))
+            controles = self._crear(ControlCalidad, [
+                ControlCalidad(
+                    codigo_control_calidad=codigos_cc[k],
+                    resultado="Conforme" if firma[k] else "En análisis",
+                    fecha_verificacion=self.hoy,
+                    aprobado=firma[k] is not None,
+                    producto=self.rng.choice(productos),
+                    inspector=inspector[k],
+                    firma_control_calidad=firma[k],
+                    **{campo: material},
+                )
+                for k, material in enumerate(objetos)
+            ])
+            # bulk_create no pasa por ControlCalidad.save: el control
+            # vigente se asigna con un UPDATE por bloque
+            modelo.objects.filter(
+                pk__gte=objetos[0].pk, pk__lte=objetos[-1].pk
+            ).update(control_calidad_vigente=Subquery(
+                ControlCalidad.objects.filter(
+                    aprobado=True, **{campo: OuterRef("pk")}
+                ).order_by("-fecha_verificacion", "-id").values("pk")[:1]
+            ))
+
+            saldos = [self._cantidad(500, 5000) for _ in objetos]
+            self._crear(STOCKS[campo], [
+                STOCKS[campo](
+                    bodega=bodega, cantidad_disponible=saldo,
+                    **{campo: material},
+                )
+                for material, saldo in zip(objetos, saldos)
+            ])
+            self._crear(MovimientoStock, [
+                MovimientoStock(
+                    tipo="AJUSTE", bodega=bodega, cantidad=saldo,
+                    referencia="Saldo inicial", usuario="generar_datos",
+                    **{campo: material},
+                )
+                for material, saldo in zip(objetos, saldos)
+            ])
+
+            aprobados.extend(
+                (material, control)
+                for material, control, f in zip(objetos, controles, firma)
+                if f
+            )
+        self._informar(f"{campo} (aprobados)", f"{n} ({len(aprobados)})")
+        return aprobados
+
+    # ---------------------------------------------------------
+    # Planillas y jarabes
+    # ---------------------------------------------------------
+    def _planillas(self, campo, modelo, materiales, n, tipos, productos,
+                   firmantes, fraccion_aprobadas):
+        """
+        Crea las planillas y luego sus firmas (que apuntan a la planilla).
+        Una fracción queda APROBADA con las tres firmas; del resto, la
+        mitad tiene firmas parciales. Los campos firma_* se enlazan con un
+        UPDATE por bloque que toma cada firma con una subconsulta, en vez
+        de un bulk_update con un CASE por fila.
+        """
+        if not materiales:
+            raise CommandError(f"No hay materiales aprobados para {campo}")
+
+        campo_material = dict((c, m) for c, _, m in PLANILLAS)[campo]
+        serie = "".join(p[0] for p in campo.split("_")).upper()
+        enlazar = {
+            campo_firma: Subquery(
+                RegistroFirma.objects.filter(
+                    tipo_firma=rol, **{campo: OuterRef("pk")}
+                ).values("pk")[:1]
+            )
+            for rol, campo_firma in RegistroFirma.CAMPOS_FIRMA_PLANILLA.items()
+        }
+        creadas = []
+        for bloque in self._bloques(n):
+            objetos, roles = [], []
+            for i in bloque:
+                material, control = self.rng.choice(materiales)
+                sorteo = self.rng.random()
+                if sorteo < fraccion_aprobadas:
+                    roles.append(ROLES_PLANILLA)
+                elif sorteo < (1 + fraccion_aprobadas) / 2:
+                    roles.append(ROLES_PLANILLA[:self.rng.randrange(1, 3)])
+                else:
+                    roles.append([])
+                objetos.append(modelo(
+                    producto=self.rng.choice(productos),
+                    tipo_producto=self.rng.choice(tipos),
+                    serie=f"{self.prefijo}-{serie}",
+                    numero_planilla=str(i),
+                    fecha_emision=self.hoy,
+                    fecha_vencimiento=self.hoy + datetime.timedelta(days=730),
+                    control_calidad=control,
+                    rendimiento_teorico=100,
+                    periodo_eficacia=24,
+                    cantidad_estuches=self.rng.randrange(10, 500),
+                    estado_aprobacion=(
+                        "APROBADO" if len(roles[-1]) == len(ROLES_PLANILLA)
+                        else "EN_PROCESO"
+                    ),
+                    usuario_creacion="generar_datos",
+                    usuario_ultima_modificacion="generar_datos",
+                    fecha_primera_modificacion=self.ahora,
+                    **{campo_material: material},
+                ))
+            objetos = self._crear(modelo, objetos)
+
+            self._crear(RegistroFirma, [
+                self._firma(
+                    self.rng.choice(firmantes[rol]), rol,
+                    **{campo: planilla},
+                )
+                for planilla, roles_planilla in zip(objetos, roles)
+                for rol in roles_planilla
+            ])
+            modelo.objects.filter(
+                pk__gte=objetos[0].pk, pk__lte=objetos[-1].pk
+            ).update(**enlazar)
+            creadas.extend(objetos)
+        self._informar(campo, len(creadas))
+        return creadas
+
+    def _jarabes(self, n, productos, tipos, planillas):
+        envases = self._crear(PlanillaEnvase, [
+            PlanillaEnvase(
+                producto=planilla.producto,
+                tipo_producto=planilla.tipo_producto,
+                cantidad_teorica=100,
+                cantidad_real=self._cantidad(90, 100),
+                rendimiento=self._cantidad(90, 100),
+                fecha_emision=self.hoy,
+                fecha_vencimiento=self.hoy + datetime.timedelta(days=730),
+                usuario_creacion="generar_datos",
+                usuario_ultima_modificacion="generar_datos",
+                fecha_primera_modificacion=self.ahora,
+            )
+            for planilla in planillas["planilla_fabricacion"][:n]
+        ])
+        jarabes = self._crear(Jarabe, [
+            Jarabe(
+                producto=pf.producto,
+                lote=f"{self.prefijo}-L-{i:07d}",
+                fecha_inicio=self.hoy,
+                planilla_fabricacion=pf,
+                planilla_envase=pe,
+                planilla_envase_primario=pep,
+            )
+            for i, (pf, pe, pep) in enumerate(zip(
+                planillas["planilla_fabricacion"][:n],
+                envases,
+                planillas["planilla_envase_primario"][:n],
+            ))
+        ])
+        self._informar("jarabes", len(jarabes))
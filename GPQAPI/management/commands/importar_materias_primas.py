@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from GPQAPI.importacion import importar_materias_primas
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa materias primas con su stock inicial desde un CSV con "
+        "columnas nombre, batch y cantidad. Si alguna fila tiene errores "
+        "no se importa ninguna."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("archivo", help="Ruta del CSV (UTF-8).")
+        parser.add_argument(
+            "--usuario", default="importacion",
+            help="Usuario que queda en los movimientos de stock.",
+        )
+
+    def handle(self, *args, **opciones):
+        try:
+            archivo = open(
+                opciones["archivo"], encoding="utf-8-sig", newline=""
+            )
+        except OSError as exc:
+            raise CommandError(str(exc))
+        with archivo:
+            reporte = importar_materias_primas(
+                archivo, usuario=opciones["usuario"]
+            )
+
+        for error in reporte["errores"]:
+            for campo, mensajes in error["errores"].items():
+                self.stderr.write(
+                    f"fila {error['fila']}: {campo}: {' '.join(mensajes)}"
+                )
+        if reporte["errores"]:
+            raise CommandError(
+                f"No se importó ninguna fila: {len(reporte['errores'])} "
+                f"de {reporte['filas']} con errores."
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"{reporte['importadas']} materias primas importadas."
+        ))
@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from GPQAPI.carga import ESCENARIOS, MedicionCarga, comparar
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide rendimiento y latencia de la API sobre una base sembrada con "
+        "generar_datos, en el mismo proceso o contra --url, y guarda el "
+        "resultado en JSON para comparar entre commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--escenarios", nargs="+", choices=ESCENARIOS,
+            default=list(ESCENARIOS),
+        )
+        parser.add_argument("--hilos", type=int, default=4)
+        parser.add_argument(
+            "--duracion", type=float, default=10.0,
+            help="Segundos por escenario (por defecto 10).",
+        )
+        parser.add_argument(
+            "--operaciones", type=int,
+            help="Tope de solicitudes por escenario.",
+        )
+        parser.add_argument(
+            "--url",
+            help="Servidor local (http://127.0.0.1:8000); sin --url se "
+                 "mide en el mismo proceso.",
+        )
+        parser.add_argument(
+            "--prefijo", default="S0",
+            help="Prefijo usado en generar_datos (por defecto S0).",
+        )
+        parser.add_argument("--semilla", type=int, default=0)
+        parser.add_argument(
+            "--salida",
+            help="Archivo JSON (por defecto "
+                 "resultados_carga/<fecha>-<commit>.json).",
+        )
+        parser.add_argument(
+            "--comparar", metavar="JSON",
+            help="Resultado anterior contra el que comparar.",
+        )
+
+    def handle(self, *args, **opciones):
+        if opciones["hilos"] < 1:
+            raise CommandError("--hilos debe ser al menos 1")
+        medicion = MedicionCarga(
+            prefijo=opciones["prefijo"],
+            url=opciones["url"],
+            hilos=opciones["hilos"],
+            duracion=opciones["duracion"],
+            operaciones=opciones["operaciones"],
+            semilla=opciones["semilla"],
+        )
+        logger_request = logging.getLogger("django.request")
+        nivel = logger_request.level
+        if not opciones["url"]:
+            # los errores ya se cuentan por clase; sin esto cada 500 en
+            # proceso imprime su traza
+            logger_request.setLevel(logging.CRITICAL)
+        try:
+            resultado = medicion.ejecutar(opciones["escenarios"])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        finally:
+            logger_request.setLevel(nivel)
+
+        for escenario, datos in resultado["escenarios"].items():
+            self.stdout.write(self.style.MIGRATE_HEADING(escenario))
+            filas = [("total", datos["total"])]
+            filas += list(datos["por_operacion"].items())
+            for nombre, resumen in filas:
+                latencia = resumen["latencia_ms"]
+                if latencia["p50"] is None:
+                    self.stdout.write(f"  {nombre:<14} sin operaciones")
+                    continue
+                self.stdout.write(
+                    f"  {nombre:<14} {resumen['operaciones']:>6} ops "
+                    f"{resumen['rendimiento_ops_s']:>8.1f} ops/s  "
+                    f"p50 {latencia['p50']:7.1f}  p95 {latencia['p95']:7.1f}  "
+                    f"p99 {latencia['p99']:7.1f} ms  "
+                    f"errores {resumen['errores'] or 0}"
+                )
+
+        salida = opciones["salida"] or os.path.join(
+            settings.BASE_DIR, "resultados_carga",
+            "{}-{}.json".format(
+                resultado["metadatos"]["fecha"][:19].replace(":", ""),
+                resultado["metadatos"]["commit"] or "sin-commit",
+            ),
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+        with open(salida, "w", encoding="utf-8") as archivo:
+            json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f"Resultado en {salida}"))
+
+        if opciones["comparar"]:
+            with open(opciones["comparar"], encoding="utf-8") as archivo:
+                anterior = json.load(archivo)
+            for linea in comparar(anterior, resultado):
+                self.stdout.write(linea)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from GPQAPI import busqueda
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye el índice de búsqueda de texto completo (materias "
+        "primas, productos, materiales de envase y planillas)."
+    )
+
+    def handle(self, *args, **opciones):
+        with transaction.atomic():
+            total = busqueda.reindexar()
+        self.stdout.write(self.style.SUCCESS(f"{total} objetos indexados."))
@@ -0,0 +1,202 @@
+"""
+Métricas de la API en formato de texto de Prometheus.
+
+MetricasMiddleware (GPQAPI.middleware) acumula por ruta (view_name del
+router) y método: histograma de latencia, cantidad y tiempo de consultas
+SQL, bytes de respuesta y solicitudes por clase de estado (2xx, 4xx, 5xx).
+Cada proceso suma en memoria y vuelca a un SQLite compartido
+(GPQ_METRICAS_DB) como máximo una vez por segundo, con un UPSERT que suma;
+/api/metrics/ lee ese archivo, así que la vista agrega todos los workers.
+"""
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+# límites superiores del histograma de latencia, en segundos
+BUCKETS_LATENCIA = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float("inf"),
+)
+
+INTERVALO_VOLCADO = 1.0
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS metrica (
+    nombre TEXT NOT NULL,
+    ruta TEXT NOT NULL,
+    metodo TEXT NOT NULL,
+    etiqueta TEXT NOT NULL,
+    valor REAL NOT NULL,
+    PRIMARY KEY (nombre, ruta, metodo, etiqueta)
+)
+"""
+
+_UPSERT = """
+INSERT INTO metrica (nombre, ruta, metodo, etiqueta, valor)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (nombre, ruta, metodo, etiqueta)
+DO UPDATE SET valor = valor + excluded.valor
+"""
+
+# nombre -> (tipo, ayuda, nombre de la etiqueta extra)
+DEFINICIONES = {
+    "gpq_http_request_duration_seconds": (
+        "histogram", "Latencia de las solicitudes.", "le",
+    ),
+    "gpq_http_requests_total": (
+        "counter", "Solicitudes por clase de estado.", "estado",
+    ),
+    "gpq_db_queries_total": (
+        "counter", "Consultas SQL ejecutadas.", None,
+    ),
+    "gpq_db_query_seconds_total": (
+        "counter", "Tiempo en consultas SQL.", None,
+    ),
+    "gpq_http_response_bytes_total": (
+        "counter", "Bytes de cuerpo de respuesta.", None,
+    ),
+}
+
+
+def _formatear_le(limite):
+    return "+Inf" if limite == float("inf") else repr(limite)
+
+
+class AlmacenMetricas:
+    """Acumulador en memoria del proceso con volcado a SQLite."""
+
+    def __init__(self):
+        self._pendientes = {}
+        self._lock = threading.Lock()
+        self._ultimo_volcado = time.monotonic()
+
+    def _ruta_db(self):
+        return getattr(settings, "GPQ_METRICAS_DB", None)
+
+    def _conectar(self, ruta_db):
+        conexion = sqlite3.connect(ruta_db, timeout=5)
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute("PRAGMA synchronous=NORMAL")
+        conexion.execute(_ESQUEMA)
+        return conexion
+
+    def _sumar(self, nombre, ruta, metodo, etiqueta, valor):
+        clave = (nombre, ruta, metodo, etiqueta)
+        self._pendientes[clave] = self._pendientes.get(clave, 0) + valor
+
+    def registrar(self, ruta, metodo, estado, segundos, consultas,
+                  segundos_sql, bytes_respuesta):
+        with self._lock:
+            # todos los límites, también en 0, para que la serie esté
+            # completa desde la primera observación
+            for limite in BUCKETS_LATENCIA:
+                self._sumar(
+                    "gpq_http_request_duration_seconds_bucket",
+                    ruta, metodo, _formatear_le(limite),
+                    1 if segundos <= limite else 0,
+                )
+            self._sumar(
+                "gpq_http_request_duration_seconds_sum",
+                ruta, metodo, "", segundos,
+            )
+            self._sumar(
+                "gpq_http_request_duration_seconds_count",
+                ruta, metodo, "", 1,
+            )
+            self._sumar(
+                "gpq_http_requests_total",
+                ruta, metodo, f"{estado // 100}xx", 1,
+            )
+            self._sumar("gpq_db_queries_total", ruta, metodo, "", consultas)
+            self._sumar(
+                "gpq_db_query_seconds_total", ruta, metodo, "", segundos_sql
+            )
+            self._sumar(
+                "gpq_http_response_bytes_total",
+                ruta, metodo, "", bytes_respuesta,
+            )
+            vencido = (
+                time.monotonic() - self._ultimo_volcado >= INTERVALO_VOLCADO
+            )
+        if vencido:
+            self.volcar()
+
+    def volcar(self):
+        """Suma lo pendiente del proceso al archivo compartido."""
+        ruta_db = self._ruta_db()
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+            self._ultimo_volcado = time.monotonic()
+        if not pendientes or not ruta_db:
+            return
+        try:
+            conexion = self._conectar(ruta_db)
+            with conexion:
+                conexion.executemany(
+                    _UPSERT,
+                    [clave + (valor,) for clave, valor in pendientes.items()],
+                )
+            conexion.close()
+        except sqlite3.Error:
+            # no se pierden: se reintenta en el próximo volcado
+            with self._lock:
+                for clave, valor in pendientes.items():
+                    self._pendientes[clave] = (
+                        self._pendientes.get(clave, 0) + valor
+                    )
+
+    def leer(self):
+        ruta_db = self._ruta_db()
+        if not ruta_db:
+            return []
+        conexion = self._conectar(ruta_db)
+        try:
+            return conexion.execute(
+                "SELECT nombre, ruta, metodo, etiqueta, valor FROM metrica "
+                "ORDER BY nombre, ruta, metodo, etiqueta"
+            ).fetchall()
+        finally:
+            conexion.close()
+
+    def reiniciar(self):
+        with self._lock:
+            self._pendientes = {}
+        ruta_db = self._ruta_db()
+        if ruta_db:
+            conexion = self._conectar(ruta_db)
+            with conexion:
+                conexion.execute("DELETE FROM metrica")
+            conexion.close()
+
+    def exportar(self):
+        """Texto de exposición de Prometheus con todas las series."""
+        self.volcar()
+        filas = self.leer()
+
+        def orden_le(fila):
+            etiqueta = fila[3]
+            if fila[0].endswith("_bucket"):
+                return float("inf") if etiqueta == "+Inf" else float(etiqueta)
+            return 0
+
+        lineas = []
+        for base, (tipo, ayuda, extra) in DEFINICIONES.items():
+            lineas.append(f"# HELP {base} {ayuda}")
+            lineas.append(f"# TYPE {base} {tipo}")
+            series = [
+                f for f in filas
+                if f[0] == base or f[0].startswith(base + "_")
+            ]
+            series.sort(key=lambda f: (f[0], f[1], f[2], orden_le(f)))
+            for nombre, ruta, metodo, etiqueta, valor in series:
+                etiquetas = [f'ruta="{ruta}"', f'metodo="{metodo}"']
+                if etiqueta:
+                    etiquetas.append(f'{extra}="{etiqueta}"')
+                if float(valor).is_integer():
+                    valor = int(valor)
+                lineas.append(f"{nombre}{{{','.join(etiquetas)}}} {valor}")
+        return "\n".join(lineas) + "\n"
+
+
+almacen = AlmacenMetricas()
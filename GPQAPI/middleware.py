@@ -0,0 +1,75 @@
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from .eventos import id_correlacion, nuevo_id_correlacion
+from .metricas import almacen
+
+
+# ===========================================================
+# CORRELACIÓN DE SOLICITUDES
+# ===========================================================
+class CorrelacionMiddleware:
+    """
+    Asigna a cada solicitud un id de correlación (el de la cabecera
+    X-Request-ID si viene, o uno nuevo), lo deja en request.id_correlacion
+    y en los logs de la solicitud, y lo devuelve en la respuesta.
+    """
+
+    CABECERA = "X-Request-ID"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        valor = nuevo_id_correlacion(request.headers.get(self.CABECERA))
+        request.id_correlacion = valor
+        token = id_correlacion.set(valor)
+        try:
+            response = self.get_response(request)
+        finally:
+            id_correlacion.reset(token)
+        response[self.CABECERA] = valor
+        return response
+
+
+# ===========================================================
+# MÉTRICAS
+# ===========================================================
+class MetricasMiddleware:
+    """Mide cada solicitud y la acumula en `almacen`."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sql = {"consultas": 0, "segundos": 0.0}
+
+        def medir_sql(execute, consulta, params, many, context):
+            inicio = time.perf_counter()
+            try:
+                return execute(consulta, params, many, context)
+            finally:
+                sql["consultas"] += 1
+                sql["segundos"] += time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        with ExitStack() as pila:
+            for conexion in connections.all():
+                pila.enter_context(conexion.execute_wrapper(medir_sql))
+            response = self.get_response(request)
+        segundos = time.perf_counter() - inicio
+
+        match = getattr(request, "resolver_match", None)
+        ruta = match.view_name if match and match.view_name else "sin_ruta"
+        if response.streaming:
+            bytes_respuesta = 0
+        else:
+            bytes_respuesta = len(response.content)
+
+        almacen.registrar(
+            ruta, request.method, response.status_code, segundos,
+            sql["consultas"], sql["segundos"], bytes_respuesta,
+        )
+        return response
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GPQAPI', '0049_planillaenvasesecundarioempaque_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='planillaenvaseprimario',
+            index=models.Index(fields=['fecha_creacion', 'id'], name='pep_fecha_creacion_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvasesecundarioempaque',
+            index=models.Index(fields=['fecha_creacion', 'id'], name='pes_fecha_creacion_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillafabricacion',
+            index=models.Index(fields=['fecha_creacion', 'id'], name='pf_fecha_creacion_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrofirma',
+            index=models.Index(fields=['timestamp_firma', 'id'], name='firma_timestamp_id_idx'),
+        ),
+    ]
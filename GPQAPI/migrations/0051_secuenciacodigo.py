@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:33
+
+from django.db import migrations, models
+
+
+SECUENCIAS = [
+    ("MEP", "MaterialEnvasePrimario", "codigo_calidad"),
+    ("MES", "MaterialEnvaseSecundarioEmpaque", "codigo_calidad"),
+    ("CC", "ControlCalidad", "codigo_control_calidad"),
+]
+
+
+def inicializar_secuencias(apps, schema_editor):
+    """Arranca cada contador en el mayor sufijo ya usado."""
+    SecuenciaCodigo = apps.get_model("GPQAPI", "SecuenciaCodigo")
+    for prefijo, modelo, campo in SECUENCIAS:
+        Modelo = apps.get_model("GPQAPI", modelo)
+        mayor = 0
+        for codigo in Modelo.objects.values_list(campo, flat=True).iterator():
+            try:
+                mayor = max(mayor, int(codigo.split("-")[-1]))
+            except (AttributeError, ValueError):
+                continue
+        SecuenciaCodigo.objects.update_or_create(
+            prefijo=prefijo, defaults={"valor": mayor}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GPQAPI', '0050_indices_paginacion_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SecuenciaCodigo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefijo', models.CharField(max_length=10, unique=True)),
+                ('valor', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(
+            inicializar_secuencias, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+STOCKS = [
+    ("StockMateriaPrima", "materia_prima"),
+    ("StockMaterialEnvasePrimario", "material_envase_primario"),
+    (
+        "StockMaterialEnvaseSecundarioEmpaque",
+        "material_envase_secundario_empaque",
+    ),
+]
+
+
+def registrar_saldos_iniciales(apps, schema_editor):
+    """Un AJUSTE por stock existente para que el libro cuadre con el saldo."""
+    MovimientoStock = apps.get_model("GPQAPI", "MovimientoStock")
+    for modelo, campo in STOCKS:
+        Stock = apps.get_model("GPQAPI", modelo)
+        MovimientoStock.objects.bulk_create(
+            MovimientoStock(
+                tipo="AJUSTE",
+                bodega_id=stock.bodega_id,
+                cantidad=stock.cantidad_disponible,
+                referencia="Saldo inicial",
+                **{f"{campo}_id": getattr(stock, f"{campo}_id")},
+            )
+            for stock in Stock.objects.exclude(cantidad_disponible=0)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GPQAPI', '0051_secuenciacodigo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('ENTRADA', 'Entrada'), ('SALIDA', 'Salida'), ('AJUSTE', 'Ajuste')], max_length=10)),
+                ('cantidad', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('referencia', models.CharField(blank=True, max_length=100)),
+                ('usuario', models.CharField(blank=True, max_length=100)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('bodega', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='movimientos', to='GPQAPI.bodega')),
+                ('materia_prima', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='movimientos', to='GPQAPI.materiaprima')),
+                ('material_envase_primario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='movimientos', to='GPQAPI.materialenvaseprimario')),
+                ('material_envase_secundario_empaque', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='movimientos', to='GPQAPI.materialenvasesecundarioempaque')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fecha_creacion', 'id'], name='mov_fecha_creacion_id_idx')],
+            },
+        ),
+        migrations.RunPython(
+            registrar_saldos_iniciales, migrations.RunPython.noop
+        ),
+    ]
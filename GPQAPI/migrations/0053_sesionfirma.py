@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GPQAPI', '0052_movimientostock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SesionFirma',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token_hash', models.CharField(max_length=64, unique=True)),
+                ('alcance', models.CharField(max_length=255)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('expira', models.DateTimeField()),
+                ('revocada', models.BooleanField(default=False)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('user_agent', models.TextField(blank=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sesiones_firma', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='registrofirma',
+            name='sesion_firma',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='firmas', to='GPQAPI.sesionfirma'),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GPQAPI', '0053_sesionfirma'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='controlcalidad',
+            name='materia_prima',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='controles_calidad', to='GPQAPI.materiaprima'),
+        ),
+        migrations.AlterField(
+            model_name='controlcalidad',
+            name='material_envase_primario',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='controles_calidad_envase_primario', to='GPQAPI.materialenvaseprimario'),
+        ),
+        migrations.AlterField(
+            model_name='controlcalidad',
+            name='material_envase_secundario_empaque',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='controles_calidad_envase_secundario', to='GPQAPI.materialenvasesecundarioempaque'),
+        ),
+        migrations.AddIndex(
+            model_name='controlcalidad',
+            index=models.Index(fields=['materia_prima', '-fecha_verificacion', '-id'], name='cc_mp_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='controlcalidad',
+            index=models.Index(fields=['material_envase_primario', '-fecha_verificacion', '-id'], name='cc_mep_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='controlcalidad',
+            index=models.Index(fields=['material_envase_secundario_empaque', '-fecha_verificacion', '-id'], name='cc_mes_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='controlcalidad',
+            index=models.Index(condition=models.Q(('aprobado', True)), fields=['materia_prima', '-fecha_verificacion', '-id'], name='cc_mp_aprobado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='controlcalidad',
+            index=models.Index(condition=models.Q(('aprobado', True)), fields=['material_envase_primario', '-fecha_verificacion', '-id'], name='cc_mep_aprobado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='controlcalidad',
+            index=models.Index(condition=models.Q(('aprobado', True)), fields=['material_envase_secundario_empaque', '-fecha_verificacion', '-id'], name='cc_mes_aprobado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='materiaprima',
+            index=models.Index(fields=['batch'], name='mp_batch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvaseprimario',
+            index=models.Index(fields=['estado_aprobacion', 'fecha_creacion', 'id'], name='pep_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvaseprimario',
+            index=models.Index(condition=models.Q(('tipo_movimiento', 'PEDIDO_BODEGA')), fields=['fecha_creacion', 'id'], name='pep_pedido_bodega_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvaseprimario',
+            index=models.Index(fields=['fecha_emision', 'id'], name='pep_fecha_emision_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvasesecundarioempaque',
+            index=models.Index(fields=['estado_aprobacion', 'fecha_creacion', 'id'], name='pes_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvasesecundarioempaque',
+            index=models.Index(condition=models.Q(('tipo_movimiento', 'PEDIDO_BODEGA')), fields=['fecha_creacion', 'id'], name='pes_pedido_bodega_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvasesecundarioempaque',
+            index=models.Index(fields=['fecha_emision', 'id'], name='pes_fecha_emision_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillafabricacion',
+            index=models.Index(fields=['estado_aprobacion', 'fecha_creacion', 'id'], name='pf_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillafabricacion',
+            index=models.Index(condition=models.Q(('tipo_movimiento', 'PEDIDO_BODEGA')), fields=['fecha_creacion', 'id'], name='pf_pedido_bodega_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillafabricacion',
+            index=models.Index(fields=['fecha_emision', 'id'], name='pf_fecha_emision_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+MATERIALES = [
+    ("MateriaPrima", "materia_prima"),
+    ("MaterialEnvasePrimario", "material_envase_primario"),
+    ("MaterialEnvaseSecundarioEmpaque", "material_envase_secundario_empaque"),
+]
+
+
+def asignar_vigentes(apps, schema_editor):
+    """Un UPDATE por tipo de material con su último control aprobado."""
+    ControlCalidad = apps.get_model("GPQAPI", "ControlCalidad")
+    for modelo, campo in MATERIALES:
+        apps.get_model("GPQAPI", modelo).objects.update(
+            control_calidad_vigente=Subquery(
+                ControlCalidad.objects.filter(
+                    aprobado=True, **{campo: OuterRef("pk")}
+                ).order_by("-fecha_verificacion", "-id").values("pk")[:1]
+            )
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GPQAPI', '0054_indices_consultas_frecuentes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='materialenvaseprimario',
+            name='control_calidad_vigente',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='GPQAPI.controlcalidad'),
+        ),
+        migrations.AddField(
+            model_name='materialenvasesecundarioempaque',
+            name='control_calidad_vigente',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='GPQAPI.controlcalidad'),
+        ),
+        migrations.AddField(
+            model_name='materiaprima',
+            name='control_calidad_vigente',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='GPQAPI.controlcalidad'),
+        ),
+        migrations.RunPython(asignar_vigentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GPQAPI', '0055_control_calidad_vigente'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='planillaenvaseprimario',
+            name='pep_pedido_bodega_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='planillaenvasesecundarioempaque',
+            name='pes_pedido_bodega_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='planillafabricacion',
+            name='pf_pedido_bodega_idx',
+        ),
+        migrations.AddIndex(
+            model_name='bodega',
+            index=models.Index(fields=['tipo', 'es_principal'], name='bodega_tipo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='jarabe',
+            index=models.Index(fields=['lote'], name='jarabe_lote_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='materialenvaseprimario',
+            index=models.Index(fields=['estado_aprobacion', 'id'], name='mep_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='materialenvasesecundarioempaque',
+            index=models.Index(fields=['estado_aprobacion', 'id'], name='mes_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='materiaprima',
+            index=models.Index(fields=['estado_aprobacion', 'id'], name='mp_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='perfilusuario',
+            index=models.Index(fields=['rol'], name='perfil_rol_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvase',
+            index=models.Index(fields=['estado_aprobacion', 'id'], name='pe_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvaseprimario',
+            index=models.Index(fields=['tipo_movimiento', 'fecha_creacion', 'id'], name='pep_tipo_mov_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvasesecundarioempaque',
+            index=models.Index(fields=['tipo_movimiento', 'fecha_creacion', 'id'], name='pes_tipo_mov_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillafabricacion',
+            index=models.Index(fields=['tipo_movimiento', 'fecha_creacion', 'id'], name='pf_tipo_mov_fecha_idx'),
+        ),
+    ]
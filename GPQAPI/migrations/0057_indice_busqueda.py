@@ -0,0 +1,111 @@
+from django.db import migrations
+
+
+CREAR = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE gpq_busqueda USING fts5("
+        "tipo UNINDEXED, objeto_id UNINDEXED, titulo, texto, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+        # ORDER BY rank: bm25 con el título diez veces más pesado
+        "INSERT INTO gpq_busqueda (gpq_busqueda, rank) "
+        "VALUES ('rank', 'bm25(0.0, 0.0, 10.0, 1.0)')",
+    ],
+    "postgresql": [
+        "CREATE TABLE gpq_busqueda ("
+        "clave bigint PRIMARY KEY, "
+        "tipo varchar(40) NOT NULL, "
+        "objeto_id bigint NOT NULL, "
+        "titulo text NOT NULL, "
+        "texto text NOT NULL, "
+        "vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('simple', titulo), 'A') || "
+        "setweight(to_tsvector('simple', texto), 'B')) STORED)",
+        "CREATE INDEX gpq_busqueda_vector_idx ON gpq_busqueda "
+        "USING GIN (vector)",
+    ],
+}
+
+
+# Copia fija de GPQAPI.busqueda al crear el índice: (tipo, código de la
+# clave, modelo, campos del título, campos del texto, separador del
+# título). La migración no usa el código vivo, que puede cambiar; después
+# el índice se reconstruye con el comando reindexar_busqueda.
+FUENTES = [
+    ("materia_prima", 1, "MateriaPrima", ("nombre",), ("batch",), " "),
+    ("producto", 2, "Producto", ("nombre",), (), " "),
+    ("material_envase_primario", 3, "MaterialEnvasePrimario",
+     ("nombre",), ("codigo", "codigo_calidad"), " "),
+    ("material_envase_secundario_empaque", 4,
+     "MaterialEnvaseSecundarioEmpaque",
+     ("nombre",), ("codigo", "codigo_calidad"), " "),
+    ("planilla_fabricacion", 5, "PlanillaFabricacion",
+     ("serie", "numero_planilla"), ("batch_standart",), "-"),
+    ("planilla_envase_primario", 6, "PlanillaEnvasePrimario",
+     ("serie", "numero_planilla"), ("batch_standart",), "-"),
+    ("planilla_envase_secundario_empaque", 7,
+     "PlanillaEnvaseSecundarioEmpaque",
+     ("serie", "numero_planilla"), ("batch_standart",), "-"),
+]
+
+GUARDAR = {
+    "sqlite": (
+        "INSERT INTO gpq_busqueda (rowid, tipo, objeto_id, titulo, texto) "
+        "VALUES (%s, %s, %s, %s, %s)"
+    ),
+    "postgresql": (
+        "INSERT INTO gpq_busqueda (clave, tipo, objeto_id, titulo, texto) "
+        "VALUES (%s, %s, %s, %s, %s)"
+    ),
+}
+
+LOTE = 2000
+
+
+def _unir(separador, valores):
+    return separador.join(str(v) for v in valores if v)
+
+
+def llenar_indice(apps, schema_editor):
+    """Una fila por objeto existente, con los modelos históricos."""
+    conexion = schema_editor.connection
+    guardar = GUARDAR[conexion.vendor]
+    with conexion.cursor() as cursor:
+        for tipo, codigo, modelo, titulo, texto, separador in FUENTES:
+            Modelo = apps.get_model("GPQAPI", modelo)
+            filas = []
+            for pk, *valores in (
+                Modelo.objects.using(conexion.alias).order_by("pk")
+                .values_list("pk", *titulo, *texto)
+                .iterator(chunk_size=LOTE)
+            ):
+                filas.append((
+                    pk * 8 + codigo, tipo, pk,
+                    _unir(separador, valores[:len(titulo)]),
+                    _unir(" ", valores[len(titulo):]),
+                ))
+                if len(filas) >= LOTE:
+                    cursor.executemany(guardar, filas)
+                    filas = []
+            if filas:
+                cursor.executemany(guardar, filas)
+
+
+def crear_indice(apps, schema_editor):
+    for sentencia in CREAR[schema_editor.connection.vendor]:
+        schema_editor.execute(sentencia)
+    llenar_indice(apps, schema_editor)
+
+
+def borrar_indice(apps, schema_editor):
+    schema_editor.execute("DROP TABLE gpq_busqueda")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GPQAPI', '0056_indices_filtros'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
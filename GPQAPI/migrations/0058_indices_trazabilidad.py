@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GPQAPI', '0057_indice_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='planillaenvaseprimario',
+            index=models.Index(fields=['batch_standart', 'producto'], name='pep_batch_producto_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvasesecundarioempaque',
+            index=models.Index(fields=['batch_standart', 'producto'], name='pes_batch_producto_idx'),
+        ),
+    ]
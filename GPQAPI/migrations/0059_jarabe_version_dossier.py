@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GPQAPI', '0058_indices_trazabilidad'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jarabe',
+            name='version_dossier',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GPQAPI', '0059_jarabe_version_dossier'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='controlcalidad',
+            index=models.Index(fields=['aprobado'], name='cc_aprobado_idx'),
+        ),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GPQAPI', '0060_indice_cc_aprobado'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='controlcalidad',
+            name='firma_control_calidad',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='firmas_cc', to='GPQAPI.registrofirma'),
+        ),
+        migrations.AlterField(
+            model_name='planillaenvaseprimario',
+            name='firma_jefe_produccion',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='firma_jp_envase_primario', to='GPQAPI.registrofirma'),
+        ),
+        migrations.AlterField(
+            model_name='planillaenvaseprimario',
+            name='firma_jefe_seccion',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='firma_js_envase_primario', to='GPQAPI.registrofirma'),
+        ),
+        migrations.AlterField(
+            model_name='planillaenvaseprimario',
+            name='firma_quimico_farmaceutico',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='firma_qf_envase_primario', to='GPQAPI.registrofirma'),
+        ),
+        migrations.AlterField(
+            model_name='planillaenvasesecundarioempaque',
+            name='firma_jefe_produccion',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='firma_jp_envase_secundario', to='GPQAPI.registrofirma'),
+        ),
+        migrations.AlterField(
+            model_name='planillaenvasesecundarioempaque',
+            name='firma_jefe_seccion',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='firma_js_envase_secundario', to='GPQAPI.registrofirma'),
+        ),
+        migrations.AlterField(
+            model_name='planillaenvasesecundarioempaque',
+            name='firma_quimico_farmaceutico',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='firma_qf_envase_secundario', to='GPQAPI.registrofirma'),
+        ),
+        migrations.AlterField(
+            model_name='planillafabricacion',
+            name='firma_jefe_produccion',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='firma_jp_fabricacion', to='GPQAPI.registrofirma'),
+        ),
+        migrations.AlterField(
+            model_name='planillafabricacion',
+            name='firma_jefe_seccion',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='firma_js_fabricacion', to='GPQAPI.registrofirma'),
+        ),
+        migrations.AlterField(
+            model_name='planillafabricacion',
+            name='firma_quimico_farmaceutico',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='firma_qf_fabricacion', to='GPQAPI.registrofirma'),
+        ),
+        migrations.AddIndex(
+            model_name='controlcalidad',
+            index=models.Index(fields=['firma_control_calidad', 'fecha_verificacion', 'id'], name='cc_firma_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvaseprimario',
+            index=models.Index(fields=['firma_jefe_seccion', 'fecha_creacion', 'id'], name='pep_firma_jsec_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvaseprimario',
+            index=models.Index(fields=['firma_jefe_produccion', 'fecha_creacion', 'id'], name='pep_firma_jprod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvaseprimario',
+            index=models.Index(fields=['firma_quimico_farmaceutico', 'fecha_creacion', 'id'], name='pep_firma_qf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvasesecundarioempaque',
+            index=models.Index(fields=['firma_jefe_seccion', 'fecha_creacion', 'id'], name='pes_firma_jsec_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvasesecundarioempaque',
+            index=models.Index(fields=['firma_jefe_produccion', 'fecha_creacion', 'id'], name='pes_firma_jprod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillaenvasesecundarioempaque',
+            index=models.Index(fields=['firma_quimico_farmaceutico', 'fecha_creacion', 'id'], name='pes_firma_qf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillafabricacion',
+            index=models.Index(fields=['firma_jefe_seccion', 'fecha_creacion', 'id'], name='pf_firma_jsec_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillafabricacion',
+            index=models.Index(fields=['firma_jefe_produccion', 'fecha_creacion', 'id'], name='pf_firma_jprod_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planillafabricacion',
+            index=models.Index(fields=['firma_quimico_farmaceutico', 'fecha_creacion', 'id'], name='pf_firma_qf_idx'),
+        ),
+    ]
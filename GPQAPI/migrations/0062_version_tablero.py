@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:09
+
+from django.db import migrations, models
+
+
+GRUPOS = ["planillas", "materiales", "controles_calidad", "stock"]
+
+
+def crear_versiones(apps, schema_editor):
+    """Una fila por grupo, para que subir la versión sea un solo UPDATE."""
+    VersionTablero = apps.get_model("GPQAPI", "VersionTablero")
+    VersionTablero.objects.bulk_create(
+        [VersionTablero(grupo=grupo) for grupo in GRUPOS],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('GPQAPI', '0061_indices_firmas_pendientes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionTablero',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grupo', models.CharField(max_length=30, unique=True)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(crear_versiones, migrations.RunPython.noop),
+    ]
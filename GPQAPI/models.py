@@ -1,10 +1,19 @@
-from django.db import models
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import F, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
+import datetime
+import hashlib
+import logging
 import random
+import secrets
 import string
 
+logger = logging.getLogger(__name__)
+
 
 # =======================================================
 # USUARIO PERSONALIZADO
@@ -45,6 +54,11 @@ class PerfilUsuario(models.Model):
     contacto_emergencia_nombre = models.CharField(max_length=100, blank=True)
     contacto_emergencia_telefono = models.CharField(max_length=15, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["rol"], name="perfil_rol_idx"),
+        ]
+
     def __str__(self):
         return f"{self.usuario.get_full_name()} - {self.get_rol_display()}"
 
@@ -79,6 +93,21 @@ class RegistroFirma(models.Model):
     ip_address = models.GenericIPAddressField(blank=True, null=True)
     user_agent = models.TextField(blank=True)
 
+    # sesión de firma con que se autenticó (vacío = RUT y contraseña)
+    sesion_firma = models.ForeignKey(
+        "SesionFirma", null=True, blank=True,
+        on_delete=models.PROTECT, related_name="firmas",
+    )
+
+    class Meta:
+        indexes = [
+            # paginación por cursor (timestamp_firma, id)
+            models.Index(
+                fields=["timestamp_firma", "id"],
+                name="firma_timestamp_id_idx",
+            ),
+        ]
+
     MAPA_FIRMA = {
         "JEFE_SECCION": "JEFE_SECCION",
         "JEFE_DE_SECCION": "JEFE_SECCION",
@@ -107,15 +136,16 @@ class RegistroFirma(models.Model):
         "CONTROL CALIDAD": "INSPECTOR_CALIDAD",
     }
 
-    def save(self, *args, **kwargs):
-        es_nueva = self.pk is None
-
-        # 1) Detectar tipo_firma según rol del usuario (rol como CharField)
-        try:
-            rol = self.usuario.perfilusuario.rol.strip().upper()
-        except Exception:
-            rol = (self.tipo_firma or "").strip().upper()
+    # tipo_firma -> campo de firma en las planillas
+    CAMPOS_FIRMA_PLANILLA = {
+        "JEFE_SECCION": "firma_jefe_seccion",
+        "JEFE_PRODUCCION": "firma_jefe_produccion",
+        "QUIMICO_FARMACEUTICO": "firma_quimico_farmaceutico",
+    }
 
+    @classmethod
+    def normalizar_tipo_firma(cls, rol):
+        rol = (rol or "").strip().upper()
         normalizado = (
             rol.replace(" ", "_")
                .replace("Á", "A")
@@ -126,29 +156,44 @@ class RegistroFirma(models.Model):
                .replace("Ñ", "N")
         )
 
-        tipo_detectado = self.MAPA_FIRMA.get(normalizado) or \
-            self.MAPA_FIRMA.get(rol.replace("_", " "))
+        tipo_detectado = cls.MAPA_FIRMA.get(normalizado) or \
+            cls.MAPA_FIRMA.get(rol.replace("_", " "))
+
+        return tipo_detectado or rol
+
+    @staticmethod
+    def generar_codigo_verificacion():
+        return ''.join(random.choices(string.digits, k=6))
+
+    def save(self, *args, **kwargs):
+        es_nueva = self.pk is None
+
+        # 1) Detectar tipo_firma según rol del usuario (rol como CharField)
+        try:
+            rol = self.usuario.perfilusuario.rol
+        except Exception:
+            rol = self.tipo_firma
 
-        self.tipo_firma = tipo_detectado or rol
+        self.tipo_firma = self.normalizar_tipo_firma(rol)
 
         # 2) Código verificación
         if not self.codigo_verificacion:
-            self.codigo_verificacion = ''.join(
-                random.choices(string.digits, k=6)
-            )
+            self.codigo_verificacion = self.generar_codigo_verificacion()
 
         super().save(*args, **kwargs)
 
         # 3) Acciones automáticas solo en nueva firma
         if es_nueva:
-            print(
-                f"DEBUG: Nueva firma creada, tipo: {self.tipo_firma}, id: {self.id}"
+            logger.debug(
+                "Nueva firma creada, tipo: %s, id: %s",
+                self.tipo_firma, self.id,
+                extra={"firma_id": self.id, "tipo_firma": self.tipo_firma},
             )
 
             # PLANILLA FABRICACIÓN
             if self.planilla_fabricacion:
                 pf = self.planilla_fabricacion
-                print(f"DEBUG: Asociando firma a planilla fabricación {pf.id}")
+                logger.debug("Asociando firma a planilla fabricación %s", pf.id)
                 asignacion = {
                     "JEFE_SECCION": "firma_jefe_seccion",
                     "JEFE_PRODUCCION": "firma_jefe_produccion",
@@ -159,15 +204,16 @@ class RegistroFirma(models.Model):
                     setattr(pf, campo, self)
                     pf.save(update_fields=[campo])
                     pf.actualizar_estado_aprobacion()
-                    print(
-                        f"DEBUG: Firma asignada a {campo} en planilla fabricación"
+                    logger.debug(
+                        "Firma asignada a %s en planilla fabricación %s",
+                        campo, pf.id,
                     )
 
             # PLANILLA ENVASE PRIMARIO
             if self.planilla_envase_primario:
                 pep = self.planilla_envase_primario
-                print(
-                    f"DEBUG: Asociando firma a planilla envase primario {pep.id}"
+                logger.debug(
+                    "Asociando firma a planilla envase primario %s", pep.id
                 )
                 asignacion2 = {
                     "JEFE_SECCION": "firma_jefe_seccion",
@@ -179,15 +225,17 @@ class RegistroFirma(models.Model):
                     setattr(pep, campo, self)
                     pep.save(update_fields=[campo])
                     pep.actualizar_estado_aprobacion()
-                    print(
-                        f"DEBUG: Firma asignada a {campo} en planilla envase primario"
+                    logger.debug(
+                        "Firma asignada a %s en planilla envase primario %s",
+                        campo, pep.id,
                     )
 
             # PLANILLA ENVASE SECUNDARIO Y EMPAQUE
             if self.planilla_envase_secundario_empaque:
                 pes = self.planilla_envase_secundario_empaque
-                print(
-                    f"DEBUG: Asociando firma a planilla envase secundario/empaque {pes.id}"
+                logger.debug(
+                    "Asociando firma a planilla envase secundario/empaque %s",
+                    pes.id,
                 )
                 asignacion3 = {
                     "JEFE_SECCION": "firma_jefe_seccion",
@@ -199,14 +247,267 @@ class RegistroFirma(models.Model):
                     setattr(pes, campo, self)
                     pes.save(update_fields=[campo])
                     pes.actualizar_estado_aprobacion()
-                    print(
-                        f"DEBUG: Firma asignada a {campo} en planilla envase secundario/empaque"
+                    logger.debug(
+                        "Firma asignada a %s en planilla envase "
+                        "secundario/empaque %s",
+                        campo, pes.id,
                     )
 
+    @classmethod
+    def firmar_planillas(cls, usuario, objetivos, sesion=None,
+                         ip_address=None, user_agent=""):
+        """
+        Firma en lote. `objetivos` es una lista de (tipo, id) con tipo
+        igual al campo de planilla en RegistroFirma. Crea todas las firmas
+        con un solo INSERT y asigna la firma y el estado de cada tipo de
+        planilla con un UPDATE por tipo, todo en una transacción.
+
+        Devuelve (resultados, aprobadas): un dict por objetivo, en el
+        mismo orden, con ok y firma_id/estado_aprobacion o error; y las
+        planillas que quedaron APROBADAS con esta firma.
+        """
+        # importación diferida: dossier y tablero importan este módulo
+        from . import dossier, tablero
+
+        try:
+            rol = usuario.perfilusuario.rol
+        except Exception:
+            rol = ""
+        tipo_firma = cls.normalizar_tipo_firma(rol)
+        campo = cls.CAMPOS_FIRMA_PLANILLA.get(tipo_firma)
+        campos = list(cls.CAMPOS_FIRMA_PLANILLA.values())
+        ahora = datetime.datetime.now().isoformat()
+
+        resultados = [{"tipo": tipo, "id": pk} for tipo, pk in objetivos]
+        por_tipo = {}
+        for resultado in resultados:
+            por_tipo.setdefault(resultado["tipo"], []).append(resultado)
+
+        def fallar(resultado, error):
+            resultado.update(ok=False, error=error)
+
+        def por_planilla(planillas, atributo):
+            # CASE id WHEN ... con el valor de cada planilla
+            return models.Case(*[
+                models.When(pk=p.pk, then=models.Value(getattr(p, atributo)))
+                for p in planillas
+            ])
+
+        aprobadas = []
+        with transaction.atomic():
+            firmas, pendientes = [], []
+            for tipo, items in por_tipo.items():
+                modelo = cls._meta.get_field(tipo).related_model
+                planillas = modelo.objects.select_for_update().in_bulk(
+                    [r["id"] for r in items]
+                )
+                vistas = set()
+                for resultado in items:
+                    planilla = planillas.get(resultado["id"])
+                    if campo is None:
+                        fallar(resultado, "No tiene permisos para esta firma")
+                    elif sesion is not None and tipo not in sesion.alcances:
+                        fallar(
+                            resultado, "Fuera del alcance de la sesión de firma"
+                        )
+                    elif planilla is None:
+                        fallar(resultado, "La planilla no existe")
+                    elif planilla.pk in vistas:
+                        fallar(resultado, "Planilla repetida en el lote")
+                    elif getattr(planilla, f"{campo}_id") is not None:
+                        fallar(
+                            resultado,
+                            "La planilla ya tiene la firma de este rol",
+                        )
+                    else:
+                        vistas.add(planilla.pk)
+                        firmas.append(cls(
+                            usuario=usuario,
+                            tipo_firma=tipo_firma,
+                            firma_hash=hashlib.sha256(
+                                f"{usuario.rut}{planilla.id}{ahora}".encode()
+                            ).hexdigest(),
+                            codigo_verificacion=(
+                                cls.generar_codigo_verificacion()
+                            ),
+                            ip_address=ip_address,
+                            user_agent=user_agent,
+                            sesion_firma=sesion,
+                            **{tipo: planilla},
+                        ))
+                        pendientes.append((resultado, planilla))
+
+            if not firmas:
+                return resultados, aprobadas
+
+            cls.objects.bulk_create(firmas)
+
+            momento = timezone.now()
+            por_modelo = {}
+            for (resultado, planilla), firma in zip(pendientes, firmas):
+                setattr(planilla, campo, firma)
+                completa = all(getattr(planilla, f"{c}_id") for c in campos)
+                planilla.estado_aprobacion = (
+                    "APROBADO" if completa else "EN_PROCESO"
+                )
+                if completa:
+                    aprobadas.append(planilla)
+                por_modelo.setdefault(type(planilla), []).append(planilla)
+                resultado.update(
+                    ok=True,
+                    firma_id=firma.id,
+                    estado_aprobacion=planilla.estado_aprobacion,
+                )
+
+            for modelo, planillas in por_modelo.items():
+                # los campos de auditoría que pondría save()
+                modelo.objects.filter(
+                    pk__in=[p.pk for p in planillas]
+                ).update(**{
+                    campo: por_planilla(planillas, f"{campo}_id"),
+                    "estado_aprobacion": por_planilla(
+                        planillas, "estado_aprobacion"
+                    ),
+                    "fecha_primera_modificacion": Coalesce(
+                        "fecha_primera_modificacion", models.Value(momento)
+                    ),
+                    "fecha_ultima_modificacion": momento,
+                    "usuario_ultima_modificacion": usuario.username,
+                })
+                for planilla in planillas:
+                    if planilla.fecha_primera_modificacion is None:
+                        planilla.fecha_primera_modificacion = momento
+                    planilla.fecha_ultima_modificacion = momento
+                    planilla.usuario_ultima_modificacion = usuario.username
+                # update() no emite post_save: el dossier y el tablero se
+                # invalidan aquí
+                campo_jarabe = Jarabe.CAMPO_PLANILLA.get(modelo.__name__)
+                if campo_jarabe:
+                    dossier.invalidar(
+                        [(campo_jarabe, p.pk) for p in planillas]
+                    )
+                tablero.invalidar(["planillas"])
+
+            # igual que en la firma individual: al aprobarse se descuenta
+            # el envase secundario, dentro de la misma transacción
+            for planilla in aprobadas:
+                if isinstance(planilla, PlanillaEnvaseSecundarioEmpaque):
+                    planilla.descontar_stock_aprobado()
+
+        return resultados, aprobadas
+
     def __str__(self):
         return f"{self.usuario.rut} - {self.tipo_firma}"
 
 
+# =======================================================
+# SESIÓN DE FIRMA
+# =======================================================
+class SesionFirma(models.Model):
+    """
+    Autorización de corta duración para firmar sin repetir la contraseña.
+    Se abre con RUT y contraseña (un solo PBKDF2) y entrega un token que
+    las acciones firmar aceptan mientras no expire, dentro de su alcance.
+    Solo se guarda el SHA-256 del token; cada RegistroFirma apunta a la
+    sesión que lo autorizó.
+    """
+
+    ALCANCE_CHOICES = [
+        ("control_calidad", "Control de calidad"),
+        ("planilla_fabricacion", "Planilla de fabricación"),
+        ("planilla_envase_primario", "Planilla envase primario"),
+        (
+            "planilla_envase_secundario_empaque",
+            "Planilla envase secundario/empaque",
+        ),
+    ]
+
+    # alcances que puede abrir cada rol
+    ALCANCES_POR_ROL = {
+        "INSPECTOR_CALIDAD": {"control_calidad"},
+        "JEFE_SECCION": {
+            "planilla_fabricacion",
+            "planilla_envase_primario",
+            "planilla_envase_secundario_empaque",
+        },
+        "JEFE_PRODUCCION": {
+            "planilla_fabricacion",
+            "planilla_envase_primario",
+            "planilla_envase_secundario_empaque",
+        },
+        "QUIMICO_FARMACEUTICO": {
+            "planilla_fabricacion",
+            "planilla_envase_primario",
+            "planilla_envase_secundario_empaque",
+        },
+    }
+
+    usuario = models.ForeignKey(
+        UsuarioPersonalizado, on_delete=models.CASCADE,
+        related_name="sesiones_firma",
+    )
+    token_hash = models.CharField(max_length=64, unique=True)
+    # alcances separados por coma
+    alcance = models.CharField(max_length=255)
+
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    expira = models.DateTimeField()
+    revocada = models.BooleanField(default=False)
+
+    ip_address = models.GenericIPAddressField(blank=True, null=True)
+    user_agent = models.TextField(blank=True)
+
+    @staticmethod
+    def _hash(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @classmethod
+    def abrir(cls, usuario, alcance, ip_address=None, user_agent=""):
+        """
+        Crea la sesión y devuelve (sesion, token). El token en claro solo
+        existe en esta respuesta.
+        """
+        minutos = getattr(settings, "GPQ_SESION_FIRMA_MINUTOS", 15)
+        token = secrets.token_urlsafe(32)
+        sesion = cls.objects.create(
+            usuario=usuario,
+            token_hash=cls._hash(token),
+            alcance=",".join(sorted(alcance)),
+            expira=timezone.now() + datetime.timedelta(minutes=minutos),
+            ip_address=ip_address,
+            user_agent=user_agent,
+        )
+        return sesion, token
+
+    @classmethod
+    def validar(cls, token, alcance):
+        """
+        Sesión vigente del token para el alcance pedido (sin alcance, para
+        cualquiera), con el usuario y su perfil ya cargados; None si no
+        existe, expiró, fue revocada o no cubre el alcance. Una sola
+        consulta indexada.
+        """
+        sesion = (
+            cls.objects.select_related("usuario__perfilusuario")
+            .filter(
+                token_hash=cls._hash(token),
+                revocada=False,
+                expira__gt=timezone.now(),
+            )
+            .first()
+        )
+        if sesion is None or (alcance and alcance not in sesion.alcances):
+            return None
+        return sesion
+
+    @property
+    def alcances(self):
+        return set(self.alcance.split(","))
+
+    def __str__(self):
+        return f"{self.usuario.rut} - {self.alcance} (hasta {self.expira})"
+
+
 # =======================================================
 # AUDITORÍA
 # =======================================================
@@ -227,6 +528,71 @@ class ModeloAuditoria(models.Model):
         super().save(*args, **kwargs)
 
 
+# =======================================================
+# SECUENCIAS DE CÓDIGOS (MEP-0001, MES-0001, CC-0001)
+# =======================================================
+class SecuenciaCodigo(models.Model):
+    """
+    Un contador por prefijo. El incremento es un UPDATE atómico
+    (valor = valor + n), así que dos inserciones concurrentes nunca
+    reciben el mismo número y no hace falta leer el último registro.
+    """
+
+    prefijo = models.CharField(max_length=10, unique=True)
+    valor = models.PositiveBigIntegerField(default=0)
+
+    @classmethod
+    def reservar(cls, prefijo, cantidad=1):
+        """
+        Reserva `cantidad` números consecutivos y devuelve sus códigos
+        ("CC-0001", ...). Un solo viaje a la base, también para cargas
+        masivas que piden un bloque.
+        """
+        if cantidad < 1:
+            return []
+
+        ultimo = cls._incrementar(prefijo, cantidad)
+        if ultimo is None:
+            cls.objects.get_or_create(prefijo=prefijo)
+            ultimo = cls._incrementar(prefijo, cantidad)
+
+        primero = ultimo - cantidad + 1
+        return [f"{prefijo}-{n:04d}" for n in range(primero, ultimo + 1)]
+
+    @classmethod
+    def _incrementar(cls, prefijo, cantidad):
+        """Suma `cantidad` al contador y devuelve el nuevo valor (o None)."""
+        if (
+            connection.vendor in ("sqlite", "postgresql")
+            and connection.features.can_return_columns_from_insert
+        ):
+            tabla = connection.ops.quote_name(cls._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {tabla} SET valor = valor + %s "
+                    f"WHERE prefijo = %s RETURNING valor",
+                    [cantidad, prefijo],
+                )
+                fila = cursor.fetchone()
+            return fila[0] if fila else None
+
+        with transaction.atomic():
+            if not cls.objects.filter(prefijo=prefijo).update(
+                valor=F("valor") + cantidad
+            ):
+                return None
+            return cls.objects.filter(prefijo=prefijo).values_list(
+                "valor", flat=True
+            ).get()
+
+    @classmethod
+    def siguiente(cls, prefijo):
+        return cls.reservar(prefijo, 1)[0]
+
+    def __str__(self):
+        return f"{self.prefijo}: {self.valor}"
+
+
 # =======================================================
 # PRODUCTO – MATERIA PRIMA – ETC.
 # =======================================================
@@ -277,26 +643,42 @@ class MateriaPrima(models.Model):
         related_name="firmas_materia_prima"
     )
 
+    # último ControlCalidad aprobado (por fecha_verificacion, id); lo
+    # mantiene ControlCalidad al guardarse o eliminarse
+    control_calidad_vigente = models.ForeignKey(
+        "ControlCalidad", null=True, blank=True, on_delete=models.SET_NULL,
+        related_name="+",
+    )
+
     estado_aprobacion = models.CharField(
         max_length=20, choices=ESTADOS_APROBACION, default="PENDIENTE"
     )
 
-    def actualizar_estado_aprobacion(self):
-        print(f"DEBUG: Actualizando estado de materia prima {self.id}")
-        print(f"DEBUG: Firma inspector: {self.firma_inspector_calidad}")
+    class Meta:
+        indexes = [
+            models.Index(fields=["batch"], name="mp_batch_idx"),
+            models.Index(
+                fields=["estado_aprobacion", "id"], name="mp_estado_idx"
+            ),
+        ]
 
-        if self.firma_inspector_calidad:
+    def actualizar_estado_aprobacion(self):
+        # por _id: no hace falta cargar la firma para saber si existe
+        if self.firma_inspector_calidad_id is not None:
             self.estado_aprobacion = "APROBADO"
             self.control_calidad = True
-            print(f"DEBUG: Materia prima {self.id} APROBADA")
         else:
             self.estado_aprobacion = "PENDIENTE"
             self.control_calidad = False
-            print(f"DEBUG: Materia prima {self.id} PENDIENTE")
 
-        self.save()
-        print(
-            f"DEBUG: Materia prima {self.id} guardada, estado: {self.estado_aprobacion}"
+        # solo lo que cambia: no pisa control_calidad_vigente
+        self.save(update_fields=[
+            "firma_inspector_calidad", "estado_aprobacion", "control_calidad",
+        ])
+        logger.debug(
+            "Materia prima %s guardada, estado: %s (firma inspector: %s)",
+            self.id, self.estado_aprobacion, self.firma_inspector_calidad_id,
+            extra={"materia_prima_id": self.id},
         )
 
     def __str__(self):
@@ -322,59 +704,51 @@ class MaterialEnvasePrimario(models.Model):
 
     control_calidad = models.BooleanField(default=False)
 
+    # último ControlCalidad aprobado (por fecha_verificacion, id); lo
+    # mantiene ControlCalidad al guardarse o eliminarse
+    control_calidad_vigente = models.ForeignKey(
+        "ControlCalidad", null=True, blank=True, on_delete=models.SET_NULL,
+        related_name="+",
+    )
+
     estado_aprobacion = models.CharField(
         max_length=20, choices=ESTADOS_APROBACION, default="PENDIENTE"
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["estado_aprobacion", "id"], name="mep_estado_idx"
+            ),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.codigo_calidad:
-            last = MaterialEnvasePrimario.objects.order_by("-id").first()
-            next_num = 1
-            if last and last.codigo_calidad:
-                try:
-                    next_num = int(last.codigo_calidad.split("-")[-1]) + 1
-                except Exception:
-                    next_num = 1
-            self.codigo_calidad = f"MEP-{next_num:04d}"
+            self.codigo_calidad = SecuenciaCodigo.siguiente("MEP")
 
         super().save(*args, **kwargs)
 
     def actualizar_estado_aprobacion(self, control_calidad):
-        print(
-            f"DEBUG: Actualizando estado de material envase primario {self.id}"
-        )
-        print(
-            f"DEBUG: Control calidad asociado: {control_calidad.id if control_calidad else 'None'}"
-        )
-        print(
-            f"DEBUG: Control calidad aprobado: {control_calidad.aprobado if control_calidad else 'False'}"
-        )
-        print(
-            f"DEBUG: Control calidad tiene firma: {control_calidad.firma_control_calidad if control_calidad else 'False'}"
-        )
-
         tiene_firma = (
             control_calidad and
             control_calidad.aprobado and
-            control_calidad.firma_control_calidad is not None
+            control_calidad.firma_control_calidad_id is not None
         )
 
         if tiene_firma:
             self.estado_aprobacion = "APROBADO"
             self.control_calidad = True
-            print(
-                f"DEBUG: Material envase primario {self.id} APROBADO (tiene firma en control calidad)"
-            )
         else:
             self.estado_aprobacion = "PENDIENTE"
             self.control_calidad = False
-            print(
-                f"DEBUG: Material envase primario {self.id} PENDIENTE (sin firma)"
-            )
 
-        self.save()
-        print(
-            f"DEBUG: Material envase primario {self.id} guardado, estado: {self.estado_aprobacion}, control_calidad: {self.control_calidad}"
+        # solo lo que cambia: no pisa control_calidad_vigente
+        self.save(update_fields=["estado_aprobacion", "control_calidad"])
+        logger.debug(
+            "Material envase primario %s guardado, estado: %s (control calidad: %s)",
+            self.id, self.estado_aprobacion,
+            control_calidad.id if control_calidad else None,
+            extra={"material_envase_primario_id": self.id},
         )
 
     def __str__(self):
@@ -400,60 +774,51 @@ class MaterialEnvaseSecundarioEmpaque(models.Model):
 
     control_calidad = models.BooleanField(default=False)
 
+    # último ControlCalidad aprobado (por fecha_verificacion, id); lo
+    # mantiene ControlCalidad al guardarse o eliminarse
+    control_calidad_vigente = models.ForeignKey(
+        "ControlCalidad", null=True, blank=True, on_delete=models.SET_NULL,
+        related_name="+",
+    )
+
     estado_aprobacion = models.CharField(
         max_length=20, choices=ESTADOS_APROBACION, default="PENDIENTE"
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["estado_aprobacion", "id"], name="mes_estado_idx"
+            ),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.codigo_calidad:
-            last = MaterialEnvaseSecundarioEmpaque.objects.order_by(
-                "-id").first()
-            next_num = 1
-            if last and last.codigo_calidad:
-                try:
-                    next_num = int(last.codigo_calidad.split("-")[-1]) + 1
-                except Exception:
-                    next_num = 1
-            self.codigo_calidad = f"MES-{next_num:04d}"
+            self.codigo_calidad = SecuenciaCodigo.siguiente("MES")
 
         super().save(*args, **kwargs)
 
     def actualizar_estado_aprobacion(self, control_calidad):
-        print(
-            f"DEBUG: Actualizando estado de material envase secundario {self.id}"
-        )
-        print(
-            f"DEBUG: Control calidad asociado: {control_calidad.id if control_calidad else 'None'}"
-        )
-        print(
-            f"DEBUG: Control calidad aprobado: {control_calidad.aprobado if control_calidad else 'False'}"
-        )
-        print(
-            f"DEBUG: Control calidad tiene firma: {control_calidad.firma_control_calidad if control_calidad else 'False'}"
-        )
-
         tiene_firma = (
             control_calidad and
             control_calidad.aprobado and
-            control_calidad.firma_control_calidad is not None
+            control_calidad.firma_control_calidad_id is not None
         )
 
         if tiene_firma:
             self.estado_aprobacion = "APROBADO"
             self.control_calidad = True
-            print(
-                f"DEBUG: Material envase secundario {self.id} APROBADO (tiene firma en control calidad)"
-            )
         else:
             self.estado_aprobacion = "PENDIENTE"
             self.control_calidad = False
-            print(
-                f"DEBUG: Material envase secundario {self.id} PENDIENTE (sin firma)"
-            )
 
-        self.save()
-        print(
-            f"DEBUG: Material envase secundario {self.id} guardado, estado: {self.estado_aprobacion}, control_calidad: {self.control_calidad}"
+        # solo lo que cambia: no pisa control_calidad_vigente
+        self.save(update_fields=["estado_aprobacion", "control_calidad"])
+        logger.debug(
+            "Material envase secundario %s guardado, estado: %s (control calidad: %s)",
+            self.id, self.estado_aprobacion,
+            control_calidad.id if control_calidad else None,
+            extra={"material_envase_secundario_id": self.id},
         )
 
     def __str__(self):
@@ -471,15 +836,83 @@ class Bodega(models.Model):
         ("PT", "Producto Terminado"),
     ]
 
+    # nombre con que se crea la bodega principal si aún no existe
+    NOMBRES_PRINCIPALES = {
+        "MP": "Bodega Materias Primas",
+        "EP": "Bodega Envase Primario",
+        "ES": "Bodega Envase Secundario",
+    }
+
     nombre = models.CharField(max_length=255, unique=True)
     tipo = models.CharField(max_length=2, choices=TIPO_CHOICES)
     ubicacion = models.CharField(max_length=255, blank=True)
     es_principal = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # filtro por tipo y búsqueda de la principal de cada tipo
+            models.Index(
+                fields=["tipo", "es_principal"], name="bodega_tipo_idx"
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        Bodega.limpiar_principales()
+
+    def delete(self, *args, **kwargs):
+        resultado = super().delete(*args, **kwargs)
+        Bodega.limpiar_principales()
+        return resultado
+
+    @classmethod
+    def principal(cls, tipo, crear=True):
+        """
+        Bodega principal del tipo, desde un registro en memoria del proceso:
+        solo la primera búsqueda por tipo va a la base. Con crear=True, si
+        no existe se crea con el nombre de NOMBRES_PRINCIPALES; con
+        crear=False devuelve None.
+
+        El registro se vacía al guardar o eliminar una Bodega desde el ORM
+        de instancia (no con QuerySet.update/delete).
+        """
+        bodega = _bodegas_principales.get(tipo)
+        if bodega is not None:
+            return bodega
+
+        bodega = cls.objects.filter(tipo=tipo, es_principal=True).first()
+        if bodega is None and crear:
+            # Bodega.save ya vacía el registro; no se guarda una bodega
+            # creada en una transacción que todavía puede revertirse
+            bodega, _ = cls.objects.get_or_create(
+                nombre=cls.NOMBRES_PRINCIPALES.get(tipo, f"Bodega {tipo}"),
+                defaults={
+                    "tipo": tipo,
+                    "ubicacion": "Principal",
+                    "es_principal": True,
+                },
+            )
+            if connection.in_atomic_block:
+                return bodega
+        if bodega is not None:
+            _bodegas_principales[tipo] = bodega
+        return bodega
+
+    @staticmethod
+    def limpiar_principales():
+        _bodegas_principales.clear()
+        # otro hilo pudo volver a leer la versión anterior antes del
+        # commit: se vacía de nuevo al confirmarse la transacción
+        transaction.on_commit(_bodegas_principales.clear)
+
     def __str__(self):
         return f"{self.nombre} ({self.get_tipo_display()})"
 
 
+# tipo -> Bodega principal (ver Bodega.principal)
+_bodegas_principales = {}
+
+
 class StockMateriaPrima(models.Model):
     bodega = models.ForeignKey(
         Bodega, on_delete=models.CASCADE, related_name="stocks_materia_prima"
@@ -539,6 +972,164 @@ class StockMaterialEnvaseSecundarioEmpaque(models.Model):
         return f"Stock ES {self.material_envase_secundario_empaque} en {self.bodega}: {self.cantidad_disponible}"
 
 
+# =======================================================
+# MOVIMIENTOS DE STOCK (LIBRO MAYOR)
+# =======================================================
+class MovimientoStock(models.Model):
+    """
+    Libro de movimientos, solo se agregan filas. Cada entrada, salida o
+    ajuste es una fila con la cantidad con signo, y el saldo del stock se
+    actualiza en la misma transacción con un UPDATE atómico
+    (cantidad_disponible = cantidad_disponible + cantidad). El saldo de
+    cualquier stock es la suma de sus movimientos.
+    """
+
+    TIPO_CHOICES = [
+        ("ENTRADA", "Entrada"),
+        ("SALIDA", "Salida"),
+        ("AJUSTE", "Ajuste"),
+    ]
+
+    # campo del material -> modelo de stock
+    STOCKS = {
+        "materia_prima": StockMateriaPrima,
+        "material_envase_primario": StockMaterialEnvasePrimario,
+        "material_envase_secundario_empaque": StockMaterialEnvaseSecundarioEmpaque,
+    }
+
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES)
+    bodega = models.ForeignKey(
+        Bodega, on_delete=models.PROTECT, related_name="movimientos"
+    )
+
+    materia_prima = models.ForeignKey(
+        MateriaPrima, null=True, blank=True,
+        on_delete=models.PROTECT, related_name="movimientos"
+    )
+    material_envase_primario = models.ForeignKey(
+        MaterialEnvasePrimario, null=True, blank=True,
+        on_delete=models.PROTECT, related_name="movimientos"
+    )
+    material_envase_secundario_empaque = models.ForeignKey(
+        MaterialEnvaseSecundarioEmpaque, null=True, blank=True,
+        on_delete=models.PROTECT, related_name="movimientos"
+    )
+
+    # positiva para entradas, negativa para salidas
+    cantidad = models.DecimalField(max_digits=12, decimal_places=2)
+
+    referencia = models.CharField(max_length=100, blank=True)
+    usuario = models.CharField(max_length=100, blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["fecha_creacion", "id"],
+                name="mov_fecha_creacion_id_idx",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValidationError(
+                "Los movimientos de stock no se modifican; registre un ajuste."
+            )
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValidationError(
+            "Los movimientos de stock no se eliminan; registre un ajuste."
+        )
+
+    @classmethod
+    def _campo_material(cls, material):
+        for campo, stock_model in cls.STOCKS.items():
+            modelo = stock_model._meta.get_field(campo).related_model
+            if isinstance(material, modelo):
+                return campo, stock_model
+        raise TypeError(f"Material sin stock asociado: {material!r}")
+
+    @classmethod
+    def registrar(cls, bodega, material, cantidad, tipo,
+                  referencia="", usuario=""):
+        """
+        Inserta el movimiento y aplica `cantidad` al saldo en una sola
+        transacción. Una salida sin saldo suficiente no se registra y
+        levanta ValidationError (no se recorta a 0).
+        """
+        with transaction.atomic():
+            return cls._aplicar(
+                bodega, material, cantidad, tipo, referencia, usuario
+            )
+
+    @classmethod
+    def _aplicar(cls, bodega, material, cantidad, tipo, referencia, usuario):
+        # Debe correr dentro de una transacción abierta por el llamador.
+        campo, stock_model = cls._campo_material(material)
+        filtro = stock_model.objects.filter(bodega=bodega, **{campo: material})
+        if cantidad < 0:
+            destino = filtro.filter(cantidad_disponible__gte=-cantidad)
+        else:
+            destino = filtro
+        cambios = {
+            "cantidad_disponible": F("cantidad_disponible") + cantidad,
+            "fecha_actualizacion": timezone.now(),
+        }
+
+        if not destino.update(**cambios):
+            if cantidad < 0:
+                raise ValidationError({
+                    "cantidad_entregada": (
+                        f"No hay stock suficiente de {material} en "
+                        f"{bodega.nombre}."
+                    )
+                })
+            stock_model.objects.get_or_create(
+                bodega=bodega, **{campo: material}
+            )
+            filtro.update(**cambios)
+
+        return cls.objects.create(
+            tipo=tipo,
+            bodega=bodega,
+            cantidad=cantidad,
+            referencia=referencia,
+            usuario=usuario,
+            **{campo: material},
+        )
+
+    @classmethod
+    def ajustar(cls, bodega, material, nuevo_saldo,
+                referencia="", usuario=""):
+        """
+        Lleva el saldo a `nuevo_saldo` registrando la diferencia como
+        AJUSTE. Devuelve (stock con el saldo actualizado, creado).
+        """
+        if nuevo_saldo < 0:
+            raise ValidationError({
+                "cantidad_disponible": "El stock no puede ser negativo."
+            })
+
+        campo, stock_model = cls._campo_material(material)
+        with transaction.atomic():
+            stock, creado = (
+                stock_model.objects.select_for_update()
+                .get_or_create(bodega=bodega, **{campo: material})
+            )
+            diferencia = nuevo_saldo - stock.cantidad_disponible
+            if diferencia:
+                cls._aplicar(
+                    bodega, material, diferencia, "AJUSTE",
+                    referencia, usuario,
+                )
+                stock.refresh_from_db()
+        return stock, creado
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.cantidad} en {self.bodega}"
+
+
 # =======================================================
 # CONTROL CALIDAD
 # =======================================================
@@ -558,20 +1149,21 @@ class ControlCalidad(models.Model):
         blank=True,
     )
 
+    # sin índice propio: cc_*_fecha_idx empieza por cada FK
     materia_prima = models.ForeignKey(
-        MateriaPrima, null=True, blank=True,
+        MateriaPrima, null=True, blank=True, db_index=False,
         on_delete=models.CASCADE, related_name="controles_calidad"
     )
 
     material_envase_primario = models.ForeignKey(
-        MaterialEnvasePrimario, null=True, blank=True,
+        MaterialEnvasePrimario, null=True, blank=True, db_index=False,
         on_delete=models.CASCADE,
         related_name="controles_calidad_envase_primario"
     )
 
     material_envase_secundario_empaque = models.ForeignKey(
         MaterialEnvaseSecundarioEmpaque, null=True, blank=True,
-        on_delete=models.CASCADE,
+        db_index=False, on_delete=models.CASCADE,
         related_name="controles_calidad_envase_secundario"
     )
 
@@ -581,31 +1173,150 @@ class ControlCalidad(models.Model):
         related_name="controles_a_firmar"
     )
 
+    # sin índice propio: cc_firma_fecha_idx empieza por la firma
     firma_control_calidad = models.ForeignKey(
-        "RegistroFirma", null=True, blank=True, on_delete=models.SET_NULL,
+        "RegistroFirma", null=True, blank=True, db_index=False,
+        on_delete=models.SET_NULL,
         related_name="firmas_cc"
     )
 
+    class Meta:
+        indexes = [
+            # último control de un material (resumen y prefetch de los
+            # serializers de material)
+            models.Index(
+                fields=["materia_prima", "-fecha_verificacion", "-id"],
+                name="cc_mp_fecha_idx",
+            ),
+            models.Index(
+                fields=[
+                    "material_envase_primario", "-fecha_verificacion", "-id",
+                ],
+                name="cc_mep_fecha_idx",
+            ),
+            models.Index(
+                fields=[
+                    "material_envase_secundario_empaque",
+                    "-fecha_verificacion", "-id",
+                ],
+                name="cc_mes_fecha_idx",
+            ),
+            # último control APROBADO, el que se asigna a cada planilla
+            models.Index(
+                fields=["materia_prima", "-fecha_verificacion", "-id"],
+                condition=Q(aprobado=True),
+                name="cc_mp_aprobado_idx",
+            ),
+            models.Index(
+                fields=[
+                    "material_envase_primario", "-fecha_verificacion", "-id",
+                ],
+                condition=Q(aprobado=True),
+                name="cc_mep_aprobado_idx",
+            ),
+            models.Index(
+                fields=[
+                    "material_envase_secundario_empaque",
+                    "-fecha_verificacion", "-id",
+                ],
+                condition=Q(aprobado=True),
+                name="cc_mes_aprobado_idx",
+            ),
+            # conteo por aprobado del tablero
+            models.Index(fields=["aprobado"], name="cc_aprobado_idx"),
+            # por firma, y bandeja del inspector (firma IS NULL) por fecha
+            models.Index(
+                fields=["firma_control_calidad", "fecha_verificacion", "id"],
+                name="cc_firma_fecha_idx",
+            ),
+        ]
+
+    CAMPOS_MATERIAL = (
+        "materia_prima",
+        "material_envase_primario",
+        "material_envase_secundario_empaque",
+    )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # si el control cambia de material, el anterior también se recalcula
+        instancia._materiales_cargados = {
+            (campo, instancia.__dict__.get(f"{campo}_id"))
+            for campo in cls.CAMPOS_MATERIAL
+        }
+        return instancia
+
     def save(self, *args, **kwargs):
         if not self.codigo_control_calidad:
-            last = ControlCalidad.objects.order_by("-id").first()
-            next_num = 1
-            if last and last.codigo_control_calidad:
-                try:
-                    next_num = int(
-                        last.codigo_control_calidad.split("-")[-1]
-                    ) + 1
-                except Exception:
-                    next_num = 1
-
-            self.codigo_control_calidad = f"CC-{next_num:04d}"
-
-        super().save(*args, **kwargs)
+            self.codigo_control_calidad = SecuenciaCodigo.siguiente("CC")
+
+        # sin savepoint: se une a la transacción de la firma si la hay
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            self.actualizar_vigentes()
+
+    def delete(self, *args, **kwargs):
+        materiales = self._materiales_relacionados()
+        with transaction.atomic(savepoint=False):
+            resultado = super().delete(*args, **kwargs)
+            self.actualizar_vigentes(materiales)
+        return resultado
+
+    def _materiales_relacionados(self):
+        materiales = {
+            (campo, getattr(self, f"{campo}_id"))
+            for campo in self.CAMPOS_MATERIAL
+        }
+        materiales |= getattr(self, "_materiales_cargados", set())
+        return {(campo, pk) for campo, pk in materiales if pk is not None}
+
+    def actualizar_vigentes(self, materiales=None):
+        """
+        Deja en control_calidad_vigente de cada material de este control
+        el aprobado más reciente. Un UPDATE por material, con la búsqueda
+        ordenada como subconsulta sobre cc_*_aprobado_idx; así la planilla
+        lee su control por clave primaria.
+        """
+        if materiales is None:
+            materiales = self._materiales_relacionados()
+        for campo, material_id in materiales:
+            vigente = ControlCalidad.objects.filter(
+                aprobado=True, **{f"{campo}_id": material_id}
+            ).order_by("-fecha_verificacion", "-id").values("pk")[:1]
+            modelo = self._meta.get_field(campo).related_model
+            modelo.objects.filter(pk=material_id).update(
+                control_calidad_vigente=Subquery(vigente)
+            )
+        self._materiales_cargados = {
+            (campo, getattr(self, f"{campo}_id"))
+            for campo in self.CAMPOS_MATERIAL
+        }
 
     def __str__(self):
         return self.codigo_control_calidad
 
 
+def _indices_firma(prefijo):
+    """
+    Índices (firma, fecha_creacion, id) de las planillas, en lugar del de
+    cada FK de firma: además de las búsquedas por firma, resuelven "sin
+    esta firma, de la más antigua a la más nueva" (firma IS NULL) sin
+    ordenar, que es la bandeja de firmas pendientes de cada rol.
+    """
+    return [
+        models.Index(
+            fields=[campo, "fecha_creacion", "id"],
+            name=f"{prefijo}_firma_{sufijo}_idx",
+        )
+        for campo, sufijo in (
+            ("firma_jefe_seccion", "jsec"),
+            ("firma_jefe_produccion", "jprod"),
+            ("firma_quimico_farmaceutico", "qf"),
+        )
+    ]
+
+
 # =======================================================
 # PLANILLA FABRICACIÓN
 # =======================================================
@@ -667,17 +1378,21 @@ class PlanillaFabricacion(ModeloAuditoria):
 
     materia_prima = models.ForeignKey(MateriaPrima, on_delete=models.CASCADE)
 
+    # sin índice propio: pf_firma_*_idx empieza por cada firma
     firma_jefe_seccion = models.ForeignKey(
-        "RegistroFirma", null=True, blank=True, on_delete=models.SET_NULL,
+        "RegistroFirma", null=True, blank=True, db_index=False,
+        on_delete=models.SET_NULL,
         related_name="firma_js_fabricacion"
     )
     firma_jefe_produccion = models.ForeignKey(
-        "RegistroFirma", null=True, blank=True, on_delete=models.SET_NULL,
+        "RegistroFirma", null=True, blank=True, db_index=False,
+        on_delete=models.SET_NULL,
         related_name="firma_jp_fabricacion"
     )
     # OJO: se elimina firma_inspector_calidad de la planilla
     firma_quimico_farmaceutico = models.ForeignKey(
-        "RegistroFirma", null=True, blank=True, on_delete=models.SET_NULL,
+        "RegistroFirma", null=True, blank=True, db_index=False,
+        on_delete=models.SET_NULL,
         related_name="firma_qf_fabricacion"
     )
 
@@ -690,6 +1405,31 @@ class PlanillaFabricacion(ModeloAuditoria):
         max_length=20, choices=ESTADOS_APROBACION, default="EN_PROCESO"
     )
 
+    class Meta:
+        indexes = [
+            # paginación por cursor (fecha_creacion, id)
+            models.Index(
+                fields=["fecha_creacion", "id"],
+                name="pf_fecha_creacion_id_idx",
+            ),
+            # filtro por estado con el mismo orden del cursor
+            models.Index(
+                fields=["estado_aprobacion", "fecha_creacion", "id"],
+                name="pf_estado_fecha_idx",
+            ),
+            # filtro por tipo de movimiento con el orden del cursor
+            models.Index(
+                fields=["tipo_movimiento", "fecha_creacion", "id"],
+                name="pf_tipo_mov_fecha_idx",
+            ),
+            models.Index(
+                fields=["fecha_emision", "id"],
+                name="pf_fecha_emision_idx",
+            ),
+            # firmas y bandeja de firmas pendientes de cada rol
+            *_indices_firma("pf"),
+        ]
+
     def clean(self):
         if (
             self.fecha_emision
@@ -745,6 +1485,13 @@ class PlanillaEnvase(ModeloAuditoria):
         max_length=20, choices=ESTADOS_APROBACION, default="EN_PROCESO"
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["estado_aprobacion", "id"], name="pe_estado_idx"
+            ),
+        ]
+
     def clean(self):
         if (
             self.fecha_emision
@@ -825,17 +1572,21 @@ class PlanillaEnvasePrimario(ModeloAuditoria):
         MaterialEnvasePrimario, on_delete=models.CASCADE
     )
 
+    # sin índice propio: pep_firma_*_idx empieza por cada firma
     firma_jefe_seccion = models.ForeignKey(
-        "RegistroFirma", null=True, blank=True, on_delete=models.SET_NULL,
+        "RegistroFirma", null=True, blank=True, db_index=False,
+        on_delete=models.SET_NULL,
         related_name="firma_js_envase_primario"
     )
     firma_jefe_produccion = models.ForeignKey(
-        "RegistroFirma", null=True, blank=True, on_delete=models.SET_NULL,
+        "RegistroFirma", null=True, blank=True, db_index=False,
+        on_delete=models.SET_NULL,
         related_name="firma_jp_envase_primario"
     )
     # OJO: se elimina firma_inspector_calidad en envase primario
     firma_quimico_farmaceutico = models.ForeignKey(
-        "RegistroFirma", null=True, blank=True, on_delete=models.SET_NULL,
+        "RegistroFirma", null=True, blank=True, db_index=False,
+        on_delete=models.SET_NULL,
         related_name="firma_qf_envase_primario"
     )
 
@@ -843,6 +1594,36 @@ class PlanillaEnvasePrimario(ModeloAuditoria):
         max_length=20, choices=ESTADOS_APROBACION, default="EN_PROCESO"
     )
 
+    class Meta:
+        indexes = [
+            # paginación por cursor (fecha_creacion, id)
+            models.Index(
+                fields=["fecha_creacion", "id"],
+                name="pep_fecha_creacion_id_idx",
+            ),
+            # filtro por estado con el mismo orden del cursor
+            models.Index(
+                fields=["estado_aprobacion", "fecha_creacion", "id"],
+                name="pep_estado_fecha_idx",
+            ),
+            # filtro por tipo de movimiento con el orden del cursor
+            models.Index(
+                fields=["tipo_movimiento", "fecha_creacion", "id"],
+                name="pep_tipo_mov_fecha_idx",
+            ),
+            models.Index(
+                fields=["fecha_emision", "id"],
+                name="pep_fecha_emision_idx",
+            ),
+            # trazabilidad: planillas del mismo lote y producto
+            models.Index(
+                fields=["batch_standart", "producto"],
+                name="pep_batch_producto_idx",
+            ),
+            # firmas y bandeja de firmas pendientes de cada rol
+            *_indices_firma("pep"),
+        ]
+
     def clean(self):
         if (
             self.fecha_emision
@@ -917,16 +1698,20 @@ class PlanillaEnvaseSecundarioEmpaque(ModeloAuditoria):
         MaterialEnvaseSecundarioEmpaque, on_delete=models.CASCADE
     )
 
+    # sin índice propio: pes_firma_*_idx empieza por cada firma
     firma_jefe_seccion = models.ForeignKey(
-        "RegistroFirma", null=True, blank=True, on_delete=models.SET_NULL,
+        "RegistroFirma", null=True, blank=True, db_index=False,
+        on_delete=models.SET_NULL,
         related_name="firma_js_envase_secundario"
     )
     firma_jefe_produccion = models.ForeignKey(
-        "RegistroFirma", null=True, blank=True, on_delete=models.SET_NULL,
+        "RegistroFirma", null=True, blank=True, db_index=False,
+        on_delete=models.SET_NULL,
         related_name="firma_jp_envase_secundario"
     )
     firma_quimico_farmaceutico = models.ForeignKey(
-        "RegistroFirma", null=True, blank=True, on_delete=models.SET_NULL,
+        "RegistroFirma", null=True, blank=True, db_index=False,
+        on_delete=models.SET_NULL,
         related_name="firma_qf_envase_secundario"
     )
 
@@ -934,6 +1719,36 @@ class PlanillaEnvaseSecundarioEmpaque(ModeloAuditoria):
         max_length=20, choices=ESTADOS_APROBACION, default="EN_PROCESO"
     )
 
+    class Meta:
+        indexes = [
+            # paginación por cursor (fecha_creacion, id)
+            models.Index(
+                fields=["fecha_creacion", "id"],
+                name="pes_fecha_creacion_id_idx",
+            ),
+            # filtro por estado con el mismo orden del cursor
+            models.Index(
+                fields=["estado_aprobacion", "fecha_creacion", "id"],
+                name="pes_estado_fecha_idx",
+            ),
+            # filtro por tipo de movimiento con el orden del cursor
+            models.Index(
+                fields=["tipo_movimiento", "fecha_creacion", "id"],
+                name="pes_tipo_mov_fecha_idx",
+            ),
+            models.Index(
+                fields=["fecha_emision", "id"],
+                name="pes_fecha_emision_idx",
+            ),
+            # trazabilidad: planillas del mismo lote y producto
+            models.Index(
+                fields=["batch_standart", "producto"],
+                name="pes_batch_producto_idx",
+            ),
+            # firmas y bandeja de firmas pendientes de cada rol
+            *_indices_firma("pes"),
+        ]
+
     def clean(self):
         if (
             self.fecha_emision
@@ -953,6 +1768,33 @@ class PlanillaEnvaseSecundarioEmpaque(ModeloAuditoria):
         self.estado_aprobacion = "APROBADO" if all(firmas) else "EN_PROCESO"
         self.save(update_fields=["estado_aprobacion"])
 
+    def descontar_stock_aprobado(self):
+        """
+        Salida de la bodega principal ES por lo entregado en un pedido a
+        bodega, al quedar la planilla APROBADA. Debe correr en la misma
+        transacción que la firma que la aprueba (ver RegistroFirma).
+        Sin saldo suficiente no se descuenta: la firma vale igual.
+        """
+        if self.tipo_movimiento != "PEDIDO_BODEGA":
+            return
+        if self.cantidad_entregada is None or self.cantidad_entregada <= 0:
+            return
+
+        try:
+            MovimientoStock.registrar(
+                Bodega.principal("ES"),
+                self.material_envase_secundario_empaque,
+                -self.cantidad_entregada, "SALIDA",
+                referencia=f"PlanillaEnvaseSecundarioEmpaque:{self.id}",
+                usuario=self.usuario_creacion,
+            )
+        except ValidationError:
+            logger.warning(
+                "No se descuenta stock ES de la planilla %s; solicitado=%s",
+                self.id, self.cantidad_entregada,
+                extra={"planilla_envase_secundario_empaque_id": self.id},
+            )
+
     def __str__(self):
         return f"EnvSec {self.serie}-{self.numero_planilla}"
 
@@ -976,5 +1818,66 @@ class Jarabe(models.Model):
         PlanillaEnvasePrimario, null=True, blank=True, on_delete=models.SET_NULL
     )
 
+    # sube cada vez que cambia algo del dossier (ver GPQAPI/dossier.py)
+    version_dossier = models.PositiveIntegerField(default=0, editable=False)
+
+    # campo del jarabe que apunta a cada tipo de planilla
+    CAMPO_PLANILLA = {
+        "PlanillaFabricacion": "planilla_fabricacion",
+        "PlanillaEnvase": "planilla_envase",
+        "PlanillaEnvasePrimario": "planilla_envase_primario",
+    }
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["lote"], name="jarabe_lote_idx"),
+        ]
+
+    @classmethod
+    def invalidar_dossieres(cls, condicion):
+        """Nueva versión del dossier de los jarabes que cumplen la condición."""
+        return cls.objects.filter(condicion).update(
+            version_dossier=F("version_dossier") + 1
+        )
+
     def __str__(self):
         return f"Jarabe {self.producto.nombre} | Lote {self.lote}"
+
+
+# =======================================================
+# VERSIONES DEL TABLERO
+# =======================================================
+class VersionTablero(models.Model):
+    """
+    Versión de cada grupo del resumen del tablero (ver GPQAPI/tablero.py).
+    Va en la clave de la caché: subirla invalida el grupo en todos los
+    workers, aunque cada uno tenga su propia caché.
+    """
+
+    grupo = models.CharField(max_length=30, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    @classmethod
+    def vigentes(cls, grupos):
+        """{grupo: versión}; 0 para los que nunca cambiaron."""
+        versiones = dict(
+            cls.objects.filter(grupo__in=grupos).values_list(
+                "grupo", "version"
+            )
+        )
+        return {grupo: versiones.get(grupo, 0) for grupo in grupos}
+
+    @classmethod
+    def subir(cls, grupos):
+        """Nueva versión de los grupos: un UPDATE (y un INSERT la primera vez)."""
+        grupos = sorted(set(grupos))
+        if cls.objects.filter(grupo__in=grupos).update(
+            version=F("version") + 1
+        ) < len(grupos):
+            cls.objects.bulk_create(
+                [cls(grupo=grupo, version=1) for grupo in grupos],
+                ignore_conflicts=True,
+            )
+
+    def __str__(self):
+        return f"{self.grupo}: {self.version}"
@@ -0,0 +1,121 @@
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+# ===========================================================
+# PAGINACIÓN POR CURSOR (TABLAS DE ALTO VOLUMEN)
+# ===========================================================
+class CursorFechaCreacionPagination(CursorPagination):
+    """
+    Paginación por cursor sobre (fecha_creacion, id), del más nuevo al más
+    antiguo. No hace COUNT(*) ni OFFSET: el cursor guarda todos los campos
+    del orden de la última fila entregada y la página siguiente se busca
+    por el índice con la comparación de esa tupla, así que una página
+    profunda (o con muchas fechas repetidas) cuesta lo mismo que la
+    primera. El cliente elige ?page_size= hasta max_page_size.
+
+    El CursorPagination de DRF guarda solo el primer campo y salta los
+    empates con OFFSET; aquí la posición ya es única (el orden siempre
+    termina en id, ver FiltroIndexado.get_ordering) y el OFFSET queda en 0.
+    """
+
+    ordering = ("-fecha_creacion", "-id")
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+    def _get_position_from_instance(self, instance, ordering):
+        valores = []
+        for campo in ordering:
+            nombre = campo.lstrip("-")
+            if isinstance(instance, dict):
+                valor = instance[nombre]
+            else:
+                valor = getattr(instance, nombre)
+            valores.append(str(valor))
+        return json.dumps(valores)
+
+    def _despues_de(self, posicion, invertido):
+        """
+        Filas que siguen a `posicion` en el orden de la consulta:
+        (a < x) OR (a = x AND b < y) ..., más la cota del primer campo
+        para que la búsqueda recorra el índice desde ese punto.
+        """
+        condicion = Q()
+        iguales = {}
+        for campo, valor in zip(self.ordering, posicion):
+            nombre = campo.lstrip("-")
+            operador = "lt" if campo.startswith("-") != invertido else "gt"
+            condicion |= Q(**iguales, **{f"{nombre}__{operador}": valor})
+            iguales[nombre] = valor
+        primero = self.ordering[0]
+        cota = "lte" if primero.startswith("-") != invertido else "gte"
+        return Q(**{f"{primero.lstrip('-')}__{cota}": posicion[0]}) & condicion
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            reverse, posicion_actual = False, None
+        else:
+            reverse, posicion_actual = self.cursor.reverse, self.cursor.position
+
+        if reverse:
+            queryset = queryset.order_by(*(
+                campo[1:] if campo.startswith("-") else f"-{campo}"
+                for campo in self.ordering
+            ))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if posicion_actual is not None:
+            try:
+                posicion = json.loads(posicion_actual)
+            except ValueError:
+                posicion = None
+            if (
+                not isinstance(posicion, list)
+                or len(posicion) != len(self.ordering)
+            ):
+                raise NotFound(self.invalid_cursor_message)
+            queryset = queryset.filter(self._despues_de(posicion, reverse))
+
+        # una fila de más indica si hay página siguiente
+        resultados = list(queryset[:self.page_size + 1])
+        self.page = resultados[:self.page_size]
+        siguiente = None
+        if len(resultados) > len(self.page):
+            siguiente = self._get_position_from_instance(
+                resultados[-1], self.ordering
+            )
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = posicion_actual is not None
+            self.has_previous = siguiente is not None
+            self.next_position = posicion_actual
+            self.previous_position = siguiente
+        else:
+            self.has_next = siguiente is not None
+            self.has_previous = posicion_actual is not None
+            self.next_position = siguiente
+            self.previous_position = posicion_actual
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+
+class CursorTimestampFirmaPagination(CursorFechaCreacionPagination):
+    """Igual que la anterior, sobre (timestamp_firma, id) de RegistroFirma."""
+
+    ordering = ("-timestamp_firma", "-id")
@@ -1,24 +1,184 @@
+from django.db import transaction
+from django.db.models import Prefetch
 from rest_framework import serializers
+from . import bandeja, busqueda
 from .models import (
     UsuarioPersonalizado, PerfilUsuario,
-    RegistroFirma, TipoProducto, Producto,
+    RegistroFirma, SesionFirma, TipoProducto, Producto,
     MateriaPrima, MaterialEnvasePrimario, MaterialEnvaseSecundarioEmpaque,
     ControlCalidad,
     PlanillaFabricacion, PlanillaEnvase,
     PlanillaEnvasePrimario, PlanillaEnvaseSecundarioEmpaque, Jarabe,
     Bodega, StockMateriaPrima,
     StockMaterialEnvasePrimario,
-    StockMaterialEnvaseSecundarioEmpaque,
+    StockMaterialEnvaseSecundarioEmpaque, MovimientoStock,
 )
 
 import hashlib
 import datetime
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+
+# =====================================================
+# CAMPOS DINÁMICOS (?fields= / ?expand=)
+# =====================================================
+def _lista_parametro(valor):
+    return {v.strip() for v in (valor or "").split(",") if v.strip()}
+
+
+def _ruta_relacion(modelo, atributos):
+    """
+    Recorre los atributos mientras sean FK/OneToOne directos y devuelve la
+    ruta para select_related ("firma_jefe_seccion__usuario"), o "".
+    """
+    ruta = []
+    for attr in atributos:
+        try:
+            campo = modelo._meta.get_field(attr)
+        except Exception:
+            break
+        if not (campo.many_to_one or campo.one_to_one) or not campo.concrete:
+            break
+        ruta.append(attr)
+        modelo = campo.related_model
+    return "__".join(ruta)
+
+
+class CamposDinamicosMixin:
+    """
+    Respuestas a medida del cliente:
+
+    - ?fields=id,estado_aprobacion  entrega solo esos campos (solo lectura).
+    - ?expand=firma_jefe_seccion_info  incluye objetos anidados, que por
+      defecto no se envían. Se listan en Meta.expandable_fields.
+      expand=* los incluye todos.
+
+    Ambos aceptan rutas con punto para los serializers anidados
+    (expand=material_detalle.control_calidad_info).
+    Los serializers anidados reciben sus parámetros del padre; solo el
+    serializer raíz lee la request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._fields_pedidos = kwargs.pop("fields", None)
+        self._expand_pedidos = kwargs.pop("expand", None)
+        super().__init__(*args, **kwargs)
+
+    def _parametros(self):
+        if self._fields_pedidos is not None or self._expand_pedidos is not None:
+            return (
+                set(self._fields_pedidos) if self._fields_pedidos else None,
+                set(self._expand_pedidos or ()),
+            )
+
+        padre, nombre = self.parent, self.field_name
+        if isinstance(padre, serializers.ListSerializer):
+            padre, nombre = padre.parent, padre.field_name
+        if padre is not None:
+            if isinstance(padre, CamposDinamicosMixin):
+                return padre._parametros_hijo(nombre)
+            return None, set()
+
+        request = self.context.get("request")
+        if request is None:
+            return None, set()
+        params = getattr(request, "query_params", request.GET)
+        pedidos = None
+        if request.method in ("GET", "HEAD", "OPTIONS"):
+            pedidos = _lista_parametro(params.get("fields")) or None
+        return pedidos, _lista_parametro(params.get("expand"))
+
+    def _parametros_hijo(self, nombre):
+        pedidos, expandir = self._parametros()
+        prefijo = f"{nombre}."
+        if pedidos is not None:
+            pedidos = {
+                f[len(prefijo):] for f in pedidos if f.startswith(prefijo)
+            } or None
+        if "*" in expandir:
+            expandir = {"*"}
+        else:
+            expandir = {
+                e[len(prefijo):] for e in expandir if e.startswith(prefijo)
+            }
+        return pedidos, expandir
+
+    def get_fields(self):
+        campos = super().get_fields()
+        pedidos, expandir = self._parametros()
+        meta = getattr(self, "Meta", None)
+
+        # "material_detalle.codigo" pide también "material_detalle"
+        pedidos = {f.split(".", 1)[0] for f in pedidos or ()}
+        expandir = {e.split(".", 1)[0] for e in expandir}
+
+        for nombre in getattr(meta, "expandable_fields", ()):
+            if (
+                "*" not in expandir
+                and nombre not in expandir
+                and nombre not in pedidos
+            ):
+                campos.pop(nombre, None)
+
+        if pedidos:
+            for nombre in list(campos):
+                if nombre not in pedidos:
+                    campos.pop(nombre)
+        return campos
+
+    def cargar(self, queryset, prefetch=True):
+        """
+        Aplica al queryset los select_related / prefetch_related que
+        necesitan los campos que este serializer va a renderizar.
+        """
+        select, prefetches = [], []
+        self._plan_de_carga("", select, prefetches)
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch and prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+        return queryset
+
+    def _plan_de_carga(self, prefijo, select, prefetches):
+        meta = getattr(self, "Meta", None)
+        modelo = getattr(meta, "model", None)
+        if modelo is None:
+            return
+        prefetch_fields = getattr(meta, "prefetch_fields", {})
+
+        for nombre, campo in self.fields.items():
+            if isinstance(campo, serializers.BaseSerializer):
+                anidado = getattr(campo, "child", campo)
+                ruta = _ruta_relacion(modelo, campo.source_attrs)
+                if ruta and isinstance(anidado, CamposDinamicosMixin):
+                    select.append(prefijo + ruta)
+                    anidado._plan_de_carga(
+                        f"{prefijo}{ruta}__", select, prefetches
+                    )
+                continue
+
+            ruta = _ruta_relacion(modelo, campo.source_attrs[:-1])
+            if ruta:
+                select.append(prefijo + ruta)
+
+            if nombre in prefetch_fields:
+                p = prefetch_fields[nombre]
+                prefetches.append(Prefetch(
+                    prefijo + p.prefetch_through,
+                    queryset=p.queryset,
+                    to_attr=p.to_attr,
+                ))
 
 
 # =====================================================
 # USUARIO
 # =====================================================
-class UsuarioPersonalizadoSerializer(serializers.ModelSerializer):
+class UsuarioPersonalizadoSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
 
     class Meta:
         model = UsuarioPersonalizado
@@ -58,7 +218,9 @@ class UsuarioPersonalizadoSerializer(serializers.ModelSerializer):
         return instance
 
 
-class PerfilUsuarioSerializer(serializers.ModelSerializer):
+class PerfilUsuarioSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
     usuario_nombre = serializers.CharField(
         source="usuario.get_full_name", read_only=True
     )
@@ -74,7 +236,9 @@ class PerfilUsuarioSerializer(serializers.ModelSerializer):
 # =====================================================
 # FIRMA
 # =====================================================
-class RegistroFirmaSerializer(serializers.ModelSerializer):
+class RegistroFirmaSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
     usuario_nombre = serializers.CharField(
         source="usuario.get_full_name", read_only=True
     )
@@ -95,20 +259,110 @@ class RegistroFirmaSerializer(serializers.ModelSerializer):
 
 
 class FirmaSerializer(serializers.Serializer):
+    # RUT y contraseña, o el token de una sesión de firma abierta
+    rut = serializers.CharField(required=False)
+    password = serializers.CharField(
+        required=False, style={"input_type": "password"}
+    )
+    token = serializers.CharField(required=False)
+
+    def validate(self, attrs):
+        if not attrs.get("token") and not (
+            attrs.get("rut") and attrs.get("password")
+        ):
+            raise serializers.ValidationError(
+                "Debe enviar rut y password, o el token de una sesión de firma."
+            )
+        return attrs
+
+
+class ObjetivoFirmaSerializer(serializers.Serializer):
+    tipo = serializers.ChoiceField(choices=[
+        "planilla_fabricacion",
+        "planilla_envase_primario",
+        "planilla_envase_secundario_empaque",
+    ])
+    id = serializers.IntegerField()
+
+
+class FirmaMasivaSerializer(FirmaSerializer):
+    planillas = ObjetivoFirmaSerializer(
+        many=True, allow_empty=False, max_length=200
+    )
+
+
+class BandejaFirmasSerializer(serializers.Serializer):
+    # parámetros de ?cursor=&limite= de la bandeja de firmas pendientes
+    cursor = serializers.CharField(required=False)
+    limite = serializers.IntegerField(min_value=1, max_value=200, default=20)
+
+    def validate_cursor(self, valor):
+        try:
+            return bandeja.leer_cursor(valor)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc))
+
+
+class SesionFirmaSerializer(serializers.Serializer):
     rut = serializers.CharField()
     password = serializers.CharField(style={"input_type": "password"})
+    # vacío = todo lo que el rol del usuario puede firmar
+    alcance = serializers.MultipleChoiceField(
+        choices=SesionFirma.ALCANCE_CHOICES, required=False
+    )
+
+
+class ExportacionSerializer(serializers.Serializer):
+    # parámetros de ?formato=&desde=&hasta= (fechas inclusivas)
+    formato = serializers.ChoiceField(
+        choices=["csv", "xlsx"], default="csv"
+    )
+    desde = serializers.DateField(required=False)
+    hasta = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        desde, hasta = attrs.get("desde"), attrs.get("hasta")
+        if desde and hasta and hasta < desde:
+            raise serializers.ValidationError(
+                {"hasta": "No puede ser anterior a desde."}
+            )
+        return attrs
+
+
+class BusquedaSerializer(serializers.Serializer):
+    # parámetros de ?q=&tipo=&limite= (tipo admite varios separados por coma)
+    q = serializers.CharField(max_length=200)
+    tipo = serializers.CharField(required=False)
+    limite = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+    def validate_q(self, valor):
+        if not re.search(r"\w", valor):
+            raise serializers.ValidationError("Indique al menos una palabra.")
+        return valor
+
+    def validate_tipo(self, valor):
+        tipos = _lista_parametro(valor)
+        invalidos = tipos - set(busqueda.FUENTE_POR_TIPO)
+        if invalidos:
+            raise serializers.ValidationError(
+                f"Tipos no válidos: {', '.join(sorted(invalidos))}. "
+                f"Opciones: {', '.join(busqueda.FUENTE_POR_TIPO)}."
+            )
+        return sorted(tipos)
 
 
 # =====================================================
 # PRODUCTOS (TIPO, MP, ENVASES)
 # =====================================================
-class TipoProductoSerializer(serializers.ModelSerializer):
+class TipoProductoSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
     class Meta:
         model = TipoProducto
         fields = "__all__"
 
 
-class ProductoSerializer(serializers.ModelSerializer):
+class ProductoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = Producto
         fields = "__all__"
@@ -135,7 +389,9 @@ class ProductoSerializer(serializers.ModelSerializer):
         return attrs
 
 
-class MateriaPrimaSerializer(serializers.ModelSerializer):
+class MateriaPrimaSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
     firma_inspector_calidad_info = RegistroFirmaSerializer(
         source="firma_inspector_calidad", read_only=True
     )
@@ -143,65 +399,132 @@ class MateriaPrimaSerializer(serializers.ModelSerializer):
     class Meta:
         model = MateriaPrima
         fields = "__all__"
-        read_only_fields = ("estado_aprobacion", "control_calidad")
+        read_only_fields = (
+            "estado_aprobacion", "control_calidad", "control_calidad_vigente",
+        )
+        expandable_fields = ("firma_inspector_calidad_info",)
+
+
+class ImportacionMateriaPrimaSerializer(serializers.ModelSerializer):
+    """Una fila del CSV de recepción (ver GPQAPI.importacion)."""
+
+    class Meta:
+        model = MateriaPrima
+        fields = ("nombre", "batch", "cantidad")
+
+    def validate_cantidad(self, value):
+        if value <= 0:
+            raise serializers.ValidationError(
+                "La cantidad recibida debe ser mayor que 0."
+            )
+        return value
+
+
+# Atributo donde queda la lista de controles precargada (más reciente primero)
+CONTROLES_CALIDAD_PREFETCH = "controles_calidad_prefetch"
+
+
+def prefetch_controles_calidad(lookup):
+    """
+    Prefetch de los controles de calidad de un material (con su inspector),
+    ordenados del más reciente al más antiguo. Los serializers de material
+    leen el resumen desde memoria cuando el queryset lo incluye.
+    """
+    return Prefetch(
+        lookup,
+        queryset=ControlCalidad.objects.select_related("inspector").order_by(
+            "-fecha_verificacion", "-id"
+        ),
+        to_attr=CONTROLES_CALIDAD_PREFETCH,
+    )
+
+
+def resumen_control_calidad(material, related_name):
+    """
+    Resumen del último control de calidad de un material.
+    Usa el prefetch si existe; si no, hace una única consulta.
+    """
+    precargados = getattr(material, CONTROLES_CALIDAD_PREFETCH, None)
+    if precargados is not None:
+        control = precargados[0] if precargados else None
+    else:
+        control = (
+            getattr(material, related_name)
+            .select_related("inspector")
+            .order_by("-fecha_verificacion", "-id")
+            .first()
+        )
+
+    if control:
+        return {
+            "id": control.id,
+            "codigo": control.codigo_control_calidad,
+            "aprobado": control.aprobado,
+            "tiene_firma": control.firma_control_calidad_id is not None,
+            "fecha_verificacion": control.fecha_verificacion,
+            "inspector": control.inspector.get_full_name() if control.inspector else None,
+        }
+    return None
 
 
-class MaterialEnvasePrimarioSerializer(serializers.ModelSerializer):
+class MaterialEnvasePrimarioSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
     control_calidad_info = serializers.SerializerMethodField()
 
     class Meta:
         model = MaterialEnvasePrimario
         fields = "__all__"
-        read_only_fields = ("estado_aprobacion",
-                            "codigo_calidad", "control_calidad")
+        read_only_fields = ("estado_aprobacion", "codigo_calidad",
+                            "control_calidad", "control_calidad_vigente")
+        expandable_fields = ("control_calidad_info",)
+        prefetch_fields = {
+            "control_calidad_info": prefetch_controles_calidad(
+                "controles_calidad_envase_primario"
+            ),
+        }
 
     def get_control_calidad_info(self, obj):
-        control = obj.controles_calidad_envase_primario.first()
-        if control:
-            return {
-                "id": control.id,
-                "codigo": control.codigo_control_calidad,
-                "aprobado": control.aprobado,
-                "tiene_firma": control.firma_control_calidad is not None,
-                "fecha_verificacion": control.fecha_verificacion,
-                "inspector": control.inspector.get_full_name() if control.inspector else None,
-            }
-        return None
+        return resumen_control_calidad(
+            obj, "controles_calidad_envase_primario"
+        )
 
 
-class MaterialEnvaseSecundarioEmpaqueSerializer(serializers.ModelSerializer):
+class MaterialEnvaseSecundarioEmpaqueSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
     control_calidad_info = serializers.SerializerMethodField()
 
     class Meta:
         model = MaterialEnvaseSecundarioEmpaque
         fields = "__all__"
-        read_only_fields = ("estado_aprobacion",
-                            "codigo_calidad", "control_calidad")
+        read_only_fields = ("estado_aprobacion", "codigo_calidad",
+                            "control_calidad", "control_calidad_vigente")
+        expandable_fields = ("control_calidad_info",)
+        prefetch_fields = {
+            "control_calidad_info": prefetch_controles_calidad(
+                "controles_calidad_envase_secundario"
+            ),
+        }
 
     def get_control_calidad_info(self, obj):
-        control = obj.controles_calidad_envase_secundario.first()
-        if control:
-            return {
-                "id": control.id,
-                "codigo": control.codigo_control_calidad,
-                "aprobado": control.aprobado,
-                "tiene_firma": control.firma_control_calidad is not None,
-                "fecha_verificacion": control.fecha_verificacion,
-                "inspector": control.inspector.get_full_name() if control.inspector else None,
-            }
-        return None
+        return resumen_control_calidad(
+            obj, "controles_calidad_envase_secundario"
+        )
 
 
 # =====================================================
 # BODEGAS Y STOCK
 # =====================================================
-class BodegaSerializer(serializers.ModelSerializer):
+class BodegaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = Bodega
         fields = "__all__"
 
 
-class StockMateriaPrimaSerializer(serializers.ModelSerializer):
+class StockMateriaPrimaSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
     materia_prima_detalle = MateriaPrimaSerializer(
         source="materia_prima", read_only=True
     )
@@ -210,9 +533,12 @@ class StockMateriaPrimaSerializer(serializers.ModelSerializer):
     class Meta:
         model = StockMateriaPrima
         fields = "__all__"
+        expandable_fields = ("materia_prima_detalle", "bodega_detalle")
 
 
-class StockMaterialEnvasePrimarioSerializer(serializers.ModelSerializer):
+class StockMaterialEnvasePrimarioSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
     material_detalle = MaterialEnvasePrimarioSerializer(
         source="material_envase_primario", read_only=True
     )
@@ -221,9 +547,12 @@ class StockMaterialEnvasePrimarioSerializer(serializers.ModelSerializer):
     class Meta:
         model = StockMaterialEnvasePrimario
         fields = "__all__"
+        expandable_fields = ("material_detalle", "bodega_detalle")
 
 
-class StockMaterialEnvaseSecundarioEmpaqueSerializer(serializers.ModelSerializer):
+class StockMaterialEnvaseSecundarioEmpaqueSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
     material_detalle = MaterialEnvaseSecundarioEmpaqueSerializer(
         source="material_envase_secundario_empaque", read_only=True
     )
@@ -232,12 +561,26 @@ class StockMaterialEnvaseSecundarioEmpaqueSerializer(serializers.ModelSerializer
     class Meta:
         model = StockMaterialEnvaseSecundarioEmpaque
         fields = "__all__"
+        expandable_fields = ("material_detalle", "bodega_detalle")
+
+
+class MovimientoStockSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
+    bodega_detalle = BodegaSerializer(source="bodega", read_only=True)
+
+    class Meta:
+        model = MovimientoStock
+        fields = "__all__"
+        expandable_fields = ("bodega_detalle",)
 
 
 # =====================================================
 # CONTROL CALIDAD
 # =====================================================
-class ControlCalidadSerializer(serializers.ModelSerializer):
+class ControlCalidadSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
     firma_control_calidad_info = RegistroFirmaSerializer(
         source="firma_control_calidad", read_only=True
     )
@@ -262,6 +605,11 @@ class ControlCalidadSerializer(serializers.ModelSerializer):
             "codigo_control_calidad",
             "firma_control_calidad",
         )
+        expandable_fields = (
+            "firma_control_calidad_info",
+            "material_envase_primario_info",
+            "material_envase_secundario_info",
+        )
 
     def _generar_hash_firma(self, user, control_calidad):
         data = f"{user.rut}{control_calidad.id}{datetime.datetime.now().isoformat()}"
@@ -273,30 +621,22 @@ class ControlCalidadSerializer(serializers.ModelSerializer):
         x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
         return x_forwarded_for.split(",")[0] if x_forwarded_for else request.META.get("REMOTE_ADDR")
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        print(f"DEBUG serializer: Actualizando control calidad {instance.id}")
-        print(f"DEBUG serializer: validated_data: {validated_data}")
-
         aprobado_antes = instance.aprobado
-        print(f"DEBUG serializer: aprobado antes: {aprobado_antes}")
 
         instance = super().update(instance, validated_data)
-        print(f"DEBUG serializer: aprobado después: {instance.aprobado}")
 
         request = self.context.get("request")
         user = getattr(request, "user", None)
-        print(f"DEBUG serializer: usuario autenticado: {user}")
 
         if (
             instance.aprobado
             and not aprobado_antes
-            and instance.firma_control_calidad is None
+            and instance.firma_control_calidad_id is None
             and user is not None
             and user.is_authenticated
         ):
-            print(
-                f"DEBUG serializer: Generando firma automática para control {instance.id}"
-            )
             firma_hash = self._generar_hash_firma(user, instance)
 
             registro_firma = RegistroFirma.objects.create(
@@ -309,33 +649,34 @@ class ControlCalidadSerializer(serializers.ModelSerializer):
 
             instance.firma_control_calidad = registro_firma
             instance.save(update_fields=["firma_control_calidad"])
-            print(
-                f"DEBUG serializer: Firma {registro_firma.id} asignada a control calidad"
+            logger.debug(
+                "Firma automática %s asignada a control calidad %s",
+                registro_firma.id, instance.id,
+                extra={
+                    "control_calidad_id": instance.id,
+                    "firma_id": registro_firma.id,
+                },
             )
 
-            if instance.materia_prima:
+            if instance.materia_prima_id:
                 mp = instance.materia_prima
                 mp.firma_inspector_calidad = registro_firma
                 mp.actualizar_estado_aprobacion()
-                print(f"DEBUG serializer: Materia prima {mp.id} actualizada")
 
-            if instance.material_envase_primario:
+            if instance.material_envase_primario_id:
                 mep = instance.material_envase_primario
                 mep.actualizar_estado_aprobacion(instance)
-                print(
-                    f"DEBUG serializer: Material envase primario {mep.id} actualizado"
-                )
 
-            if instance.material_envase_secundario_empaque:
+            if instance.material_envase_secundario_empaque_id:
                 mes = instance.material_envase_secundario_empaque
                 mes.actualizar_estado_aprobacion(instance)
-                print(
-                    f"DEBUG serializer: Material envase secundario {mes.id} actualizado"
-                )
         else:
-            print(f"DEBUG serializer: No se generó firma automática")
-            print(
-                f"DEBUG serializer: Condiciones: aprobado={instance.aprobado}, aprobado_antes={aprobado_antes}, firma_existe={instance.firma_control_calidad is not None}"
+            logger.debug(
+                "Control calidad %s sin firma automática: aprobado=%s, "
+                "aprobado_antes=%s, firma_existe=%s",
+                instance.id, instance.aprobado, aprobado_antes,
+                instance.firma_control_calidad_id is not None,
+                extra={"control_calidad_id": instance.id},
             )
 
         return instance
@@ -344,7 +685,9 @@ class ControlCalidadSerializer(serializers.ModelSerializer):
 # =====================================================
 # PLANILLA FABRICACION
 # =====================================================
-class PlanillaFabricacionSerializer(serializers.ModelSerializer):
+class PlanillaFabricacionSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
 
     firma_jefe_seccion_info = RegistroFirmaSerializer(
         source="firma_jefe_seccion", read_only=True
@@ -373,6 +716,11 @@ class PlanillaFabricacionSerializer(serializers.ModelSerializer):
             "usuario_ultima_modificacion",
             "estado_aprobacion",
         )
+        expandable_fields = (
+            "firma_jefe_seccion_info",
+            "firma_jefe_produccion_info",
+            "firma_quimico_farmaceutico_info",
+        )
 
     def validate(self, attrs):
         # Validación fechas
@@ -429,9 +777,7 @@ class PlanillaFabricacionSerializer(serializers.ModelSerializer):
                 })
 
             # Buscar stock disponible en la bodega de materias primas
-            bodega_mp = Bodega.objects.filter(
-                nombre="Bodega Materias Primas"
-            ).first()
+            bodega_mp = Bodega.principal("MP", crear=False)
             stock_disponible = 0
             if bodega_mp:
                 stock_obj = StockMateriaPrima.objects.filter(
@@ -455,10 +801,8 @@ class PlanillaFabricacionSerializer(serializers.ModelSerializer):
                 "materia_prima": "Debe seleccionar una materia prima."
             })
 
-        cc = ControlCalidad.objects.filter(
-            materia_prima=materia,
-            aprobado=True,
-        ).order_by("-fecha_verificacion", "-id").first()
+        # control vigente mantenido por ControlCalidad: lectura por PK
+        cc = materia.control_calidad_vigente
 
         if not cc:
             raise serializers.ValidationError({
@@ -472,10 +816,7 @@ class PlanillaFabricacionSerializer(serializers.ModelSerializer):
         materia = validated_data.get("materia_prima", instance.materia_prima)
 
         if materia != instance.materia_prima:
-            cc = ControlCalidad.objects.filter(
-                materia_prima=materia,
-                aprobado=True,
-            ).order_by("-fecha_verificacion", "-id").first()
+            cc = materia.control_calidad_vigente
 
             if not cc:
                 raise serializers.ValidationError({
@@ -490,7 +831,9 @@ class PlanillaFabricacionSerializer(serializers.ModelSerializer):
 # =====================================================
 # PLANILLA ENVASE
 # =====================================================
-class PlanillaEnvaseSerializer(serializers.ModelSerializer):
+class PlanillaEnvaseSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
 
     firma_jefe_seccion_info = RegistroFirmaSerializer(
         source="firma_jefe_seccion", read_only=True
@@ -510,6 +853,10 @@ class PlanillaEnvaseSerializer(serializers.ModelSerializer):
             "usuario_ultima_modificacion",
             "estado_aprobacion",
         )
+        expandable_fields = (
+            "firma_jefe_seccion_info",
+            "firma_jefe_produccion_info",
+        )
 
     def validate(self, attrs):
         fecha_emision = attrs.get(
@@ -536,7 +883,9 @@ class PlanillaEnvaseSerializer(serializers.ModelSerializer):
 # =====================================================
 # PLANILLA ENVASE PRIMARIO
 # =====================================================
-class PlanillaEnvasePrimarioSerializer(serializers.ModelSerializer):
+class PlanillaEnvasePrimarioSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
 
     firma_jefe_seccion_info = RegistroFirmaSerializer(
         source="firma_jefe_seccion", read_only=True
@@ -565,6 +914,11 @@ class PlanillaEnvasePrimarioSerializer(serializers.ModelSerializer):
             "usuario_ultima_modificacion",
             "estado_aprobacion",
         )
+        expandable_fields = (
+            "firma_jefe_seccion_info",
+            "firma_jefe_produccion_info",
+            "firma_quimico_farmaceutico_info",
+        )
 
     def validate(self, attrs):
         # Validación fechas
@@ -621,9 +975,7 @@ class PlanillaEnvasePrimarioSerializer(serializers.ModelSerializer):
                 })
 
             # Buscar stock disponible en la bodega de envase primario
-            bodega_ep = Bodega.objects.filter(
-                nombre="Bodega Envase Primario"
-            ).first()
+            bodega_ep = Bodega.principal("EP", crear=False)
             stock_disponible = 0
             if bodega_ep:
                 stock_obj = StockMaterialEnvasePrimario.objects.filter(
@@ -647,10 +999,7 @@ class PlanillaEnvasePrimarioSerializer(serializers.ModelSerializer):
                 "material_envase_primario": "Debe seleccionar un material de envase primario."
             })
 
-        cc = ControlCalidad.objects.filter(
-            material_envase_primario=material,
-            aprobado=True,
-        ).order_by("-fecha_verificacion", "-id").first()
+        cc = material.control_calidad_vigente
 
         if not cc:
             raise serializers.ValidationError({
@@ -666,10 +1015,7 @@ class PlanillaEnvasePrimarioSerializer(serializers.ModelSerializer):
         )
 
         if material != instance.material_envase_primario:
-            cc = ControlCalidad.objects.filter(
-                material_envase_primario=material,
-                aprobado=True,
-            ).order_by("-fecha_verificacion", "-id").first()
+            cc = material.control_calidad_vigente
 
             if not cc:
                 raise serializers.ValidationError({
@@ -684,7 +1030,9 @@ class PlanillaEnvasePrimarioSerializer(serializers.ModelSerializer):
 # =====================================================
 # PLANILLA ENVASE SECUNDARIO Y EMPAQUE
 # =====================================================
-class PlanillaEnvaseSecundarioEmpaqueSerializer(serializers.ModelSerializer):
+class PlanillaEnvaseSecundarioEmpaqueSerializer(
+    CamposDinamicosMixin, serializers.ModelSerializer
+):
 
     firma_jefe_seccion_info = RegistroFirmaSerializer(
         source="firma_jefe_seccion", read_only=True
@@ -712,6 +1060,11 @@ class PlanillaEnvaseSecundarioEmpaqueSerializer(serializers.ModelSerializer):
             "usuario_ultima_modificacion",
             "estado_aprobacion",
         )
+        expandable_fields = (
+            "firma_jefe_seccion_info",
+            "firma_jefe_produccion_info",
+            "firma_quimico_farmaceutico_info",
+        )
 
     def validate(self, attrs):
         # Validación fechas
@@ -768,9 +1121,7 @@ class PlanillaEnvaseSecundarioEmpaqueSerializer(serializers.ModelSerializer):
                 })
 
             # Buscar stock disponible en la bodega de envase secundario
-            bodega_es = Bodega.objects.filter(
-                nombre="Bodega Envase Secundario"
-            ).first()
+            bodega_es = Bodega.principal("ES", crear=False)
             stock_disponible = 0
             if bodega_es:
                 stock_obj = StockMaterialEnvaseSecundarioEmpaque.objects.filter(
@@ -794,10 +1145,7 @@ class PlanillaEnvaseSecundarioEmpaqueSerializer(serializers.ModelSerializer):
                 "material_envase_secundario_empaque": "Debe seleccionar un material de envase secundario/empaque."
             })
 
-        cc = ControlCalidad.objects.filter(
-            material_envase_secundario_empaque=material,
-            aprobado=True,
-        ).order_by("-fecha_verificacion", "-id").first()
+        cc = material.control_calidad_vigente
 
         if not cc:
             raise serializers.ValidationError({
@@ -814,10 +1162,7 @@ class PlanillaEnvaseSecundarioEmpaqueSerializer(serializers.ModelSerializer):
         )
 
         if material != instance.material_envase_secundario_empaque:
-            cc = ControlCalidad.objects.filter(
-                material_envase_secundario_empaque=material,
-                aprobado=True,
-            ).order_by("-fecha_verificacion", "-id").first()
+            cc = material.control_calidad_vigente
 
             if not cc:
                 raise serializers.ValidationError({
@@ -832,7 +1177,7 @@ class PlanillaEnvaseSecundarioEmpaqueSerializer(serializers.ModelSerializer):
 # =====================================================
 # JARABE
 # =====================================================
-class JarabeSerializer(serializers.ModelSerializer):
+class JarabeSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
 
     rutas = serializers.SerializerMethodField()
 
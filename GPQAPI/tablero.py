@@ -0,0 +1,244 @@
+"""
+Resumen de producción para el tablero de supervisión.
+
+Cuatro grupos, cada uno calculado con una sola consulta (un UNION ALL de
+un GROUP BY por tabla):
+
+planillas
+    conteo por estado_aprobacion de cada tipo de planilla (índices
+    *_estado_idx);
+materiales
+    conteo por estado_aprobacion de materias primas y materiales de envase
+    (mp/mep/mes_estado_idx);
+controles_calidad
+    conteo por aprobado (cc_aprobado_idx);
+stock
+    registros y cantidad disponible de cada tipo de material por bodega
+    (las bodegas sin stock no aparecen).
+
+Cada grupo queda en la caché por separado, bajo una clave con su
+VersionTablero. Los receivers de abajo (conectados en GpqapiConfig.ready)
+suben la versión del grupo afectado cuando cambia una de sus filas, con
+un UPDATE al confirmar la transacción; RegistroFirma.firmar_planillas e
+importar_materias_primas lo piden para sus update() y bulk_create(). Como
+las versiones se leen de la base en cada solicitud (una consulta para los
+cuatro grupos), la caché local de cada worker deja de servir el grupo
+viejo apenas otro worker lo cambia.
+"""
+from decimal import Decimal
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Count, Sum, Value
+from django.db.models.signals import post_delete, post_save
+
+from .models import (
+    Bodega,
+    ControlCalidad,
+    MateriaPrima,
+    MaterialEnvasePrimario,
+    MaterialEnvaseSecundarioEmpaque,
+    MovimientoStock,
+    PlanillaEnvase,
+    PlanillaEnvasePrimario,
+    PlanillaEnvaseSecundarioEmpaque,
+    PlanillaFabricacion,
+    StockMateriaPrima,
+    StockMaterialEnvasePrimario,
+    StockMaterialEnvaseSecundarioEmpaque,
+    VersionTablero,
+)
+
+PLANILLAS = {
+    "fabricacion": PlanillaFabricacion,
+    "envase": PlanillaEnvase,
+    "envase_primario": PlanillaEnvasePrimario,
+    "envase_secundario_empaque": PlanillaEnvaseSecundarioEmpaque,
+}
+MATERIALES = {
+    "materia_prima": MateriaPrima,
+    "material_envase_primario": MaterialEnvasePrimario,
+    "material_envase_secundario_empaque": MaterialEnvaseSecundarioEmpaque,
+}
+STOCKS = {
+    "materia_prima": StockMateriaPrima,
+    "material_envase_primario": StockMaterialEnvasePrimario,
+    "material_envase_secundario_empaque":
+        StockMaterialEnvaseSecundarioEmpaque,
+}
+
+# la suma de muchos saldos no cabe en los 10 dígitos de cada uno
+CANTIDAD = models.DecimalField(max_digits=20, decimal_places=2)
+# en SQLite la suma llega sin redondear (se acumula en coma flotante)
+CENTESIMO = Decimal("0.01")
+
+
+def _clave(grupo, version):
+    return f"gpq:tablero:{grupo}:{version}"
+
+
+def _union(modelos, campos, **agregados):
+    """
+    Un GROUP BY por campos en cada modelo, unidos en una consulta. Cada
+    fila trae además `indice`, la posición de su modelo en `modelos`.
+    """
+    consultas = [
+        modelo.objects.order_by().values(*campos).annotate(
+            indice=Value(i, output_field=models.IntegerField()),
+            **agregados,
+        )
+        for i, modelo in enumerate(modelos)
+    ]
+    return list(consultas[0].union(*consultas[1:], all=True))
+
+
+def _por_estado(por_tipo):
+    """{tipo: {estado: n, ..., "total": n}} con todos los estados en 0."""
+    tipos = list(por_tipo)
+    resultado = {
+        tipo: {estado: 0 for estado, _ in modelo.ESTADOS_APROBACION}
+        for tipo, modelo in por_tipo.items()
+    }
+    for fila in _union(
+        por_tipo.values(), ("estado_aprobacion",), total=Count("pk")
+    ):
+        resultado[tipos[fila["indice"]]][fila["estado_aprobacion"]] = (
+            fila["total"]
+        )
+    for conteos in resultado.values():
+        conteos["total"] = sum(conteos.values())
+    return resultado
+
+
+# ===========================================================
+# GRUPOS
+# ===========================================================
+def planillas():
+    return _por_estado(PLANILLAS)
+
+
+def materiales():
+    return _por_estado(MATERIALES)
+
+
+def controles_calidad():
+    conteos = dict(
+        ControlCalidad.objects.order_by().values("aprobado")
+        .annotate(total=Count("pk")).values_list("aprobado", "total")
+    )
+    aprobados = conteos.get(True, 0)
+    no_aprobados = conteos.get(False, 0)
+    return {
+        "aprobados": aprobados,
+        "no_aprobados": no_aprobados,
+        "total": aprobados + no_aprobados,
+    }
+
+
+def stock():
+    tipos = list(STOCKS)
+    bodegas = {}
+    for fila in _union(
+        STOCKS.values(), ("bodega_id", "bodega__nombre", "bodega__tipo"),
+        registros=Count("pk"),
+        cantidad=Sum("cantidad_disponible", output_field=CANTIDAD),
+    ):
+        bodega = bodegas.get(fila["bodega_id"])
+        if bodega is None:
+            bodega = bodegas[fila["bodega_id"]] = {
+                "id": fila["bodega_id"],
+                "nombre": fila["bodega__nombre"],
+                "tipo": fila["bodega__tipo"],
+                **{
+                    tipo: {"registros": 0, "cantidad": "0.00"}
+                    for tipo in tipos
+                },
+            }
+        bodega[tipos[fila["indice"]]] = {
+            "registros": fila["registros"],
+            "cantidad": str(fila["cantidad"].quantize(CENTESIMO)),
+        }
+    return [bodegas[pk] for pk in sorted(bodegas)]
+
+
+GRUPOS = {
+    "planillas": planillas,
+    "materiales": materiales,
+    "controles_calidad": controles_calidad,
+    "stock": stock,
+}
+
+
+def resumen():
+    """Todos los grupos: los vigentes de la caché, el resto recalculado."""
+    claves = {
+        grupo: _clave(grupo, version)
+        for grupo, version in VersionTablero.vigentes(list(GRUPOS)).items()
+    }
+    en_cache = cache.get_many(claves.values())
+    datos = {}
+    nuevos = {}
+    for grupo, calcular in GRUPOS.items():
+        clave = claves[grupo]
+        if clave in en_cache:
+            datos[grupo] = en_cache[clave]
+        else:
+            datos[grupo] = nuevos[clave] = calcular()
+    if nuevos:
+        cache.set_many(nuevos, settings.GPQ_TABLERO_SEGUNDOS)
+    return datos
+
+
+# ===========================================================
+# INVALIDACIÓN
+# ===========================================================
+def invalidar(grupos):
+    """Sube la versión de los grupos al confirmar la transacción en curso."""
+    transaction.on_commit(partial(VersionTablero.subir, grupos))
+
+
+# modelo -> (grupo, campos que cambian el resumen; None: cualquiera)
+DEPENDENCIAS = {
+    **{modelo: ("planillas", {"estado_aprobacion"})
+       for modelo in PLANILLAS.values()},
+    **{modelo: ("materiales", {"estado_aprobacion"})
+       for modelo in MATERIALES.values()},
+    ControlCalidad: ("controles_calidad", {"aprobado"}),
+    **{modelo: ("stock", {"bodega", "cantidad_disponible"})
+       for modelo in STOCKS.values()},
+    # MovimientoStock.registrar cambia el saldo con update(): el movimiento
+    # que inserta en la misma transacción es la señal
+    MovimientoStock: ("stock", None),
+    Bodega: ("stock", {"nombre", "tipo"}),
+}
+
+
+def _al_guardar(sender, instance, created=False, raw=False,
+                update_fields=None, **kwargs):
+    if raw:
+        return
+    grupo, campos = DEPENDENCIAS[sender]
+    if (
+        not created and campos is not None and update_fields is not None
+        and not set(update_fields) & campos
+    ):
+        return
+    invalidar([grupo])
+
+
+def _al_eliminar(sender, instance, **kwargs):
+    invalidar([DEPENDENCIAS[sender][0]])
+
+
+def conectar():
+    for modelo in DEPENDENCIAS:
+        post_save.connect(
+            _al_guardar, sender=modelo,
+            dispatch_uid=f"tablero-guardar-{modelo.__name__}",
+        )
+        post_delete.connect(
+            _al_eliminar, sender=modelo,
+            dispatch_uid=f"tablero-eliminar-{modelo.__name__}",
+        )
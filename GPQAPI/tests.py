@@ -1,3 +1,2998 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import re
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+from collections import namedtuple
+from contextlib import closing
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.backends.sqlite3 import base as sqlite_base
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.pagination import CursorPagination
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from GPQ import basedatos
+
+from .models import (
+    UsuarioPersonalizado,
+    PerfilUsuario,
+    RegistroFirma,
+    Producto,
+    TipoProducto,
+    MateriaPrima,
+    MaterialEnvasePrimario,
+    MaterialEnvaseSecundarioEmpaque,
+    ControlCalidad,
+    PlanillaFabricacion,
+    PlanillaEnvase,
+    PlanillaEnvasePrimario,
+    PlanillaEnvaseSecundarioEmpaque,
+    Jarabe,
+    Bodega,
+    StockMateriaPrima,
+    StockMaterialEnvaseSecundarioEmpaque,
+    MovimientoStock,
+    SecuenciaCodigo,
+    SesionFirma,
+    VersionTablero,
+)
+from . import bandeja, busqueda, exportacion, tablero
+from .carga import MedicionCarga, clasificar_error, percentil
+from .importacion import importar_materias_primas
+from .filtros import Exacto, FiltroIndexado, Presente, Rango, revisar_filtros
+from .eventos import FiltroCorrelacion, FormatoJSON, id_correlacion
+from .dossier import armar
+from .metricas import AlmacenMetricas, almacen
+from .trazabilidad import trazar_lote
+from .urls import router
+from .management.commands import activar_wal
+
+
+# ===========================================================
+# PRESUPUESTOS POR ENDPOINT
+# ===========================================================
+# (máximo de consultas SQL, máximo de milisegundos) por ruta y acción.
+# Las rutas son los prefijos registrados en GPQAPI/urls.py. Ajustar a la
+# baja a medida que el código se vuelve más rápido; nunca al alza sin
+# revisar qué consulta nueva apareció.
+# Las escrituras cuentan también, al confirmar, un UPDATE por cada
+# invalidación del dossier (Jarabe.version_dossier) y del tablero
+# (VersionTablero).
+# Las consultas se verifican siempre. Los milisegundos dependen de la
+# máquina: solo se verifican con GPQ_PRESUPUESTO_MS, el factor por el que
+# se multiplican (1 tal cual, 3 en un runner lento; vacío, no se miden).
+Presupuesto = namedtuple("Presupuesto", ["consultas", "ms"])
+FACTOR_PRESUPUESTO_MS = float(os.environ.get("GPQ_PRESUPUESTO_MS") or 0)
+
+PRESUPUESTOS = {
+    "usuarios": {
+        "list": Presupuesto(2, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(3, 500),
+    },
+    "perfiles": {
+        "list": Presupuesto(2, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(4, 500),
+    },
+    "registro-firmas": {
+        "list": Presupuesto(1, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(3, 500),
+        "exportar": Presupuesto(1, 300),
+    },
+    "sesiones-firma": {
+        "create": Presupuesto(3, 500),
+    },
+    "firmas-masivas": {
+        "create": Presupuesto(16, 500),
+        "pendientes": Presupuesto(5, 300),
+    },
+    "productos": {
+        "list": Presupuesto(2, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(2, 500),
+    },
+    "tipos-producto": {
+        "list": Presupuesto(2, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(2, 500),
+    },
+    "materias-primas": {
+        "list": Presupuesto(2, 300),
+        "list_expandido": Presupuesto(2, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(16, 500),
+        "importar": Presupuesto(9, 500),
+        "trazabilidad": Presupuesto(6, 300),
+    },
+    "materiales-envase-primario": {
+        "list": Presupuesto(2, 300),
+        "list_expandido": Presupuesto(3, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(11, 500),
+    },
+    "materiales-envase-secundario-empaque": {
+        "list": Presupuesto(2, 300),
+        "list_expandido": Presupuesto(3, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(11, 500),
+    },
+    "controles-calidad": {
+        "list": Presupuesto(2, 300),
+        "list_expandido": Presupuesto(4, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(7, 500),
+        "firmar": Presupuesto(14, 500),
+    },
+    "planillas-fabricacion-Pedido": {
+        "list": Presupuesto(1, 300),
+        "list_expandido": Presupuesto(1, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(15, 500),
+        "firmar": Presupuesto(11, 500),
+        "exportar": Presupuesto(1, 300),
+    },
+    "planillas-envase": {
+        "list": Presupuesto(2, 300),
+        "list_expandido": Presupuesto(2, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(4, 500),
+    },
+    "planillas-envase-primario-Pedido": {
+        "list": Presupuesto(1, 300),
+        "list_expandido": Presupuesto(1, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(15, 500),
+        "firmar": Presupuesto(11, 500),
+        "exportar": Presupuesto(1, 300),
+    },
+    "jarabes": {
+        "list": Presupuesto(2, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(2, 500),
+        "fabricacion": Presupuesto(2, 300),
+        "envase": Presupuesto(2, 300),
+        "envase-primario": Presupuesto(2, 300),
+        "dossier": Presupuesto(4, 300),
+    },
+    "bodegas": {
+        "list": Presupuesto(2, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(3, 500),
+    },
+    "stock-materias-primas": {
+        "list": Presupuesto(2, 300),
+        "list_expandido": Presupuesto(2, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(9, 500),
+    },
+    "stock-materiales-envase-primario": {
+        "list": Presupuesto(2, 300),
+        "list_expandido": Presupuesto(3, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(9, 500),
+    },
+    "stock-materiales-envase-secundario": {
+        "list": Presupuesto(2, 300),
+        "list_expandido": Presupuesto(3, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(9, 500),
+    },
+    "planilla-envase-Secundario-empaque": {
+        "list": Presupuesto(1, 300),
+        "list_expandido": Presupuesto(1, 300),
+        "retrieve": Presupuesto(1, 300),
+        "create": Presupuesto(8, 500),
+        "firmar": Presupuesto(10, 500),
+        "exportar": Presupuesto(1, 300),
+    },
+    "movimientos-stock": {
+        "list": Presupuesto(1, 300),
+        "list_expandido": Presupuesto(1, 300),
+        "retrieve": Presupuesto(1, 300),
+    },
+}
+
+ACCIONES_ESTANDAR = {
+    "list", "list_expandido", "retrieve", "create", "firmar",
+}
+
+# Filas por tabla en el set de datos sembrado (más que PAGE_SIZE, para que
+# los listados rindan páginas completas).
+FILAS_POR_TABLA = 15
+
+PASSWORD = "clave-segura-123"
+
+
+# ===========================================================
+# DATOS DE PRUEBA
+# ===========================================================
+def sembrar_datos(n=FILAS_POR_TABLA):
+    """
+    Crea un set de datos realista: firmantes con rol, bodegas principales,
+    materiales aprobados con su control de calidad y stock, planillas de
+    los tres tipos firmadas por los tres roles y jarabes que las agrupan.
+    Devuelve un dict con los objetos que usan las pruebas.
+    """
+    hoy = datetime.date(2025, 1, 1)
+    vence = datetime.date(2027, 1, 1)
+
+    firmantes = {}
+    for i, rol in enumerate(
+        ["JEFE_SECCION", "JEFE_PRODUCCION",
+         "QUIMICO_FARMACEUTICO", "INSPECTOR_CALIDAD"]
+    ):
+        usuario = UsuarioPersonalizado.objects.create_user(
+            username=f"firmante{i}",
+            password=PASSWORD,
+            rut=f"1111111{i}-{i}",
+            first_name="Firmante",
+            last_name=rol.title(),
+        )
+        PerfilUsuario.objects.create(usuario=usuario, rol=rol)
+        firmantes[rol] = usuario
+    inspector = firmantes["INSPECTOR_CALIDAD"]
+
+    bodega_mp = Bodega.objects.create(
+        nombre="Bodega Materias Primas", tipo="MP", es_principal=True
+    )
+    bodega_ep = Bodega.objects.create(
+        nombre="Bodega Envase Primario", tipo="EP", es_principal=True
+    )
+    bodega_es = Bodega.objects.create(
+        nombre="Bodega Envase Secundario", tipo="ES", es_principal=True
+    )
+
+    tipo = TipoProducto.objects.create(nombre="Jarabe", descripcion="Jarabe")
+    productos = [
+        Producto.objects.create(
+            nombre=f"Producto {i}",
+            cantidad_teorica=100,
+            cantidad_real=98,
+            rendimiento=98,
+            fecha_emision=hoy,
+            fecha_vencimiento=vence,
+        )
+        for i in range(n)
+    ]
+
+    def firmar_cc(cc):
+        firma = RegistroFirma.objects.create(usuario=inspector, firma_hash="x")
+        cc.firma_control_calidad = firma
+        cc.aprobado = True
+        cc.save(update_fields=["firma_control_calidad", "aprobado"])
+        return firma
+
+    materias, materiales_ep, materiales_es = [], [], []
+    for i in range(n):
+        mp = MateriaPrima.objects.create(
+            nombre=f"Materia {i}", cantidad=1000, batch=f"MP-{i:04d}"
+        )
+        cc = ControlCalidad.objects.create(
+            resultado="OK", fecha_verificacion=hoy,
+            inspector=inspector, materia_prima=mp, producto=productos[i],
+        )
+        mp.firma_inspector_calidad = firmar_cc(cc)
+        mp.actualizar_estado_aprobacion()
+        MovimientoStock.registrar(bodega_mp, mp, 1000, "ENTRADA")
+        materias.append(mp)
+
+        mep = MaterialEnvasePrimario.objects.create(
+            codigo=f"EP-{i:04d}", nombre=f"Frasco {i}", tipo_envase="Frasco"
+        )
+        cc = ControlCalidad.objects.create(
+            resultado="OK", fecha_verificacion=hoy,
+            inspector=inspector, material_envase_primario=mep,
+        )
+        firmar_cc(cc)
+        mep.actualizar_estado_aprobacion(cc)
+        MovimientoStock.registrar(bodega_ep, mep, 1000, "ENTRADA")
+        materiales_ep.append(mep)
+
+        mes = MaterialEnvaseSecundarioEmpaque.objects.create(
+            codigo=f"ES-{i:04d}", nombre=f"Caja {i}", tipo_envase="Caja"
+        )
+        cc = ControlCalidad.objects.create(
+            resultado="OK", fecha_verificacion=hoy,
+            inspector=inspector, material_envase_secundario_empaque=mes,
+        )
+        firmar_cc(cc)
+        mes.actualizar_estado_aprobacion(cc)
+        MovimientoStock.registrar(bodega_es, mes, 1000, "ENTRADA")
+        materiales_es.append(mes)
+
+    comunes = {
+        "tipo_producto": tipo,
+        "fecha_emision": hoy,
+        "fecha_vencimiento": vence,
+        "rendimiento_teorico": 100,
+        "periodo_eficacia": 24,
+        "cantidad_estuches": 50,
+    }
+    firmas_planilla = ["JEFE_SECCION", "JEFE_PRODUCCION", "QUIMICO_FARMACEUTICO"]
+
+    jarabes = []
+    for i in range(n):
+        pf = PlanillaFabricacion.objects.create(
+            producto=productos[i], serie="F", numero_planilla=str(i),
+            control_calidad=materias[i].controles_calidad.get(),
+            materia_prima=materias[i], **comunes,
+        )
+        pep = PlanillaEnvasePrimario.objects.create(
+            producto=productos[i], serie="P", numero_planilla=str(i),
+            control_calidad=materiales_ep[i]
+            .controles_calidad_envase_primario.get(),
+            material_envase_primario=materiales_ep[i], **comunes,
+        )
+        pes = PlanillaEnvaseSecundarioEmpaque.objects.create(
+            producto=productos[i], serie="S", numero_planilla=str(i),
+            control_calidad=materiales_es[i]
+            .controles_calidad_envase_secundario.get(),
+            material_envase_secundario_empaque=materiales_es[i], **comunes,
+        )
+        for rol in firmas_planilla:
+            RegistroFirma.objects.create(
+                usuario=firmantes[rol], planilla_fabricacion=pf,
+                firma_hash="x",
+            )
+            RegistroFirma.objects.create(
+                usuario=firmantes[rol], planilla_envase_primario=pep,
+                firma_hash="x",
+            )
+            RegistroFirma.objects.create(
+                usuario=firmantes[rol],
+                planilla_envase_secundario_empaque=pes,
+                firma_hash="x",
+            )
+
+        pe = PlanillaEnvase.objects.create(
+            producto=productos[i], tipo_producto=tipo,
+            cantidad_teorica=100, cantidad_real=98, rendimiento=98,
+            fecha_emision=hoy, fecha_vencimiento=vence,
+        )
+        jarabes.append(Jarabe.objects.create(
+            producto=productos[i], lote=f"L-{i:04d}", fecha_inicio=hoy,
+            planilla_fabricacion=pf, planilla_envase=pe,
+            planilla_envase_primario=pep,
+        ))
+
+    return {
+        "firmantes": firmantes,
+        "tipo": tipo,
+        "productos": productos,
+        "materias": materias,
+        "materiales_ep": materiales_ep,
+        "materiales_es": materiales_es,
+        "jarabes": jarabes,
+        "bodegas": [bodega_mp, bodega_ep, bodega_es],
+    }
+
+
+# ===========================================================
+# PRUEBAS DE PRESUPUESTO
+# ===========================================================
+@override_settings(
+    # El costo de PBKDF2 no es parte del código de la API.
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+)
+class PresupuestoEndpointsTests(TestCase):
+    """
+    Verifica que cada ruta de GPQAPI/urls.py respeta su presupuesto de
+    consultas SQL y de tiempo para list, retrieve, create y firmar.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos()
+        cls.admin = UsuarioPersonalizado.objects.create_superuser(
+            username="admin", password=PASSWORD, rut="99999999-9"
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    # ---------------------------------------------------------
+    # Medición
+    # ---------------------------------------------------------
+    def medir(self, prefijo, accion, metodo, url, data=None, formato="json"):
+        presupuesto = PRESUPUESTOS[prefijo][accion]
+        llamar = getattr(self.client, metodo)
+
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            # lo que corre al confirmar (invalidar dossieres) también cuenta
+            with self.captureOnCommitCallbacks(execute=True):
+                if data is None:
+                    response = llamar(url)
+                else:
+                    response = llamar(url, data, format=formato)
+            if response.streaming:
+                # las exportaciones consultan mientras se consume el cuerpo
+                b"".join(response.streaming_content)
+            ms = (time.perf_counter() - inicio) * 1000
+
+        self.assertLess(
+            response.status_code, 400,
+            f"{metodo.upper()} {url} -> {response.status_code}: "
+            f"{getattr(response, 'data', '')}",
+        )
+        self.assertLessEqual(
+            len(consultas), presupuesto.consultas,
+            f"{prefijo}.{accion}: {len(consultas)} consultas "
+            f"(presupuesto {presupuesto.consultas})",
+        )
+        if FACTOR_PRESUPUESTO_MS:
+            limite = presupuesto.ms * FACTOR_PRESUPUESTO_MS
+            self.assertLessEqual(
+                ms, limite,
+                f"{prefijo}.{accion}: {ms:.1f} ms (presupuesto {limite:.0f})",
+            )
+        return response
+
+    def objeto(self, prefijo):
+        """Fila existente que se usa para retrieve, firmar y acciones."""
+        modelo = self.viewset(prefijo).queryset.model
+        return modelo.objects.order_by("id").first()
+
+    def viewset(self, prefijo):
+        for registrado, viewset, _ in router.registry:
+            if registrado == prefijo:
+                return viewset
+        raise KeyError(prefijo)
+
+    # ---------------------------------------------------------
+    # Cobertura de la tabla
+    # ---------------------------------------------------------
+    def test_todas_las_rutas_tienen_presupuesto(self):
+        for prefijo, viewset, _ in router.registry:
+            with self.subTest(ruta=prefijo):
+                self.assertIn(prefijo, PRESUPUESTOS)
+                acciones = set(PRESUPUESTOS[prefijo])
+                for accion in ("list", "retrieve", "create"):
+                    if hasattr(viewset, accion):
+                        self.assertIn(accion, acciones)
+                if hasattr(viewset, "firmar"):
+                    self.assertIn("firmar", acciones)
+                meta = getattr(viewset.serializer_class, "Meta", None)
+                if getattr(meta, "expandable_fields", ()):
+                    self.assertIn("list_expandido", acciones)
+                for extra in viewset.get_extra_actions():
+                    self.assertIn(extra.url_path, acciones)
+
+    # ---------------------------------------------------------
+    # Acciones
+    # ---------------------------------------------------------
+    def test_list(self):
+        for prefijo, acciones in PRESUPUESTOS.items():
+            if "list" not in acciones:
+                continue
+            with self.subTest(ruta=prefijo):
+                self.medir(prefijo, "list", "get", f"/api/{prefijo}/")
+
+    def test_list_expandido(self):
+        # ?expand=* debe seguir costando un número fijo de consultas
+        for prefijo, acciones in PRESUPUESTOS.items():
+            if "list_expandido" not in acciones:
+                continue
+            with self.subTest(ruta=prefijo):
+                self.medir(
+                    prefijo, "list_expandido", "get",
+                    f"/api/{prefijo}/?expand=*",
+                )
+
+    def test_retrieve(self):
+        for prefijo, acciones in PRESUPUESTOS.items():
+            if "retrieve" not in acciones:
+                continue
+            with self.subTest(ruta=prefijo):
+                obj = self.objeto(prefijo)
+                self.medir(
+                    prefijo, "retrieve", "get", f"/api/{prefijo}/{obj.pk}/"
+                )
+
+    def test_create(self):
+        for prefijo, acciones in PRESUPUESTOS.items():
+            if "create" not in acciones:
+                continue
+            with self.subTest(ruta=prefijo):
+                self.medir(
+                    prefijo, "create", "post", f"/api/{prefijo}/",
+                    self.payload_create(prefijo),
+                )
+
+    def test_acciones_detalle(self):
+        for prefijo, acciones in PRESUPUESTOS.items():
+            extras = {
+                extra.url_path: extra
+                for extra in self.viewset(prefijo).get_extra_actions()
+            }
+            for accion in set(acciones) - ACCIONES_ESTANDAR:
+                with self.subTest(ruta=prefijo, accion=accion):
+                    extra = extras[accion]
+                    if extra.detail:
+                        obj = self.objeto(prefijo)
+                        url = f"/api/{prefijo}/{obj.pk}/{accion}/"
+                    else:
+                        url = f"/api/{prefijo}/{accion}/"
+                    if "get" in extra.mapping:
+                        self.medir(prefijo, accion, "get", url)
+                    else:
+                        self.medir(
+                            prefijo, accion, "post", url,
+                            self.payload_accion(prefijo, accion),
+                            formato="multipart",
+                        )
+
+    def test_firmar(self):
+        firmantes = self.datos["firmantes"]
+        for prefijo, acciones in PRESUPUESTOS.items():
+            if "firmar" not in acciones:
+                continue
+            with self.subTest(ruta=prefijo):
+                if prefijo == "controles-calidad":
+                    firmante = firmantes["INSPECTOR_CALIDAD"]
+                    obj = ControlCalidad.objects.create(
+                        resultado="OK",
+                        fecha_verificacion=datetime.date(2025, 2, 1),
+                        inspector=firmante,
+                        materia_prima=self.datos["materias"][0],
+                    )
+                else:
+                    firmante = firmantes["JEFE_SECCION"]
+                    obj = self.planilla_sin_firmas(prefijo)
+                self.medir(
+                    prefijo, "firmar", "post",
+                    f"/api/{prefijo}/{obj.pk}/firmar/",
+                    {"rut": firmante.rut, "password": PASSWORD},
+                )
+
+    # ---------------------------------------------------------
+    # Payloads
+    # ---------------------------------------------------------
+    def planilla_sin_firmas(self, prefijo):
+        plantilla = self.objeto(prefijo)
+        plantilla.pk = None
+        plantilla.id = None
+        plantilla.firma_jefe_seccion = None
+        plantilla.firma_jefe_produccion = None
+        plantilla.firma_quimico_farmaceutico = None
+        plantilla.estado_aprobacion = "EN_PROCESO"
+        plantilla.save()
+        return plantilla
+
+    def payload_create(self, prefijo):
+        datos = self.datos
+        producto = datos["productos"][0]
+        planilla = {
+            "producto": producto.id,
+            "tipo_producto": datos["tipo"].id,
+            "serie": "N",
+            "numero_planilla": "1",
+            "fecha_emision": "2025-01-01",
+            "fecha_vencimiento": "2026-01-01",
+            "rendimiento_teorico": "100.00",
+            "periodo_eficacia": 24,
+            "cantidad_estuches": "10.00",
+            "tipo_movimiento": "PEDIDO_BODEGA",
+            "cantidad_entregada": "5.00",
+        }
+        sin_perfil = UsuarioPersonalizado.objects.create_user(
+            username=f"nuevo-{prefijo}",
+            rut=f"{UsuarioPersonalizado.objects.count():08d}-K",
+            password=PASSWORD,
+        )
+        payloads = {
+            "usuarios": {
+                "username": "nuevo",
+                "rut": "12345678-5",
+                "password": PASSWORD,
+            },
+            "perfiles": {"usuario": sin_perfil.id, "rol": "JEFE_SECCION"},
+            "registro-firmas": {"usuario": sin_perfil.id},
+            "sesiones-firma": {
+                "rut": datos["firmantes"]["JEFE_SECCION"].rut,
+                "password": PASSWORD,
+            },
+            "firmas-masivas": {
+                "rut": datos["firmantes"]["JEFE_SECCION"].rut,
+                "password": PASSWORD,
+                "planillas": [
+                    {"tipo": tipo, "id": self.planilla_sin_firmas(ruta).id}
+                    for tipo, ruta in [
+                        ("planilla_fabricacion",
+                         "planillas-fabricacion-Pedido"),
+                        ("planilla_envase_primario",
+                         "planillas-envase-primario-Pedido"),
+                        ("planilla_envase_secundario_empaque",
+                         "planilla-envase-Secundario-empaque"),
+                    ]
+                ],
+            },
+            "productos": {
+                "nombre": "Nuevo",
+                "cantidad_teorica": "10.00",
+                "cantidad_real": "10.00",
+                "rendimiento": "100.00",
+                "fecha_emision": "2025-01-01",
+                "fecha_vencimiento": "2026-01-01",
+            },
+            "tipos-producto": {"nombre": "Nuevo", "descripcion": "Nuevo"},
+            "materias-primas": {
+                "nombre": "Nueva", "cantidad": "10.00", "batch": "NEW-1",
+            },
+            "materiales-envase-primario": {
+                "codigo": "EP-NEW", "nombre": "Nuevo", "tipo_envase": "Frasco",
+            },
+            "materiales-envase-secundario-empaque": {
+                "codigo": "ES-NEW", "nombre": "Nuevo", "tipo_envase": "Caja",
+            },
+            "controles-calidad": {
+                "resultado": "OK",
+                "fecha_verificacion": "2025-01-01",
+                "inspector": datos["firmantes"]["INSPECTOR_CALIDAD"].id,
+                "materia_prima": datos["materias"][1].id,
+            },
+            "planillas-fabricacion-Pedido": dict(
+                planilla, materia_prima=datos["materias"][0].id
+            ),
+            "planillas-envase": {
+                "producto": producto.id,
+                "tipo_producto": datos["tipo"].id,
+                "cantidad_teorica": "10.00",
+                "cantidad_real": "10.00",
+                "rendimiento": "100.00",
+                "fecha_emision": "2025-01-01",
+                "fecha_vencimiento": "2026-01-01",
+            },
+            "planillas-envase-primario-Pedido": dict(
+                planilla,
+                material_envase_primario=datos["materiales_ep"][0].id,
+            ),
+            "jarabes": {
+                "producto": producto.id,
+                "lote": "NEW-1",
+                "fecha_inicio": "2025-01-01",
+            },
+            "bodegas": {"nombre": "Nueva", "tipo": "PT"},
+            "stock-materias-primas": {
+                "materia_prima": datos["materias"][0].id,
+                "cantidad_disponible": "500.00",
+            },
+            "stock-materiales-envase-primario": {
+                "material_envase_primario": datos["materiales_ep"][0].id,
+                "cantidad_disponible": "500.00",
+            },
+            "stock-materiales-envase-secundario": {
+                "material_envase_secundario_empaque":
+                    datos["materiales_es"][0].id,
+                "cantidad_disponible": "500.00",
+            },
+            "planilla-envase-Secundario-empaque": dict(
+                planilla,
+                material_envase_secundario_empaque=datos["materiales_es"][0].id,
+            ),
+        }
+        return payloads[prefijo]
+
+    def payload_accion(self, prefijo, accion):
+        payloads = {
+            ("materias-primas", "importar"): {
+                "archivo": SimpleUploadedFile(
+                    "recepcion.csv",
+                    b"nombre,batch,cantidad\n"
+                    + b"".join(
+                        f"Importada {i},IMP-{i:04d},100\n".encode()
+                        for i in range(FILAS_POR_TABLA)
+                    ),
+                    content_type="text/csv",
+                ),
+            },
+        }
+        return payloads[(prefijo, accion)]
+
+
+# ===========================================================
+# PAGINACIÓN POR CURSOR
+# ===========================================================
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+)
+class PaginacionCursorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos()
+        cls.admin = UsuarioPersonalizado.objects.create_superuser(
+            username="admin", password=PASSWORD, rut="99999999-9"
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def recorrer(self, url):
+        ids, sqls = [], []
+        while url:
+            with CaptureQueriesContext(connection) as consultas:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            sqls.extend(q["sql"].upper() for q in consultas)
+            ids.extend(fila["id"] for fila in response.data["results"])
+            url = response.data["next"]
+        return ids, sqls
+
+    def test_recorre_tabla_completa_sin_offset_ni_count(self):
+        for prefijo, modelo in [
+            ("registro-firmas", RegistroFirma),
+            ("planillas-fabricacion-Pedido", PlanillaFabricacion),
+            ("planillas-envase-primario-Pedido", PlanillaEnvasePrimario),
+            ("planilla-envase-Secundario-empaque",
+             PlanillaEnvaseSecundarioEmpaque),
+        ]:
+            with self.subTest(ruta=prefijo):
+                ids, sqls = self.recorrer(f"/api/{prefijo}/?page_size=7")
+                self.assertEqual(sorted(ids), sorted(
+                    modelo.objects.values_list("id", flat=True)
+                ))
+                self.assertEqual(len(ids), len(set(ids)))
+                self.assertFalse(any("COUNT(" in sql for sql in sqls))
+                self.assertFalse(any(" OFFSET " in sql for sql in sqls))
+
+    def test_empates_de_fecha_se_paginan_por_id(self):
+        # todas con la misma fecha: el cursor debe avanzar por id, sin OFFSET
+        PlanillaFabricacion.objects.update(fecha_creacion=timezone.now())
+        ids, sqls = self.recorrer(
+            "/api/planillas-fabricacion-Pedido/?page_size=2"
+        )
+        esperados = list(
+            PlanillaFabricacion.objects.order_by("-id")
+            .values_list("id", flat=True)
+        )
+        self.assertGreater(len(esperados), 2)
+        self.assertEqual(ids, esperados)
+        self.assertFalse(any(" OFFSET " in sql for sql in sqls))
+
+    def test_pagina_anterior_con_empates(self):
+        PlanillaFabricacion.objects.update(fecha_creacion=timezone.now())
+        url = "/api/planillas-fabricacion-Pedido/?page_size=2"
+        primera = self.client.get(url).data
+        segunda = self.client.get(primera["next"]).data
+        anterior = self.client.get(segunda["previous"]).data
+        self.assertEqual(
+            [fila["id"] for fila in anterior["results"]],
+            [fila["id"] for fila in primera["results"]],
+        )
+
+    def test_cursor_invalido(self):
+        response = self.client.get(
+            "/api/registro-firmas/?cursor=cD1ub2VzanNvbg%3D%3D"
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_size_tiene_tope(self):
+        response = self.client.get("/api/registro-firmas/?page_size=100000")
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.data["results"]), 200)
+
+
+# ===========================================================
+# CAMPOS DINÁMICOS (?fields= / ?expand=)
+# ===========================================================
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+)
+class CamposDinamicosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(n=2)
+        cls.admin = UsuarioPersonalizado.objects.create_superuser(
+            username="admin", password=PASSWORD, rut="99999999-9"
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def primera(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data["results"][0]
+
+    def test_anidados_solo_con_expand(self):
+        url = "/api/planillas-fabricacion-Pedido/"
+        fila = self.primera(url)
+        self.assertNotIn("firma_jefe_seccion_info", fila)
+        self.assertIn("codigo_control_calidad", fila)
+
+        fila = self.primera(f"{url}?expand=firma_jefe_seccion_info")
+        self.assertEqual(
+            fila["firma_jefe_seccion_info"]["usuario_rut"],
+            self.datos["firmantes"]["JEFE_SECCION"].rut,
+        )
+        self.assertNotIn("firma_jefe_produccion_info", fila)
+
+    def test_fields_limita_campos(self):
+        fila = self.primera(
+            "/api/planillas-fabricacion-Pedido/?fields=id,estado_aprobacion"
+        )
+        self.assertEqual(set(fila), {"id", "estado_aprobacion"})
+
+    def test_expand_con_ruta_anidada(self):
+        url = "/api/stock-materiales-envase-primario/"
+        fila = self.primera(f"{url}?expand=material_detalle")
+        self.assertNotIn("control_calidad_info", fila["material_detalle"])
+
+        fila = self.primera(
+            f"{url}?expand=material_detalle.control_calidad_info"
+            "&fields=id,material_detalle.codigo,"
+            "material_detalle.control_calidad_info"
+        )
+        self.assertEqual(set(fila), {"id", "material_detalle"})
+        self.assertEqual(
+            set(fila["material_detalle"]), {"codigo", "control_calidad_info"}
+        )
+        resumen = fila["material_detalle"]["control_calidad_info"]
+        self.assertTrue(resumen["aprobado"])
+
+
+# ===========================================================
+# SECUENCIAS DE CÓDIGOS
+# ===========================================================
+class SecuenciaCodigoTests(TestCase):
+
+    def test_codigos_consecutivos_por_prefijo(self):
+        self.assertEqual(SecuenciaCodigo.siguiente("TST"), "TST-0001")
+        self.assertEqual(SecuenciaCodigo.siguiente("TST"), "TST-0002")
+        self.assertEqual(SecuenciaCodigo.siguiente("OTR"), "OTR-0001")
+
+    def test_reserva_en_bloque_en_un_solo_incremento(self):
+        SecuenciaCodigo.siguiente("TST")
+        with CaptureQueriesContext(connection) as consultas:
+            codigos = SecuenciaCodigo.reservar("TST", 3)
+        self.assertEqual(codigos, ["TST-0002", "TST-0003", "TST-0004"])
+        updates = [q for q in consultas if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(SecuenciaCodigo.siguiente("TST"), "TST-0005")
+
+    def test_modelos_usan_la_secuencia(self):
+        primero = MaterialEnvasePrimario.objects.create(
+            codigo="A", nombre="A", tipo_envase="Frasco"
+        )
+        segundo = MaterialEnvasePrimario.objects.create(
+            codigo="B", nombre="B", tipo_envase="Frasco"
+        )
+        self.assertEqual(primero.codigo_calidad, "MEP-0001")
+        self.assertEqual(segundo.codigo_calidad, "MEP-0002")
+
+
+# ===========================================================
+# LIBRO DE MOVIMIENTOS DE STOCK
+# ===========================================================
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+)
+class MovimientoStockTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(n=2)
+        cls.admin = UsuarioPersonalizado.objects.create_superuser(
+            username="admin", password=PASSWORD, rut="99999999-9"
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.bodega = self.datos["bodegas"][0]
+        self.materia = self.datos["materias"][0]
+
+    def saldo(self):
+        return StockMateriaPrima.objects.get(
+            bodega=self.bodega, materia_prima=self.materia
+        ).cantidad_disponible
+
+    def suma_libro(self):
+        return sum(
+            m.cantidad for m in MovimientoStock.objects.filter(
+                bodega=self.bodega, materia_prima=self.materia
+            )
+        )
+
+    def test_saldo_igual_a_suma_del_libro(self):
+        MovimientoStock.registrar(self.bodega, self.materia, -300, "SALIDA")
+        MovimientoStock.ajustar(self.bodega, self.materia, 950)
+        self.assertEqual(self.saldo(), 950)
+        self.assertEqual(self.suma_libro(), self.saldo())
+
+    def test_salida_sin_saldo_no_descuenta(self):
+        with self.assertRaises(ValidationError):
+            MovimientoStock.registrar(
+                self.bodega, self.materia, -5000, "SALIDA"
+            )
+        self.assertEqual(self.saldo(), 1000)
+        self.assertEqual(self.suma_libro(), 1000)
+
+    def test_pedido_sin_saldo_no_crea_planilla(self):
+        planilla = PlanillaFabricacion.objects.first()
+        antes = PlanillaFabricacion.objects.count()
+        response = self.client.post(
+            "/api/planillas-fabricacion-Pedido/",
+            {
+                "producto": planilla.producto_id,
+                "tipo_producto": planilla.tipo_producto_id,
+                "serie": "N",
+                "numero_planilla": "1",
+                "fecha_emision": "2025-01-01",
+                "fecha_vencimiento": "2026-01-01",
+                "rendimiento_teorico": "100.00",
+                "periodo_eficacia": 24,
+                "cantidad_estuches": "10.00",
+                "materia_prima": self.materia.id,
+                "tipo_movimiento": "PEDIDO_BODEGA",
+                "cantidad_entregada": "5000.00",
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("cantidad_entregada", response.data)
+        self.assertEqual(PlanillaFabricacion.objects.count(), antes)
+        self.assertEqual(self.saldo(), 1000)
+
+    def test_edicion_de_stock_queda_en_el_libro(self):
+        stock = StockMateriaPrima.objects.get(
+            bodega=self.bodega, materia_prima=self.materia
+        )
+        response = self.client.patch(
+            f"/api/stock-materias-primas/{stock.pk}/",
+            {"cantidad_disponible": "400.00"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data["cantidad_disponible"]), 400)
+        self.assertEqual(self.suma_libro(), 400)
+
+    def test_movimientos_no_se_modifican_ni_eliminan(self):
+        movimiento = MovimientoStock.objects.first()
+        movimiento.cantidad = 1
+        with self.assertRaises(ValidationError):
+            movimiento.save()
+        with self.assertRaises(ValidationError):
+            movimiento.delete()
+        response = self.client.delete(
+            f"/api/movimientos-stock/{movimiento.pk}/"
+        )
+        self.assertEqual(response.status_code, 405)
+
+    def test_no_se_elimina_material_ni_bodega_con_movimientos(self):
+        for url, modelo, pk in [
+            ("materias-primas", MateriaPrima, self.materia.pk),
+            ("bodegas", Bodega, self.bodega.pk),
+        ]:
+            with self.subTest(ruta=url):
+                response = self.client.delete(f"/api/{url}/{pk}/")
+                self.assertEqual(response.status_code, 409)
+                self.assertIn("No se puede eliminar", response.data["error"])
+                self.assertEqual(
+                    response.data["relacionados"], ["MovimientoStock"]
+                )
+                self.assertTrue(modelo.objects.filter(pk=pk).exists())
+        self.assertEqual(self.saldo(), 1000)
+
+
+# ===========================================================
+# BODEGAS PRINCIPALES
+# ===========================================================
+class BodegaPrincipalTests(TestCase):
+
+    def setUp(self):
+        self.bodega = Bodega.objects.create(
+            nombre="Bodega Materias Primas", tipo="MP", es_principal=True
+        )
+
+    def test_sin_consultas_una_vez_resuelta(self):
+        self.assertEqual(Bodega.principal("MP"), self.bodega)
+        with self.assertNumQueries(0):
+            self.assertEqual(Bodega.principal("MP"), self.bodega)
+
+    def test_guardar_o_eliminar_invalida_el_registro(self):
+        Bodega.principal("MP")
+        self.bodega.es_principal = False
+        self.bodega.save()
+        nueva = Bodega.objects.create(
+            nombre="Bodega MP 2", tipo="MP", es_principal=True
+        )
+        self.assertEqual(Bodega.principal("MP"), nueva)
+
+        nueva.delete()
+        self.assertIsNone(Bodega.principal("MP", crear=False))
+
+    def test_crea_la_principal_si_no_existe(self):
+        bodega = Bodega.principal("EP")
+        self.assertEqual(bodega.nombre, "Bodega Envase Primario")
+        self.assertTrue(bodega.es_principal)
+
+
+# ===========================================================
+# SESIONES DE FIRMA
+# ===========================================================
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+)
+class SesionFirmaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(n=2)
+        cls.jefe = cls.datos["firmantes"]["JEFE_SECCION"]
+        cls.inspector = cls.datos["firmantes"]["INSPECTOR_CALIDAD"]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.jefe)
+
+    def abrir(self, usuario, **extra):
+        return self.client.post(
+            "/api/sesiones-firma/",
+            {"rut": usuario.rut, "password": PASSWORD, **extra},
+            format="json",
+        )
+
+    def planilla_sin_firmas(self):
+        planilla = PlanillaFabricacion.objects.first()
+        planilla.pk = None
+        planilla.firma_jefe_seccion = None
+        planilla.firma_jefe_produccion = None
+        planilla.firma_quimico_farmaceutico = None
+        planilla.save()
+        return planilla
+
+    def firmar(self, planilla, token):
+        return self.client.post(
+            f"/api/planillas-fabricacion-Pedido/{planilla.pk}/firmar/",
+            {"token": token},
+            format="json",
+        )
+
+    def test_firma_con_token_no_recalcula_la_contrasena(self):
+        token = self.abrir(self.jefe).data["token"]
+        planilla = self.planilla_sin_firmas()
+        with mock.patch.object(
+            UsuarioPersonalizado, "check_password"
+        ) as check_password:
+            response = self.firmar(planilla, token)
+        self.assertEqual(response.status_code, 200)
+        check_password.assert_not_called()
+        firma = RegistroFirma.objects.get(pk=response.data["firma_id"])
+        self.assertEqual(firma.usuario, self.jefe)
+        self.assertEqual(firma.sesion_firma.usuario, self.jefe)
+
+    def test_alcance_por_rol(self):
+        response = self.abrir(self.inspector)
+        self.assertEqual(response.data["alcance"], ["control_calidad"])
+        # el token del inspector no firma planillas
+        response = self.firmar(
+            self.planilla_sin_firmas(), response.data["token"]
+        )
+        self.assertEqual(response.status_code, 401)
+
+        response = self.abrir(self.inspector, alcance=["planilla_fabricacion"])
+        self.assertEqual(response.status_code, 403)
+
+    def test_token_expirado_o_revocado(self):
+        token = self.abrir(self.jefe).data["token"]
+        SesionFirma.objects.update(
+            expira=timezone.now() - datetime.timedelta(seconds=1)
+        )
+        self.assertEqual(
+            self.firmar(self.planilla_sin_firmas(), token).status_code, 401
+        )
+
+        token = self.abrir(self.jefe).data["token"]
+        SesionFirma.objects.update(revocada=True)
+        self.assertEqual(
+            self.firmar(self.planilla_sin_firmas(), token).status_code, 401
+        )
+
+    def test_contrasena_incorrecta_no_abre_sesion(self):
+        response = self.client.post(
+            "/api/sesiones-firma/",
+            {"rut": self.jefe.rut, "password": "otra"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(SesionFirma.objects.exists())
+
+
+# ===========================================================
+# FIRMA MASIVA
+# ===========================================================
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+)
+class FirmaMasivaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(n=2)
+        cls.firmantes = cls.datos["firmantes"]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.firmantes["JEFE_SECCION"])
+
+    def nuevas(self, modelo, n):
+        planillas = []
+        for _ in range(n):
+            planilla = modelo.objects.order_by("id").first()
+            planilla.pk = None
+            planilla.firma_jefe_seccion = None
+            planilla.firma_jefe_produccion = None
+            planilla.firma_quimico_farmaceutico = None
+            planilla.estado_aprobacion = "EN_PROCESO"
+            planilla.save()
+            planillas.append(planilla)
+        return planillas
+
+    def firmar(self, rol, objetivos):
+        return self.client.post(
+            "/api/firmas-masivas/",
+            {
+                "rut": self.firmantes[rol].rut,
+                "password": PASSWORD,
+                "planillas": [{"tipo": t, "id": i} for t, i in objetivos],
+            },
+            format="json",
+        )
+
+    def test_consultas_no_crecen_con_el_lote(self):
+        consultas = []
+        for n in (2, 6):
+            objetivos = [
+                ("planilla_fabricacion", p.id)
+                for p in self.nuevas(PlanillaFabricacion, n)
+            ] + [
+                ("planilla_envase_primario", p.id)
+                for p in self.nuevas(PlanillaEnvasePrimario, n)
+            ]
+            with CaptureQueriesContext(connection) as capturadas:
+                response = self.firmar("JEFE_SECCION", objetivos)
+            self.assertEqual(response.data["firmadas"], 2 * n)
+            consultas.append(len(capturadas))
+        self.assertEqual(consultas[0], consultas[1])
+
+    def test_una_validacion_de_credenciales(self):
+        objetivos = [
+            ("planilla_fabricacion", p.id)
+            for p in self.nuevas(PlanillaFabricacion, 3)
+        ]
+        with mock.patch.object(
+            UsuarioPersonalizado, "check_password", autospec=True,
+            return_value=True,
+        ) as check_password:
+            self.firmar("JEFE_SECCION", objetivos)
+        self.assertEqual(check_password.call_count, 1)
+
+    def test_resultado_por_planilla(self):
+        libre, firmada = self.nuevas(PlanillaFabricacion, 2)
+        self.firmar("JEFE_SECCION", [("planilla_fabricacion", firmada.id)])
+
+        response = self.firmar("JEFE_SECCION", [
+            ("planilla_fabricacion", libre.id),
+            ("planilla_fabricacion", firmada.id),
+            ("planilla_fabricacion", 999999),
+        ])
+        self.assertEqual(response.status_code, 200)
+        ok = [r["ok"] for r in response.data["resultados"]]
+        self.assertEqual(ok, [True, False, False])
+        self.assertEqual(
+            RegistroFirma.objects.filter(planilla_fabricacion=firmada).count(),
+            1,
+        )
+
+    def test_tercera_firma_aprueba_y_descuenta_envase_secundario(self):
+        (planilla,) = self.nuevas(PlanillaEnvaseSecundarioEmpaque, 1)
+        planilla.tipo_movimiento = "PEDIDO_BODEGA"
+        planilla.cantidad_entregada = 10
+        planilla.save()
+        stock = StockMaterialEnvaseSecundarioEmpaque.objects.get(
+            material_envase_secundario_empaque=(
+                planilla.material_envase_secundario_empaque
+            )
+        )
+        objetivo = [("planilla_envase_secundario_empaque", planilla.id)]
+
+        for rol in ("JEFE_SECCION", "JEFE_PRODUCCION"):
+            response = self.firmar(rol, objetivo)
+            self.assertEqual(
+                response.data["resultados"][0]["estado_aprobacion"],
+                "EN_PROCESO",
+            )
+        response = self.firmar("QUIMICO_FARMACEUTICO", objetivo)
+        self.assertEqual(
+            response.data["resultados"][0]["estado_aprobacion"], "APROBADO"
+        )
+
+        planilla.refresh_from_db()
+        self.assertEqual(planilla.estado_aprobacion, "APROBADO")
+        self.assertIsNotNone(planilla.firma_quimico_farmaceutico)
+        stock.refresh_from_db()
+        self.assertEqual(stock.cantidad_disponible, 990)
+
+    def test_firma_deja_auditoria_de_modificacion(self):
+        (planilla,) = self.nuevas(PlanillaFabricacion, 1)
+        antes = timezone.now() - datetime.timedelta(days=1)
+        PlanillaFabricacion.objects.filter(pk=planilla.pk).update(
+            fecha_primera_modificacion=None,
+            fecha_ultima_modificacion=antes,
+            usuario_ultima_modificacion="otro",
+        )
+
+        self.firmar("JEFE_SECCION", [("planilla_fabricacion", planilla.id)])
+
+        planilla.refresh_from_db()
+        self.assertGreater(planilla.fecha_ultima_modificacion, antes)
+        self.assertEqual(
+            planilla.fecha_primera_modificacion,
+            planilla.fecha_ultima_modificacion,
+        )
+        self.assertEqual(
+            planilla.usuario_ultima_modificacion,
+            self.firmantes["JEFE_SECCION"].username,
+        )
+
+    def test_descuento_fallido_revierte_la_firma(self):
+        (planilla,) = self.nuevas(PlanillaEnvaseSecundarioEmpaque, 1)
+        objetivo = [("planilla_envase_secundario_empaque", planilla.id)]
+        for rol in ("JEFE_SECCION", "JEFE_PRODUCCION"):
+            self.firmar(rol, objetivo)
+
+        # el descuento corre en la transacción de la firma: si falla, la
+        # planilla no queda aprobada sin su salida de stock
+        with mock.patch.object(
+            PlanillaEnvaseSecundarioEmpaque, "descontar_stock_aprobado",
+            side_effect=RuntimeError("bodega caída"),
+        ), self.assertRaises(RuntimeError):
+            self.firmar("QUIMICO_FARMACEUTICO", objetivo)
+
+        planilla.refresh_from_db()
+        self.assertEqual(planilla.estado_aprobacion, "EN_PROCESO")
+        self.assertIsNone(planilla.firma_quimico_farmaceutico)
+        self.assertFalse(RegistroFirma.objects.filter(
+            planilla_envase_secundario_empaque=planilla,
+            tipo_firma="QUIMICO_FARMACEUTICO",
+        ).exists())
+
+
+# ===========================================================
+# LOGS ESTRUCTURADOS
+# ===========================================================
+class EventosTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            UsuarioPersonalizado.objects.create_user(
+                username="u", password=PASSWORD, rut="1-9"
+            )
+        )
+
+    def test_id_de_correlacion_en_la_respuesta(self):
+        response = self.client.get(
+            "/api/bodegas/", HTTP_X_REQUEST_ID="pedido-123"
+        )
+        self.assertEqual(response["X-Request-ID"], "pedido-123")
+
+        # un id con caracteres no seguros se reemplaza
+        response = self.client.get(
+            "/api/bodegas/", HTTP_X_REQUEST_ID="x\ninyectado"
+        )
+        self.assertRegex(response["X-Request-ID"], r"^[0-9a-f]{32}$")
+
+    def test_formato_json_con_correlacion_y_extra(self):
+        token = id_correlacion.set("abc")
+        try:
+            registro = logging.makeLogRecord({
+                "name": "GPQAPI.models", "levelno": logging.INFO,
+                "levelname": "INFO", "msg": "Firma %s", "args": (7,),
+                "firma_id": 7,
+            })
+            FiltroCorrelacion().filter(registro)
+        finally:
+            id_correlacion.reset(token)
+        datos = json.loads(FormatoJSON().format(registro))
+        self.assertEqual(datos["mensaje"], "Firma 7")
+        self.assertEqual(datos["id_correlacion"], "abc")
+        self.assertEqual(datos["firma_id"], 7)
+
+    def test_aprobacion_sin_consultas_de_depuracion(self):
+        inspector = UsuarioPersonalizado.objects.create_user(
+            username="insp", password=PASSWORD, rut="2-7"
+        )
+        material = MaterialEnvasePrimario.objects.create(
+            codigo="EP-1", nombre="Frasco", tipo_envase="Frasco"
+        )
+        cc = ControlCalidad.objects.create(
+            resultado="OK", fecha_verificacion=datetime.date(2025, 1, 1),
+            inspector=inspector, material_envase_primario=material,
+            aprobado=True,
+            firma_control_calidad=RegistroFirma.objects.create(
+                usuario=inspector, firma_hash="x"
+            ),
+        )
+        cc = ControlCalidad.objects.get(pk=cc.pk)
+        # solo el UPDATE del material: la firma no se carga para el log
+        with self.assertNumQueries(1):
+            material.actualizar_estado_aprobacion(cc)
+        self.assertEqual(material.estado_aprobacion, "APROBADO")
+
+
+# ===========================================================
+# MÉTRICAS
+# ===========================================================
+class MetricasTests(TestCase):
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajuste = override_settings(
+            GPQ_METRICAS_DB=os.path.join(directorio.name, "metricas.sqlite3")
+        )
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        almacen.reiniciar()
+
+        self.client = APIClient()
+        self.staff = UsuarioPersonalizado.objects.create_user(
+            username="staff", password=PASSWORD, rut="3-5", is_staff=True
+        )
+
+    def serie(self, texto, prefijo):
+        for linea in texto.splitlines():
+            if linea.startswith(prefijo):
+                return float(linea.rsplit(" ", 1)[1])
+        return None
+
+    def test_solo_staff(self):
+        normal = UsuarioPersonalizado.objects.create_user(
+            username="normal", password=PASSWORD, rut="4-3"
+        )
+        self.client.force_authenticate(normal)
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 403)
+
+    def test_latencia_consultas_y_errores_por_ruta(self):
+        self.client.force_authenticate(self.staff)
+        for _ in range(3):
+            self.client.get("/api/bodegas/")
+        self.client.get("/api/bodegas/999/")
+
+        response = self.client.get("/api/metrics/")
+        self.assertEqual(response.status_code, 200)
+        texto = response.content.decode()
+        etiquetas = 'ruta="bodega-list",metodo="GET"'
+        self.assertEqual(
+            self.serie(
+                texto,
+                f"gpq_http_request_duration_seconds_count{{{etiquetas}}}",
+            ),
+            3,
+        )
+        self.assertEqual(
+            self.serie(
+                texto,
+                "gpq_http_request_duration_seconds_bucket"
+                f'{{{etiquetas},le="+Inf"}}',
+            ),
+            3,
+        )
+        self.assertGreater(
+            self.serie(texto, f"gpq_db_queries_total{{{etiquetas}}}"), 0
+        )
+        self.assertGreater(
+            self.serie(texto, f"gpq_http_response_bytes_total{{{etiquetas}}}"),
+            0,
+        )
+        self.assertEqual(
+            self.serie(
+                texto,
+                'gpq_http_requests_total{ruta="bodega-detail",metodo="GET",'
+                'estado="4xx"}',
+            ),
+            1,
+        )
+
+    def test_agrega_varios_procesos(self):
+        # dos acumuladores independientes, como dos workers
+        for _ in range(2):
+            worker = AlmacenMetricas()
+            worker.registrar("bodega-list", "GET", 200, 0.02, 2, 0.001, 100)
+            worker.volcar()
+        texto = almacen.exportar()
+        self.assertEqual(
+            self.serie(
+                texto,
+                'gpq_http_requests_total{ruta="bodega-list",metodo="GET",'
+                'estado="2xx"}',
+            ),
+            2,
+        )
+        self.assertEqual(
+            self.serie(
+                texto,
+                'gpq_http_request_duration_seconds_bucket{ruta="bodega-list",'
+                'metodo="GET",le="0.01"}',
+            ),
+            0,
+        )
+        self.assertEqual(
+            self.serie(
+                texto,
+                'gpq_http_request_duration_seconds_bucket{ruta="bodega-list",'
+                'metodo="GET",le="0.025"}',
+            ),
+            2,
+        )
+
+
+# ===========================================================
+# GENERADOR DE DATOS SINTÉTICOS
+# ===========================================================
+class GenerarDatosTests(TestCase):
+    def setUp(self):
+        # el registro de bodegas principales sobrevive al rollback de
+        # cada test
+        Bodega.limpiar_principales()
+        self.addCleanup(Bodega.limpiar_principales)
+
+    def generar(self, prefijo, semilla=7):
+        call_command(
+            "generar_datos", escala=12, productos=3, firmantes=2,
+            semilla=semilla, prefijo=prefijo, lote=5, stdout=io.StringIO(),
+        )
+
+    def huella(self, prefijo):
+        """Estado generado, sin ids ni códigos de secuencia."""
+        return (
+            list(
+                PlanillaFabricacion.objects.filter(
+                    serie__startswith=f"{prefijo}-"
+                ).order_by("id").values_list(
+                    "estado_aprobacion", "cantidad_estuches"
+                )
+            ),
+            list(
+                StockMateriaPrima.objects.filter(
+                    materia_prima__nombre__startswith=f"{prefijo} "
+                ).order_by("id").values_list("cantidad_disponible", flat=True)
+            ),
+        )
+
+    def test_cantidades_y_consistencia(self):
+        self.generar("A")
+
+        self.assertEqual(
+            MateriaPrima.objects.filter(nombre__startswith="A ").count(), 12
+        )
+        self.assertEqual(ControlCalidad.objects.count(), 36)
+        self.assertEqual(
+            PlanillaEnvaseSecundarioEmpaque.objects.count(), 12
+        )
+        self.assertEqual(Jarabe.objects.count(), 12)
+
+        for planilla in PlanillaFabricacion.objects.all():
+            firmas = [
+                planilla.firma_jefe_seccion_id,
+                planilla.firma_jefe_produccion_id,
+                planilla.firma_quimico_farmaceutico_id,
+            ]
+            self.assertEqual(
+                planilla.estado_aprobacion == "APROBADO", all(firmas)
+            )
+            # las planillas solo usan materiales aprobados
+            self.assertEqual(
+                planilla.materia_prima.estado_aprobacion, "APROBADO"
+            )
+
+        for control in ControlCalidad.objects.all():
+            self.assertEqual(
+                control.aprobado, control.firma_control_calidad_id is not None
+            )
+
+        for materia in MateriaPrima.objects.all():
+            aprobado = materia.controles_calidad.filter(aprobado=True).first()
+            self.assertEqual(
+                materia.control_calidad_vigente_id,
+                aprobado.id if aprobado else None,
+            )
+
+        # el libro de movimientos cuadra con el stock
+        for stock in StockMateriaPrima.objects.all():
+            total = MovimientoStock.objects.filter(
+                bodega=stock.bodega, materia_prima=stock.materia_prima
+            ).aggregate(total=Sum("cantidad"))["total"]
+            self.assertEqual(total, stock.cantidad_disponible)
+
+    def test_misma_semilla_mismos_datos(self):
+        self.generar("A")
+        self.generar("B")
+        self.generar("C", semilla=8)
+        self.assertEqual(self.huella("A"), self.huella("B"))
+        self.assertNotEqual(self.huella("A"), self.huella("C"))
+
+    def test_prefijo_repetido(self):
+        self.generar("A")
+        with self.assertRaises(CommandError):
+            self.generar("A")
+
+
+# ===========================================================
+# MEDICIÓN DE CARGA
+# ===========================================================
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+)
+class MedicionCargaTests(TestCase):
+    def setUp(self):
+        Bodega.limpiar_principales()
+        self.addCleanup(Bodega.limpiar_principales)
+        call_command(
+            "generar_datos", escala=10, productos=2, firmantes=1,
+            aprobadas=0.0, prefijo="A", stdout=io.StringIO(),
+        )
+
+    def test_percentil_y_clasificacion(self):
+        valores = list(range(1, 101))
+        self.assertEqual(percentil(valores, 50), 50)
+        self.assertEqual(percentil(valores, 99), 99)
+        self.assertEqual(percentil([7], 95), 7)
+        self.assertIsNone(percentil([], 50))
+
+        self.assertIsNone(clasificar_error(201, b"{}", ""))
+        self.assertEqual(clasificar_error(400, b"{}", ""), "http_4xx")
+        self.assertEqual(
+            clasificar_error(
+                500, b"", "OperationalError('database is locked')"
+            ),
+            "bloqueo_db",
+        )
+        self.assertEqual(clasificar_error(0, b"", "timeout"), "conexion")
+
+    def test_escenarios_en_proceso(self):
+        medicion = MedicionCarga(
+            prefijo="A", hilos=1, duracion=60, operaciones=4
+        )
+        resultado = medicion.ejecutar(
+            ["listar", "firmar", "stock", "pedido_bodega"]
+        )
+
+        for escenario, datos in resultado["escenarios"].items():
+            total = datos["total"]
+            self.assertEqual(total["operaciones"], 4, escenario)
+            self.assertEqual(total["errores"], {}, escenario)
+            self.assertIsNotNone(total["latencia_ms"]["p99"])
+        self.assertEqual(resultado["metadatos"]["modo"], "en_proceso")
+
+        # las firmas y los pedidos quedaron registrados de verdad
+        self.assertEqual(
+            RegistroFirma.objects.exclude(sesion_firma=None).count(), 4
+        )
+        pedidos = PlanillaFabricacion.objects.filter(serie="A-CARGA")
+        self.assertEqual(pedidos.count(), 4)
+        self.assertEqual(
+            MovimientoStock.objects.filter(
+                tipo="SALIDA",
+                referencia__startswith="PlanillaFabricacion:",
+            ).count(),
+            4,
+        )
+
+    def test_comando_guarda_json(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            salida = os.path.join(directorio, "r.json")
+            call_command(
+                "medir_carga", escenarios=["listar"], hilos=1,
+                operaciones=3, prefijo="A", salida=salida,
+                stdout=io.StringIO(),
+            )
+            with open(salida, encoding="utf-8") as archivo:
+                resultado = json.load(archivo)
+        self.assertEqual(
+            resultado["escenarios"]["listar"]["total"]["operaciones"], 3
+        )
+
+
+# ===========================================================
+# PERFILES DE BASE DE DATOS
+# ===========================================================
+class PerfilesBaseDatosTests(TestCase):
+    base_dir = Path("/srv/gpq")
+
+    def test_sqlite_por_defecto(self):
+        config = basedatos.configurar({}, self.base_dir)["default"]
+        self.assertEqual(config["ENGINE"], "django.db.backends.sqlite3")
+        self.assertEqual(config["NAME"], self.base_dir / "db.sqlite3")
+        self.assertEqual(config["OPTIONS"]["transaction_mode"], "IMMEDIATE")
+        # WAL queda en el archivo (activar_wal), no se aplica al conectar
+        self.assertNotIn("journal_mode", config["OPTIONS"]["init_command"])
+
+    def test_postgresql_persistente_o_con_pool(self):
+        entorno = {"GPQ_DB": "postgresql", "GPQ_DB_HOST": "db"}
+        config = basedatos.configurar(entorno, self.base_dir)["default"]
+        self.assertEqual(config["ENGINE"], "django.db.backends.postgresql")
+        self.assertEqual(config["CONN_MAX_AGE"], 600)
+        self.assertTrue(config["CONN_HEALTH_CHECKS"])
+        self.assertNotIn("pool", config["OPTIONS"])
+
+        entorno["GPQ_DB_POOL"] = "8"
+        config = basedatos.configurar(entorno, self.base_dir)["default"]
+        self.assertEqual(config["CONN_MAX_AGE"], 0)
+        self.assertEqual(config["OPTIONS"]["pool"]["max_size"], 8)
+
+    def test_perfil_desconocido(self):
+        with self.assertRaises(ImproperlyConfigured):
+            basedatos.configurar({"GPQ_DB": "oracle"}, self.base_dir)
+
+    def test_pragmas_en_la_conexion(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("solo perfil sqlite")
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(
+                cursor.fetchone()[0],
+                basedatos.ESPERA_BLOQUEO_SQLITE * 1000,
+            )
+        self.assertEqual(connection.transaction_mode, "IMMEDIATE")
+
+    def test_synchronous_normal_solo_con_wal(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("solo perfil sqlite")
+        with tempfile.TemporaryDirectory() as directorio:
+            sincronizacion = {}
+            for modo in ("delete", "wal"):
+                ruta = os.path.join(directorio, f"{modo}.sqlite3")
+                with closing(sqlite3.connect(ruta)) as archivo:
+                    archivo.execute(f"PRAGMA journal_mode={modo}")
+                base = sqlite_base.DatabaseWrapper(
+                    {**connection.settings_dict, "NAME": ruta}, alias=modo
+                )
+                try:
+                    with base.cursor() as cursor:
+                        cursor.execute("PRAGMA synchronous")
+                        sincronizacion[modo] = cursor.fetchone()[0]
+                finally:
+                    base.close()
+        # sin WAL queda FULL (2): NORMAL (1) ahí no es seguro
+        self.assertEqual(sincronizacion, {"delete": 2, "wal": 1})
+
+    def test_activar_wal_queda_en_el_archivo(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("solo perfil sqlite")
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, "wal.sqlite3")
+            otra_base = sqlite_base.DatabaseWrapper(
+                {**connection.settings_dict, "NAME": ruta}, alias="wal"
+            )
+            try:
+                with mock.patch.object(
+                    activar_wal, "connections", {"wal": otra_base}
+                ):
+                    call_command("activar_wal", database="wal",
+                                 stdout=io.StringIO())
+            finally:
+                otra_base.close()
+            # una conexión nueva, sin ningún PRAGMA, ya lo encuentra en WAL
+            with closing(sqlite3.connect(ruta)) as otra:
+                modo = otra.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(modo, "wal")
+
+
+# ===========================================================
+# ÍNDICES DE LAS CONSULTAS FRECUENTES
+# ===========================================================
+class IndicesConsultasTests(TestCase):
+    """
+    Con EXPLAIN QUERY PLAN de SQLite: cada acceso frecuente se resuelve
+    con su índice y, cuando hay orden, sin ordenar en una tabla temporal.
+    """
+
+    PLANILLAS = [
+        (PlanillaFabricacion, "pf"),
+        (PlanillaEnvasePrimario, "pep"),
+        (PlanillaEnvaseSecundarioEmpaque, "pes"),
+    ]
+
+    MATERIALES = [
+        ("materia_prima", "cc_mp"),
+        ("material_envase_primario", "cc_mep"),
+        ("material_envase_secundario_empaque", "cc_mes"),
+    ]
+
+    def setUp(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("los planes se comprueban sobre SQLite")
+
+    def assertUsaIndice(self, queryset, indice, sin_ordenar=True):
+        plan = queryset.explain()
+        self.assertIn(f"INDEX {indice}", plan)
+        if sin_ordenar:
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_ultimo_control_aprobado_de_cada_material(self):
+        for campo, prefijo in self.MATERIALES:
+            with self.subTest(campo=campo):
+                self.assertUsaIndice(
+                    ControlCalidad.objects.filter(
+                        aprobado=True, **{campo: 1}
+                    ).order_by("-fecha_verificacion", "-id")[:1],
+                    f"{prefijo}_aprobado_idx",
+                )
+                self.assertUsaIndice(
+                    ControlCalidad.objects.filter(
+                        **{campo: 1}
+                    ).order_by("-fecha_verificacion", "-id")[:1],
+                    f"{prefijo}_fecha_idx",
+                )
+                # el prefetch de varios materiales usa el índice para el
+                # IN; el orden entre materiales sí requiere ordenar
+                self.assertUsaIndice(
+                    ControlCalidad.objects.filter(
+                        **{f"{campo}__in": [1, 2, 3]}
+                    ).order_by("-fecha_verificacion", "-id"),
+                    f"{prefijo}_fecha_idx",
+                    sin_ordenar=False,
+                )
+
+    def test_filtros_de_planillas(self):
+        orden = ("-fecha_creacion", "-id")
+        for modelo, prefijo in self.PLANILLAS:
+            with self.subTest(modelo=modelo.__name__):
+                self.assertUsaIndice(
+                    modelo.objects.filter(
+                        estado_aprobacion="APROBADO"
+                    ).order_by(*orden)[:10],
+                    f"{prefijo}_estado_fecha_idx",
+                )
+                self.assertUsaIndice(
+                    modelo.objects.filter(
+                        tipo_movimiento="PEDIDO_BODEGA"
+                    ).order_by(*orden)[:10],
+                    f"{prefijo}_tipo_mov_fecha_idx",
+                )
+                self.assertUsaIndice(
+                    modelo.objects.filter(
+                        fecha_emision__range=(
+                            datetime.date(2025, 1, 1),
+                            datetime.date(2025, 1, 31),
+                        )
+                    ).order_by("fecha_emision", "id"),
+                    f"{prefijo}_fecha_emision_idx",
+                )
+
+    def test_busqueda_por_batch(self):
+        self.assertUsaIndice(
+            MateriaPrima.objects.filter(batch="L-2025-001"), "mp_batch_idx"
+        )
+
+    def test_bandeja_de_firmas(self):
+        fecha = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+        for rol, lista in bandeja.FUENTES_POR_ROL.items():
+            for fuente in lista:
+                prefijo = dict(self.PLANILLAS).get(fuente.modelo, "cc")
+                sufijo = {
+                    "firma_jefe_seccion": "firma_jsec",
+                    "firma_jefe_produccion": "firma_jprod",
+                    "firma_quimico_farmaceutico": "firma_qf",
+                    "firma_control_calidad": "firma_fecha",
+                }[fuente.campo_firma]
+                pendientes = fuente.modelo.objects.filter(
+                    **{f"{fuente.campo_firma}__isnull": True}
+                )
+                desde = fecha
+                if fuente.campo_fecha == "fecha_verificacion":
+                    desde = fecha.date()
+                with self.subTest(rol=rol, tipo=fuente.tipo):
+                    self.assertUsaIndice(
+                        pendientes.order_by(fuente.campo_fecha, "id")[:21],
+                        f"{prefijo}_{sufijo}_idx",
+                    )
+                    # página siguiente: desde el cursor por el mismo índice
+                    self.assertUsaIndice(
+                        pendientes.filter(
+                            bandeja._despues(
+                                fuente, 0,
+                                (desde.isoformat(), 0, 10),
+                            )
+                        ).order_by(fuente.campo_fecha, "id")[:21],
+                        f"{prefijo}_{sufijo}_idx",
+                    )
+
+
+# ===========================================================
+# CONTROL DE CALIDAD VIGENTE DE LOS MATERIALES
+# ===========================================================
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+)
+class ControlCalidadVigenteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(n=1)
+        cls.inspector = cls.datos["firmantes"]["INSPECTOR_CALIDAD"]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.inspector)
+        self.mp = self.datos["materias"][0]
+
+    def vigente(self, material):
+        material.refresh_from_db()
+        return material.control_calidad_vigente_id
+
+    def nuevo_control(self, fecha, **material):
+        return ControlCalidad.objects.create(
+            resultado="OK", fecha_verificacion=fecha,
+            inspector=self.inspector, **material,
+        )
+
+    def test_sembrado_apunta_al_aprobado(self):
+        for material, relacion in [
+            (self.mp, "controles_calidad"),
+            (self.datos["materiales_ep"][0],
+             "controles_calidad_envase_primario"),
+            (self.datos["materiales_es"][0],
+             "controles_calidad_envase_secundario"),
+        ]:
+            self.assertEqual(
+                self.vigente(material), getattr(material, relacion).get().id
+            )
+
+    def test_firmar_actualiza_el_vigente_en_la_misma_transaccion(self):
+        anterior = self.vigente(self.mp)
+        cc = self.nuevo_control(datetime.date(2025, 6, 1), materia_prima=self.mp)
+        # sin aprobar no cambia
+        self.assertEqual(self.vigente(self.mp), anterior)
+
+        response = self.client.post(
+            f"/api/controles-calidad/{cc.id}/firmar/",
+            {"rut": self.inspector.rut, "password": PASSWORD},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.vigente(self.mp), cc.id)
+
+        # un aprobado con fecha anterior no desplaza al más reciente
+        viejo = self.nuevo_control(
+            datetime.date(2024, 1, 1), materia_prima=self.mp
+        )
+        self.client.patch(
+            f"/api/controles-calidad/{viejo.id}/", {"aprobado": True},
+            format="json",
+        )
+        self.assertEqual(self.vigente(self.mp), cc.id)
+
+    def test_desaprobar_mover_o_eliminar_recalcula(self):
+        anterior = self.vigente(self.mp)
+        cc = self.nuevo_control(
+            datetime.date(2025, 6, 1), materia_prima=self.mp
+        )
+        cc.aprobado = True
+        cc.save()
+        self.assertEqual(self.vigente(self.mp), cc.id)
+
+        cc.aprobado = False
+        cc.save()
+        self.assertEqual(self.vigente(self.mp), anterior)
+
+        cc.aprobado = True
+        cc.save()
+        otra = MateriaPrima.objects.create(
+            nombre="Otra", cantidad=1, batch="OTRA-1"
+        )
+        cc = ControlCalidad.objects.get(pk=cc.pk)
+        cc.materia_prima = otra
+        cc.save()
+        self.assertEqual(self.vigente(self.mp), anterior)
+        self.assertEqual(self.vigente(otra), cc.id)
+
+        cc.delete()
+        self.assertIsNone(self.vigente(otra))
+
+    def test_planilla_lee_el_control_por_clave_primaria(self):
+        planilla = {
+            "producto": self.datos["productos"][0].id,
+            "tipo_producto": self.datos["tipo"].id,
+            "serie": "V",
+            "numero_planilla": "1",
+            "fecha_emision": "2025-01-01",
+            "fecha_vencimiento": "2026-01-01",
+            "rendimiento_teorico": "100.00",
+            "periodo_eficacia": 24,
+            "cantidad_estuches": "10.00",
+            "materia_prima": self.mp.id,
+        }
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.post(
+                "/api/planillas-fabricacion-Pedido/", planilla, format="json"
+            )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(
+            response.data["control_calidad"], self.vigente(self.mp)
+        )
+        sql = [c["sql"] for c in consultas.captured_queries]
+        self.assertFalse([
+            q for q in sql
+            if 'FROM "GPQAPI_controlcalidad"' in q and "ORDER BY" in q
+        ])
+
+    def test_sin_control_aprobado(self):
+        otra = MateriaPrima.objects.create(
+            nombre="Otra", cantidad=1, batch="OTRA-1"
+        )
+        response = self.client.post(
+            "/api/planillas-fabricacion-Pedido/",
+            {
+                "producto": self.datos["productos"][0].id,
+                "tipo_producto": self.datos["tipo"].id,
+                "serie": "V", "numero_planilla": "2",
+                "fecha_emision": "2025-01-01",
+                "fecha_vencimiento": "2026-01-01",
+                "rendimiento_teorico": "100.00", "periodo_eficacia": 24,
+                "cantidad_estuches": "10.00", "materia_prima": otra.id,
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("control_calidad", response.data)
+
+
+# ===========================================================
+# EXPORTACIÓN PARA AUDITORÍA
+# ===========================================================
+class ExportacionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(n=3)
+        # una planilla fuera del rango de enero
+        cls.fuera = PlanillaFabricacion.objects.order_by("id").last()
+        PlanillaFabricacion.objects.filter(pk=cls.fuera.pk).update(
+            fecha_emision=datetime.date(2025, 3, 1)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.datos["firmantes"]["JEFE_SECCION"])
+
+    def descargar(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content)
+
+    def leer_csv(self, contenido):
+        return list(csv.DictReader(
+            io.StringIO(contenido.decode("utf-8-sig"))
+        ))
+
+    def test_csv_filtra_por_rango_con_firmantes(self):
+        response, contenido = self.descargar(
+            "/api/planillas-fabricacion-Pedido/exportar/"
+            "?desde=2025-01-01&hasta=2025-01-31"
+        )
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertIn(
+            'filename="planillafabricacion-2025-01-01-2025-01-31.csv"',
+            response["Content-Disposition"],
+        )
+        filas = self.leer_csv(contenido)
+        self.assertEqual(len(filas), 2)
+        self.assertNotIn(str(self.fuera.pk), [f["id"] for f in filas])
+        jefe = self.datos["firmantes"]["JEFE_SECCION"]
+        self.assertEqual(
+            filas[0]["jefe_seccion_nombre"],
+            f"{jefe.first_name} {jefe.last_name}",
+        )
+        self.assertEqual(filas[0]["jefe_seccion_rut"], jefe.rut)
+        self.assertEqual(filas[0]["material_codigo"], "MP-0000")
+
+    def test_planilla_sin_firma_deja_celdas_vacias(self):
+        PlanillaEnvasePrimario.objects.update(firma_jefe_produccion=None)
+        _, contenido = self.descargar(
+            "/api/planillas-envase-primario-Pedido/exportar/"
+        )
+        filas = self.leer_csv(contenido)
+        self.assertEqual(len(filas), 3)
+        self.assertEqual(
+            {f["jefe_produccion_nombre"] for f in filas}, {""}
+        )
+
+    def test_una_consulta_sin_importar_las_filas(self):
+        consultas = []
+        for n in (1, 3):
+            qs = RegistroFirma.objects.order_by("id")[:n]
+            with CaptureQueriesContext(connection) as capturadas:
+                b"".join(exportacion.generar(
+                    "csv", exportacion.COLUMNAS_REGISTRO_FIRMA, qs
+                ))
+            consultas.append(len(capturadas))
+        self.assertEqual(consultas, [1, 1])
+
+    def test_se_entrega_por_bloques(self):
+        qs = PlanillaEnvaseSecundarioEmpaque.objects.order_by("id")
+        trozos = list(exportacion.generar(
+            "csv", exportacion.COLUMNAS_PLANILLA_ENVASE_SECUNDARIO, qs,
+            bloque=1,
+        ))
+        # encabezado y una fila por trozo
+        self.assertEqual(len(trozos), 4)
+        self.assertEqual(len(self.leer_csv(b"".join(trozos))), 3)
+
+        trozos = list(exportacion.generar(
+            "xlsx", exportacion.COLUMNAS_PLANILLA_ENVASE_SECUNDARIO, qs,
+            bloque=1,
+        ))
+        self.assertEqual(len(trozos), 4)
+
+    def test_xlsx_es_un_libro_valido(self):
+        response, contenido = self.descargar(
+            "/api/registro-firmas/exportar/?formato=xlsx"
+        )
+        self.assertEqual(
+            response["Content-Type"], exportacion.FORMATOS["xlsx"]
+        )
+        with zipfile.ZipFile(io.BytesIO(contenido)) as libro:
+            self.assertIsNone(libro.testzip())
+            hoja = libro.read("xl/worksheets/sheet1.xml").decode("utf-8")
+            self.assertIn("xl/workbook.xml", libro.namelist())
+        self.assertEqual(
+            hoja.count("<row>"), RegistroFirma.objects.count() + 1
+        )
+        self.assertIn(self.datos["firmantes"]["JEFE_SECCION"].rut, hoja)
+
+    def test_firmas_por_dia_de_firma(self):
+        ayer = timezone.localdate() - datetime.timedelta(days=1)
+        RegistroFirma.objects.filter(
+            pk=RegistroFirma.objects.order_by("id").first().pk
+        ).update(timestamp_firma=timezone.now() - datetime.timedelta(days=1))
+        _, contenido = self.descargar(
+            f"/api/registro-firmas/exportar/?desde={ayer}&hasta={ayer}"
+        )
+        self.assertEqual(len(self.leer_csv(contenido)), 1)
+
+    def test_parametros_invalidos(self):
+        for consulta in ("formato=pdf", "desde=2025-02-01&hasta=2025-01-01"):
+            with self.subTest(consulta=consulta):
+                response = self.client.get(
+                    f"/api/registro-firmas/exportar/?{consulta}"
+                )
+                self.assertEqual(response.status_code, 400)
+
+
+# ===========================================================
+# IMPORTACIÓN DE MATERIAS PRIMAS
+# ===========================================================
+class ImportacionMateriaPrimaTests(TestCase):
+
+    def setUp(self):
+        # el registro de bodegas principales sobrevive al rollback
+        Bodega.limpiar_principales()
+        self.addCleanup(Bodega.limpiar_principales)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            UsuarioPersonalizado.objects.create_user(
+                username="bodeguero", rut="22222222-2", password=PASSWORD
+            )
+        )
+
+    def csv(self, n, inicio=0):
+        return "nombre,batch,cantidad\n" + "".join(
+            f"Materia {i},LOTE-{i:05d},{10 + i}.50\n"
+            for i in range(inicio, inicio + n)
+        )
+
+    def subir(self, contenido):
+        return self.client.post(
+            "/api/materias-primas/importar/",
+            {"archivo": SimpleUploadedFile(
+                "recepcion.csv", contenido.encode("utf-8-sig"),
+                content_type="text/csv",
+            )},
+            format="multipart",
+        )
+
+    def test_importa_materias_con_stock_y_movimientos(self):
+        response = self.subir(self.csv(3))
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(
+            response.data, {"filas": 3, "importadas": 3, "errores": []}
+        )
+        materia = MateriaPrima.objects.get(batch="LOTE-00002")
+        self.assertEqual(materia.cantidad, Decimal("12.50"))
+        stock = StockMateriaPrima.objects.get(materia_prima=materia)
+        self.assertEqual(stock.bodega, Bodega.principal("MP"))
+        self.assertEqual(stock.cantidad_disponible, Decimal("12.50"))
+        movimiento = MovimientoStock.objects.get(materia_prima=materia)
+        self.assertEqual(movimiento.tipo, "ENTRADA")
+        self.assertEqual(movimiento.referencia, f"MateriaPrima:{materia.id}")
+        self.assertEqual(movimiento.usuario, "bodeguero")
+        self.assertEqual(
+            MovimientoStock.objects.aggregate(s=Sum("cantidad"))["s"],
+            StockMateriaPrima.objects.aggregate(
+                s=Sum("cantidad_disponible")
+            )["s"],
+        )
+
+    def test_consultas_no_crecen_con_las_filas(self):
+        # bodega ya registrada: la primera importación no la busca
+        Bodega.objects.create(nombre="MP", tipo="MP", es_principal=True)
+        Bodega.principal("MP")
+        consultas = []
+        # pocas filas: en SQLite cada INSERT admite ~999 parámetros
+        for n, inicio in ((5, 0), (50, 100)):
+            with CaptureQueriesContext(connection) as capturadas:
+                response = self.subir(self.csv(n, inicio))
+            self.assertEqual(response.status_code, 201)
+            consultas.append(len(capturadas))
+        self.assertEqual(consultas[0], consultas[1])
+
+    def test_con_errores_no_importa_nada(self):
+        MateriaPrima.objects.create(
+            nombre="Previa", cantidad=1, batch="LOTE-EXISTE"
+        )
+        contenido = (
+            "nombre,batch,cantidad\n"
+            "Buena,LOTE-1,10\n"
+            ",LOTE-2,10\n"
+            "Negativa,LOTE-3,-5\n"
+            "Repetida,LOTE-1,10\n"
+            "\n"
+            "Existente,LOTE-EXISTE,abc\n"
+        )
+        response = self.subir(contenido)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["importadas"], 0)
+        errores = {e["fila"]: e["errores"] for e in response.data["errores"]}
+        self.assertEqual(sorted(errores), [2, 3, 4, 5, 7])
+        self.assertIn("nombre", errores[3])
+        self.assertIn("cantidad", errores[4])
+        self.assertIn("batch", errores[5])
+        self.assertEqual(set(errores[7]), {"batch", "cantidad"})
+        self.assertEqual(MateriaPrima.objects.count(), 1)
+        self.assertFalse(StockMateriaPrima.objects.exists())
+
+    def test_columnas_faltantes_o_sin_archivo(self):
+        response = self.subir("nombre,cantidad\nX,1\n")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("columnas", response.data["errores"][0]["errores"])
+        response = self.client.post(
+            "/api/materias-primas/importar/", {}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("archivo", response.data)
+
+    def test_comando(self):
+        with tempfile.TemporaryDirectory() as carpeta:
+            ruta = Path(carpeta) / "recepcion.csv"
+            ruta.write_text(self.csv(4), encoding="utf-8")
+            salida = io.StringIO()
+            call_command("importar_materias_primas", str(ruta), stdout=salida)
+            self.assertIn("4 materias primas importadas", salida.getvalue())
+            self.assertEqual(StockMateriaPrima.objects.count(), 4)
+
+            # la segunda vez todos los batch ya existen
+            with self.assertRaises(CommandError):
+                call_command(
+                    "importar_materias_primas", str(ruta),
+                    stdout=io.StringIO(), stderr=io.StringIO(),
+                )
+        self.assertEqual(MateriaPrima.objects.count(), 4)
+
+
+# ===========================================================
+# FILTROS Y ORDEN
+# ===========================================================
+class FiltrosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(n=3)
+        cls.pf = PlanillaFabricacion.objects.order_by("id")
+        # una planilla sin firma del jefe de sección, de otra fecha
+        cls.pendiente = cls.pf.first()
+        PlanillaFabricacion.objects.filter(pk=cls.pendiente.pk).update(
+            firma_jefe_seccion=None, estado_aprobacion="EN_PROCESO",
+            fecha_emision=datetime.date(2025, 2, 1),
+        )
+        MateriaPrima.objects.filter(
+            pk=cls.datos["materias"][0].pk
+        ).update(estado_aprobacion="PENDIENTE")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.datos["firmantes"]["JEFE_SECCION"])
+
+    def ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [fila["id"] for fila in response.data["results"]]
+
+    def test_revisar_filtros_sin_errores(self):
+        self.assertEqual(revisar_filtros(), [])
+
+    def test_planillas_por_estado_y_firma(self):
+        ruta = "/api/planillas-fabricacion-Pedido/"
+        self.assertEqual(
+            self.ids(f"{ruta}?estado=EN_PROCESO"), [self.pendiente.id]
+        )
+        self.assertEqual(
+            self.ids(f"{ruta}?firmado_jefe_seccion=false"),
+            [self.pendiente.id],
+        )
+        self.assertEqual(
+            len(self.ids(f"{ruta}?firmado_jefe_seccion=true")), 2
+        )
+        self.assertEqual(
+            self.ids(
+                f"{ruta}?fecha_emision_desde=2025-02-01"
+                "&fecha_emision_hasta=2025-02-28"
+            ),
+            [self.pendiente.id],
+        )
+        self.assertEqual(
+            len(self.ids(f"{ruta}?estado=EN_PROCESO,APROBADO")), 3
+        )
+
+    def test_materiales_por_estado(self):
+        self.assertEqual(
+            self.ids("/api/materias-primas/?estado=PENDIENTE"),
+            [self.datos["materias"][0].id],
+        )
+        self.assertEqual(
+            self.ids("/api/materias-primas/?batch=MP-0001"),
+            [self.datos["materias"][1].id],
+        )
+
+    def test_stock_por_bodega_y_orden_estable(self):
+        bodega = self.datos["bodegas"][0]
+        ids = self.ids(f"/api/stock-materias-primas/?bodega={bodega.id}")
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(
+            self.ids(f"/api/stock-materias-primas/?ordering=-id"),
+            sorted(ids, reverse=True),
+        )
+
+    def test_orden_con_cursor(self):
+        ruta = "/api/planillas-fabricacion-Pedido/?page_size=2"
+        response = self.client.get(f"{ruta}&ordering=-fecha_emision")
+        self.assertEqual(
+            response.data["results"][0]["id"], self.pendiente.id
+        )
+        siguiente = self.client.get(response.data["next"])
+        self.assertEqual(len(siguiente.data["results"]), 1)
+
+    def test_parametros_invalidos(self):
+        for url in (
+            "/api/planillas-fabricacion-Pedido/?estado=OTRO",
+            "/api/planillas-fabricacion-Pedido/?producto=abc",
+            "/api/planillas-fabricacion-Pedido/?firmado_jefe_seccion=tal",
+            "/api/planillas-fabricacion-Pedido/?fecha_emision_desde=ayer",
+            "/api/planillas-fabricacion-Pedido/?ordering=serie",
+            "/api/materias-primas/?ordering=nombre",
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_cada_filtro_usa_un_indice(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("los planes se comprueban sobre SQLite")
+        ejemplos = {Exacto: "1", Presente: "false"}
+        for prefijo, viewset, _ in router.registry:
+            modelo = viewset.queryset.model
+            tabla = modelo._meta.db_table
+            paginacion = getattr(viewset, "pagination_class", None)
+            for nombre, filtro in getattr(viewset, "filtros", {}).items():
+                campo = modelo._meta.get_field(filtro.campo)
+                if isinstance(filtro, Rango):
+                    params = {
+                        f"{nombre}_desde": "2025-01-01",
+                        f"{nombre}_hasta": "2025-01-31",
+                    }
+                elif campo.choices:
+                    params = {nombre: campo.choices[0][0]}
+                else:
+                    params = {nombre: ejemplos[type(filtro)]}
+                request = Request(APIRequestFactory().get("/", params))
+                queryset = FiltroIndexado().filter_queryset(
+                    request, viewset.queryset.all(), viewset
+                )
+                if paginacion and issubclass(paginacion, CursorPagination):
+                    queryset = queryset.order_by(*paginacion.ordering)
+                with self.subTest(ruta=prefijo, filtro=nombre):
+                    plan = queryset[:10].explain()
+                    self.assertIsNone(
+                        re.search(rf"SCAN {tabla}\b(?! USING)", plan), plan
+                    )
+
+
+# ===========================================================
+# BÚSQUEDA DE TEXTO COMPLETO
+# ===========================================================
+class BusquedaTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            UsuarioPersonalizado.objects.create_user(
+                username="consulta", rut="33333333-3", password=PASSWORD
+            )
+        )
+        self.citrico = MateriaPrima.objects.create(
+            nombre="Ácido cítrico", cantidad=10, batch="AC-0001"
+        )
+        self.ascorbico = MateriaPrima.objects.create(
+            nombre="Ácido ascórbico", cantidad=10, batch="AA-0002"
+        )
+        self.frasco = MaterialEnvasePrimario.objects.create(
+            codigo="EP-0001", nombre="Frasco ámbar", tipo_envase="Frasco"
+        )
+        self.tapa = MaterialEnvasePrimario.objects.create(
+            codigo="EP-0002", nombre="Tapa", tipo_envase="Tapa",
+            codigo_calidad="FRASCO-TAPA",
+        )
+
+    def encontrados(self, texto, **kwargs):
+        return [(r["tipo"], r["id"]) for r in busqueda.buscar(texto, **kwargs)]
+
+    def test_prefijos_sin_tildes_y_todas_las_palabras(self):
+        self.assertEqual(
+            self.encontrados("acido cit"),
+            [("materia_prima", self.citrico.id)],
+        )
+        self.assertEqual(
+            set(self.encontrados("ÁCIDO")),
+            {("materia_prima", self.citrico.id),
+             ("materia_prima", self.ascorbico.id)},
+        )
+        self.assertEqual(
+            self.encontrados("AC-0001"), [("materia_prima", self.citrico.id)]
+        )
+        self.assertEqual(self.encontrados("inexistente"), [])
+
+    def test_titulo_pesa_mas_que_el_texto(self):
+        self.assertEqual(
+            self.encontrados("frasco"),
+            [("material_envase_primario", self.frasco.id),
+             ("material_envase_primario", self.tapa.id)],
+        )
+
+    def test_guardar_y_eliminar_mantienen_el_indice(self):
+        self.citrico.nombre = "Citrato de sodio"
+        self.citrico.save()
+        self.assertEqual(self.encontrados("acido cit"), [])
+        self.assertEqual(
+            self.encontrados("citrato"), [("materia_prima", self.citrico.id)]
+        )
+        self.citrico.delete()
+        self.assertEqual(self.encontrados("citrato"), [])
+
+    def test_guardar_campos_no_indexados_no_escribe_el_indice(self):
+        self.citrico.estado_aprobacion = "APROBADO"
+        with self.assertNumQueries(1):
+            self.citrico.save(update_fields=["estado_aprobacion"])
+
+    def test_reindexar_corrige_cambios_sin_senales(self):
+        MateriaPrima.objects.filter(pk=self.citrico.pk).update(
+            nombre="Glicerina"
+        )
+        self.assertEqual(self.encontrados("glicerina"), [])
+        call_command("reindexar_busqueda", stdout=io.StringIO())
+        self.assertEqual(
+            self.encontrados("glicerina"), [("materia_prima", self.citrico.id)]
+        )
+        self.assertEqual(self.encontrados("frasco ambar"),
+                         [("material_envase_primario", self.frasco.id)])
+
+    def test_importacion_indexa_las_materias(self):
+        Bodega.limpiar_principales()
+        self.addCleanup(Bodega.limpiar_principales)
+        reporte = importar_materias_primas(
+            ["nombre,batch,cantidad", "Sorbitol,SB-0001,5"]
+        )
+        self.assertEqual(reporte["importadas"], 1)
+        materia = MateriaPrima.objects.get(batch="SB-0001")
+        self.assertEqual(
+            self.encontrados("sorbi"), [("materia_prima", materia.id)]
+        )
+
+    def test_endpoint_una_consulta_con_url_y_filtro_de_tipo(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                "/api/buscar/", {"q": "frasco", "tipo": "materia_prima"}
+            )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["resultados"], [])
+
+        response = self.client.get(
+            "/api/buscar/", {"q": "acido cit", "limite": 5}
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        (resultado,) = response.data["resultados"]
+        self.assertEqual(resultado["titulo"], "Ácido cítrico")
+        self.assertTrue(resultado["url"].endswith(
+            f"/api/materias-primas/{self.citrico.id}/"
+        ))
+        detalle = self.client.get(resultado["url"])
+        self.assertEqual(detalle.status_code, 200)
+
+    def test_endpoint_valida_parametros(self):
+        for params in (
+            {}, {"q": "--"}, {"q": "acido", "tipo": "jarabe"},
+            {"q": "acido", "limite": 0},
+        ):
+            with self.subTest(params=params):
+                response = self.client.get("/api/buscar/", params)
+                self.assertEqual(response.status_code, 400)
+
+
+# ===========================================================
+# TRAZABILIDAD DE LOTES
+# ===========================================================
+class TrazabilidadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(n=3)
+        cls.materia = cls.datos["materias"][0]
+        jarabe = cls.datos["jarabes"][0]
+        cls.pf = jarabe.planilla_fabricacion
+        PlanillaFabricacion.objects.filter(pk=cls.pf.pk).update(
+            batch_standart="BS-0000"
+        )
+        # sin jarabe que la enlace: entra por producto y lote
+        cls.pes = PlanillaEnvaseSecundarioEmpaque.objects.order_by("id")[0]
+        PlanillaEnvaseSecundarioEmpaque.objects.filter(
+            pk=cls.pes.pk
+        ).update(batch_standart=jarabe.lote)
+        # mismo lote, otro producto: no está afectada
+        PlanillaEnvaseSecundarioEmpaque.objects.filter(
+            pk=PlanillaEnvaseSecundarioEmpaque.objects.order_by("id")[1].pk
+        ).update(batch_standart=jarabe.lote)
+        cls.pep = jarabe.planilla_envase_primario
+        cls.pe = jarabe.planilla_envase
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.datos["firmantes"]["JEFE_SECCION"])
+
+    def test_arbol_del_lote(self):
+        response = self.client.get(
+            f"/api/materias-primas/{self.materia.id}/trazabilidad/"
+        )
+        self.assertEqual(response.status_code, 200)
+        arbol = response.data
+        self.assertEqual(arbol["batch"], self.materia.batch)
+        self.assertEqual(arbol["totales"], {
+            "materias_primas": 1,
+            "planillas_fabricacion": 1,
+            "jarabes": 1,
+            "planillas_envase": 1,
+            "planillas_envase_primario": 1,
+            "planillas_envase_secundario_empaque": 1,
+        })
+        (materia,) = arbol["materias_primas"]
+        (planilla,) = materia["planillas_fabricacion"]
+        self.assertEqual(planilla["id"], self.pf.id)
+        self.assertEqual(planilla["batch_standart"], "BS-0000")
+        self.assertEqual(planilla["producto"]["id"], self.pf.producto_id)
+        (jarabe,) = planilla["jarabes"]
+        self.assertEqual(jarabe["planilla_envase"]["id"], self.pe.id)
+        self.assertEqual(jarabe["planilla_envase_primario"]["id"], self.pep.id)
+        self.assertEqual(
+            [p["id"] for p in planilla["planillas_envase_primario"]],
+            [self.pep.id],
+        )
+        self.assertEqual(
+            [p["id"] for p in planilla["planillas_envase_secundario_empaque"]],
+            [self.pes.id],
+        )
+
+    def test_lote_por_batch_standart_y_batch_repetido(self):
+        # otra recepción con el mismo batch y una planilla del mismo lote
+        otra = MateriaPrima.objects.create(
+            nombre="Materia 0 bis", cantidad=10, batch=self.materia.batch
+        )
+        pep = PlanillaEnvasePrimario.objects.order_by("id")[2]
+        PlanillaEnvasePrimario.objects.filter(pk=pep.pk).update(
+            batch_standart="BS-0000", producto=self.pf.producto
+        )
+        arbol = trazar_lote(self.materia.batch)
+        self.assertEqual(
+            [m["id"] for m in arbol["materias_primas"]],
+            [self.materia.id, otra.id],
+        )
+        self.assertEqual(arbol["materias_primas"][1]["planillas_fabricacion"], [])
+        planilla = arbol["materias_primas"][0]["planillas_fabricacion"][0]
+        self.assertEqual(
+            [p["id"] for p in planilla["planillas_envase_primario"]],
+            sorted([self.pep.id, pep.id]),
+        )
+        self.assertEqual(arbol["totales"]["planillas_envase_primario"], 2)
+
+    def test_consultas_fijas(self):
+        with self.assertNumQueries(5):
+            trazar_lote(self.materia.batch)
+        with self.assertNumQueries(1):
+            self.assertIsNone(trazar_lote("NO-EXISTE"))
+        response = self.client.get("/api/materias-primas/0/trazabilidad/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_planillas_de_envase_por_indice(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("los planes se comprueban sobre SQLite")
+        for modelo, indice in (
+            (PlanillaEnvasePrimario, "pep_batch_producto_idx"),
+            (PlanillaEnvaseSecundarioEmpaque, "pes_batch_producto_idx"),
+        ):
+            with self.subTest(modelo=modelo.__name__):
+                plan = modelo.objects.filter(
+                    batch_standart__in=["L-0000", "L-0001"],
+                    producto_id__in=[1, 2],
+                ).order_by("id").explain()
+                self.assertIn(indice, plan)
+
+
+# ===========================================================
+# DOSSIER DE JARABE
+# ===========================================================
+class DossierJarabeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(n=2)
+        cls.jarabe = cls.datos["jarabes"][0]
+
+    def setUp(self):
+        # las claves usan ids que se repiten entre pruebas
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.client.force_authenticate(self.datos["firmantes"]["JEFE_SECCION"])
+        self.url = f"/api/jarabes/{self.jarabe.id}/dossier/"
+
+    def version(self):
+        return Jarabe.objects.get(pk=self.jarabe.pk).version_dossier
+
+    def test_contenido(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        dossier = response.data
+        self.assertEqual(dossier["jarabe"]["lote"], self.jarabe.lote)
+        self.assertEqual(dossier["producto"]["id"], self.jarabe.producto_id)
+        planillas = dossier["planillas"]
+        self.assertEqual(
+            planillas["fabricacion"]["id"], self.jarabe.planilla_fabricacion_id
+        )
+        self.assertEqual(planillas["envase"]["id"], self.jarabe.planilla_envase_id)
+        self.assertEqual(
+            planillas["envase_primario"]["id"],
+            self.jarabe.planilla_envase_primario_id,
+        )
+        self.assertEqual(
+            dossier["materiales"]["materia_prima"]["id"],
+            self.datos["materias"][0].id,
+        )
+        self.assertEqual(
+            dossier["materiales"]["material_envase_primario"]["id"],
+            self.datos["materiales_ep"][0].id,
+        )
+        self.assertEqual(
+            {c["id"] for c in dossier["controles_calidad"]},
+            {
+                self.jarabe.planilla_fabricacion.control_calidad_id,
+                self.jarabe.planilla_envase_primario.control_calidad_id,
+            },
+        )
+        # 3 roles x 2 planillas + el inspector en los dos controles y la MP
+        firmas = dossier["firmas"]
+        self.assertEqual(len(firmas), 8)
+        self.assertEqual(
+            {f["usuario_rol"] for f in firmas},
+            {"JEFE_SECCION", "JEFE_PRODUCCION", "QUIMICO_FARMACEUTICO",
+             "INSPECTOR_CALIDAD"},
+        )
+        self.assertTrue(all(f["usuario_rut"] for f in firmas))
+
+    def test_consultas_fijas_y_cache(self):
+        # el control vigente de cada material es el de su planilla
+        with self.assertNumQueries(2):
+            armar(self.jarabe.pk)
+        otro = ControlCalidad.objects.create(
+            resultado="OK", fecha_verificacion=datetime.date(2025, 6, 1),
+            inspector=self.datos["firmantes"]["INSPECTOR_CALIDAD"],
+            materia_prima=self.datos["materias"][0], aprobado=True,
+        )
+        with self.assertNumQueries(3):
+            dossier = armar(self.jarabe.pk)
+        self.assertIn(otro.id, [c["id"] for c in dossier["controles_calidad"]])
+
+        with self.assertNumQueries(4):
+            primera = self.client.get(self.url)
+        # en caché: solo la lectura del jarabe con su versión
+        with self.assertNumQueries(1):
+            segunda = self.client.get(self.url)
+        self.assertEqual(primera.data, segunda.data)
+
+    def test_cambios_de_miembros_invalidan(self):
+        pf = self.jarabe.planilla_fabricacion
+        cambios = [
+            lambda: PlanillaFabricacion.objects.get(pk=pf.pk).save(),
+            lambda: self.datos["materias"][0].save(),
+            lambda: ControlCalidad.objects.get(
+                pk=pf.control_calidad_id
+            ).save(),
+            lambda: RegistroFirma.objects.create(
+                usuario=self.datos["firmantes"]["JEFE_SECCION"],
+                planilla_envase_primario=self.jarabe.planilla_envase_primario,
+                firma_hash="x",
+            ),
+            lambda: Jarabe.objects.get(pk=self.jarabe.pk).save(),
+        ]
+        for i, cambio in enumerate(cambios):
+            antes = self.version()
+            with self.captureOnCommitCallbacks(execute=True):
+                cambio()
+            self.assertGreater(self.version(), antes, f"cambio {i}")
+
+        # otro jarabe no se invalida
+        otro = self.datos["jarabes"][1]
+        antes = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            otro.planilla_fabricacion.save()
+        self.assertEqual(self.version(), antes)
+
+    def test_dossier_nuevo_tras_firmar(self):
+        self.client.get(self.url)
+        pf = self.jarabe.planilla_fabricacion
+        PlanillaFabricacion.objects.filter(pk=pf.pk).update(
+            firma_jefe_seccion=None, estado_aprobacion="EN_PROCESO"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            RegistroFirma.firmar_planillas(
+                self.datos["firmantes"]["JEFE_SECCION"],
+                [("planilla_fabricacion", pf.pk)],
+            )
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response.data["planillas"]["fabricacion"]["estado_aprobacion"],
+            "APROBADO",
+        )
+
+    def test_savepoint_deshecho_no_invalida(self):
+        antes = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.jarabe.planilla_envase.save()
+                try:
+                    with transaction.atomic():
+                        self.datos["materias"][0].save()
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+        # solo la invalidación que sobrevivió al commit
+        self.assertEqual(self.version(), antes + 1)
+
+    def test_producto_y_firmantes_invalidan(self):
+        firmante = self.datos["firmantes"]["JEFE_PRODUCCION"]
+        inspector = self.datos["firmantes"]["INSPECTOR_CALIDAD"]
+        cambios = [
+            lambda: Producto.objects.get(pk=self.jarabe.producto_id).save(),
+            lambda: UsuarioPersonalizado.objects.get(pk=firmante.pk).save(
+                update_fields=["first_name"]
+            ),
+            lambda: PerfilUsuario.objects.get(usuario=firmante).save(),
+            # firma los controles y la materia prima, e inspecciona
+            lambda: UsuarioPersonalizado.objects.get(pk=inspector.pk).save(),
+        ]
+        for i, cambio in enumerate(cambios):
+            antes = self.version()
+            with self.captureOnCommitCallbacks(execute=True):
+                cambio()
+            self.assertEqual(self.version(), antes + 1, f"cambio {i}")
+
+        # el login no cambia nada de lo que muestra el dossier
+        antes = self.version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            firmante.save(update_fields=["last_login"])
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.version(), antes)
+
+    def test_nombre_del_firmante_se_actualiza(self):
+        firmante = self.datos["firmantes"]["JEFE_PRODUCCION"]
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            usuario = UsuarioPersonalizado.objects.get(pk=firmante.pk)
+            usuario.first_name = "Renombrado"
+            usuario.save()
+        firmas = self.client.get(self.url).data["firmas"]
+        self.assertIn(
+            usuario.get_full_name(),
+            [f["usuario_nombre"] for f in firmas],
+        )
+
+
+class TableroTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(n=2)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.client.force_authenticate(self.datos["firmantes"]["JEFE_SECCION"])
+
+    def resumen_sin_cache(self, grupo):
+        return tablero.GRUPOS[grupo]()
+
+    def test_contenido(self):
+        response = self.client.get("/api/tablero/")
+        self.assertEqual(response.status_code, 200)
+        resumen = response.data
+
+        for tipo, modelo in tablero.PLANILLAS.items():
+            for estado, _ in modelo.ESTADOS_APROBACION:
+                self.assertEqual(
+                    resumen["planillas"][tipo][estado],
+                    modelo.objects.filter(estado_aprobacion=estado).count(),
+                    f"{tipo} {estado}",
+                )
+            self.assertEqual(
+                resumen["planillas"][tipo]["total"], modelo.objects.count()
+            )
+        for tipo, modelo in tablero.MATERIALES.items():
+            self.assertEqual(
+                resumen["materiales"][tipo]["APROBADO"],
+                modelo.objects.filter(estado_aprobacion="APROBADO").count(),
+            )
+            self.assertEqual(
+                resumen["materiales"][tipo]["total"], modelo.objects.count()
+            )
+        self.assertEqual(resumen["controles_calidad"], {
+            "aprobados": ControlCalidad.objects.filter(aprobado=True).count(),
+            "no_aprobados": ControlCalidad.objects.filter(
+                aprobado=False
+            ).count(),
+            "total": ControlCalidad.objects.count(),
+        })
+
+        bodega_mp = self.datos["bodegas"][0]
+        fila = next(b for b in resumen["stock"] if b["id"] == bodega_mp.id)
+        self.assertEqual(fila["nombre"], bodega_mp.nombre)
+        stocks = StockMateriaPrima.objects.filter(bodega=bodega_mp)
+        self.assertEqual(fila["materia_prima"], {
+            "registros": stocks.count(),
+            "cantidad": str(sum(s.cantidad_disponible for s in stocks)),
+        })
+        self.assertEqual(
+            fila["material_envase_primario"],
+            {"registros": 0, "cantidad": "0.00"},
+        )
+
+    def test_una_consulta_por_grupo_y_cache(self):
+        # más la lectura de las versiones
+        with self.assertNumQueries(len(tablero.GRUPOS) + 1):
+            primera = self.client.get("/api/tablero/")
+        with self.assertNumQueries(1):
+            segunda = self.client.get("/api/tablero/")
+        self.assertEqual(primera.data, segunda.data)
+
+    def test_cambio_en_otro_worker_invalida(self):
+        antes = tablero.resumen()["stock"]
+        # otro worker: cambia el saldo y sube la versión, sin tocar esta
+        # caché
+        StockMateriaPrima.objects.filter(
+            bodega=self.datos["bodegas"][0]
+        ).update(cantidad_disponible=0)
+        VersionTablero.subir(["stock"])
+        with self.assertNumQueries(2):
+            despues = tablero.resumen()["stock"]
+        self.assertNotEqual(despues, antes)
+        self.assertEqual(despues, self.resumen_sin_cache("stock"))
+
+    def test_cambios_invalidan_solo_su_grupo(self):
+        bodega = self.datos["bodegas"][0]
+        materia = self.datos["materias"][0]
+        cambios = [
+            ("controles_calidad", lambda: ControlCalidad.objects.create(
+                resultado="Fuera de rango",
+                fecha_verificacion=datetime.date(2025, 6, 1),
+                inspector=self.datos["firmantes"]["INSPECTOR_CALIDAD"],
+                materia_prima=materia,
+            )),
+            ("stock", lambda: MovimientoStock.registrar(
+                bodega, materia, -300, "SALIDA"
+            )),
+            ("materiales", lambda: MateriaPrima.objects.create(
+                nombre="Sacarosa", batch="SAC-9", cantidad=10,
+            )),
+        ]
+        tablero.resumen()
+        for grupo, cambio in cambios:
+            with self.captureOnCommitCallbacks(execute=True):
+                cambio()
+            # las versiones y el grupo que cambió
+            with self.assertNumQueries(2):
+                resumen = tablero.resumen()
+            self.assertEqual(
+                resumen[grupo], self.resumen_sin_cache(grupo), grupo
+            )
+
+        # un cambio que no toca los campos resumidos no invalida
+        materia.nombre = "Glucosa"
+        with self.captureOnCommitCallbacks(execute=True):
+            materia.save(update_fields=["nombre"])
+        with self.assertNumQueries(1):
+            tablero.resumen()
+
+    def test_firmar_planillas_invalida(self):
+        pf = self.datos["jarabes"][0].planilla_fabricacion
+        PlanillaFabricacion.objects.filter(pk=pf.pk).update(
+            firma_jefe_seccion=None, estado_aprobacion="EN_PROCESO"
+        )
+        antes = tablero.resumen()["planillas"]["fabricacion"]
+        with self.captureOnCommitCallbacks(execute=True):
+            RegistroFirma.firmar_planillas(
+                self.datos["firmantes"]["JEFE_SECCION"],
+                [("planilla_fabricacion", pf.pk)],
+            )
+        despues = tablero.resumen()["planillas"]["fabricacion"]
+        self.assertEqual(despues["APROBADO"], antes["APROBADO"] + 1)
+        self.assertEqual(despues["EN_PROCESO"], antes["EN_PROCESO"] - 1)
+
+
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+)
+class BandejaFirmasTests(TestCase):
+
+    URL = "/api/firmas-masivas/pendientes/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_datos(n=2)
+        cls.firmantes = cls.datos["firmantes"]
+        # tres planillas sin firmas de cada tipo
+        for modelo in (
+            PlanillaFabricacion, PlanillaEnvasePrimario,
+            PlanillaEnvaseSecundarioEmpaque,
+        ):
+            for _ in range(3):
+                planilla = modelo.objects.order_by("id").first()
+                planilla.pk = planilla.id = None
+                planilla.firma_jefe_seccion = None
+                planilla.firma_jefe_produccion = None
+                planilla.firma_quimico_farmaceutico = None
+                planilla.estado_aprobacion = "EN_PROCESO"
+                planilla.save()
+        cls.control = ControlCalidad.objects.create(
+            resultado="OK", fecha_verificacion=datetime.date(2025, 3, 1),
+            inspector=cls.firmantes["INSPECTOR_CALIDAD"],
+            materia_prima=cls.datos["materias"][0],
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def bandeja(self, rol, **params):
+        # usuario recién leído: el perfil no viene en caché
+        usuario = UsuarioPersonalizado.objects.get(pk=self.firmantes[rol].pk)
+        self.client.force_authenticate(usuario)
+        response = self.client.get(self.URL, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def esperadas(self, rol):
+        filas = []
+        for orden, fuente in enumerate(bandeja.fuentes(rol)):
+            for pk, fecha in fuente.modelo.objects.filter(
+                **{f"{fuente.campo_firma}__isnull": True}
+            ).values_list("id", fuente.campo_fecha):
+                filas.append(((fecha, orden, pk), (fuente.tipo, pk)))
+        return [fila for _, fila in sorted(filas)]
+
+    def test_pendientes_del_rol(self):
+        datos = self.bandeja("JEFE_SECCION", limite=200)
+        self.assertEqual(datos["conteos"], {
+            "planilla_fabricacion": 3,
+            "planilla_envase_primario": 3,
+            "planilla_envase_secundario_empaque": 3,
+        })
+        self.assertEqual(datos["total"], 9)
+        self.assertIsNone(datos["siguiente"])
+        self.assertEqual(
+            [(f["tipo"], f["id"]) for f in datos["resultados"]],
+            self.esperadas("JEFE_SECCION"),
+        )
+        primera = datos["resultados"][0]
+        self.assertTrue(primera["url"].endswith(f"/{primera['id']}/"))
+        self.assertTrue(primera["titulo"])
+
+        # lo que firma un rol sale de su bandeja y no de la de los demás
+        RegistroFirma.firmar_planillas(
+            self.firmantes["JEFE_SECCION"], [(primera["tipo"], primera["id"])]
+        )
+        objetivo = (primera["tipo"], primera["id"])
+        jefe = self.bandeja("JEFE_SECCION", limite=200)
+        self.assertEqual(jefe["total"], 8)
+        self.assertNotIn(
+            objetivo, [(f["tipo"], f["id"]) for f in jefe["resultados"]]
+        )
+        produccion = self.bandeja("JEFE_PRODUCCION", limite=200)
+        self.assertIn(
+            objetivo,
+            [(f["tipo"], f["id"]) for f in produccion["resultados"]],
+        )
+
+    def test_inspector_ve_controles_sin_firma(self):
+        datos = self.bandeja("INSPECTOR_CALIDAD")
+        self.assertEqual(datos["conteos"], {"control_calidad": 1})
+        self.assertEqual(
+            [(f["tipo"], f["id"]) for f in datos["resultados"]],
+            [("control_calidad", self.control.id)],
+        )
+
+    def test_paginacion_por_cursor_y_consultas(self):
+        self.client.force_authenticate(UsuarioPersonalizado.objects.get(
+            pk=self.firmantes["QUIMICO_FARMACEUTICO"].pk
+        ))
+        # perfil, una página por tabla y los conteos
+        with self.assertNumQueries(5):
+            datos = self.client.get(self.URL, {"limite": 4}).data
+        vistas = [(f["tipo"], f["id"]) for f in datos["resultados"]]
+        while datos["siguiente"]:
+            self.assertEqual(len(datos["resultados"]), 4)
+            cursor = parse_qs(urlsplit(datos["siguiente"]).query)["cursor"][0]
+            datos = self.bandeja(
+                "QUIMICO_FARMACEUTICO", limite=4, cursor=cursor
+            )
+            vistas += [(f["tipo"], f["id"]) for f in datos["resultados"]]
+        self.assertEqual(vistas, self.esperadas("QUIMICO_FARMACEUTICO"))
+
+    def test_sin_rol_y_cursor_invalido(self):
+        sin_perfil = UsuarioPersonalizado.objects.create_user(
+            username="sin-perfil", rut="44444444-4", password=PASSWORD
+        )
+        self.client.force_authenticate(sin_perfil)
+        response = self.client.get(self.URL)
+        self.assertEqual(response.data["conteos"], {})
+        self.assertEqual(response.data["resultados"], [])
+
+        self.client.force_authenticate(self.firmantes["JEFE_SECCION"])
+        response = self.client.get(self.URL, {"cursor": "no-es-un-cursor"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("cursor", response.data)
@@ -0,0 +1,171 @@
+"""
+Trazabilidad hacia adelante de un lote de materia prima (retiro de lote).
+
+Para un batch de materia prima se arma el árbol completo de lo afectado:
+
+    materias primas con ese batch
+    └── planillas de fabricación que las consumieron
+        ├── jarabes de cada planilla (con su planilla de envase y de
+        │   envase primario enlazadas)
+        ├── planillas de envase enlazadas por esos jarabes
+        ├── planillas de envase primario del mismo producto y lote
+        └── planillas de envase secundario del mismo producto y lote
+
+El lote de una planilla de fabricación es su batch_standart y el de sus
+jarabes; las planillas de envase primario y secundario cuyo
+(producto, batch_standart) coincide con alguno de esos lotes son parte
+del árbol, igual que las que un jarabe enlaza directamente.
+
+Son cinco consultas fijas con values() (sin instanciar modelos), sea
+cual sea el tamaño del árbol: materias, planillas de fabricación (por
+mp_batch_idx y el índice de la FK), jarabes con sus planillas enlazadas
+(LEFT JOIN) y las planillas de envase primario y secundario por
+(batch_standart, producto), con los lotes en bloques de LOTE_CONSULTA.
+"""
+from .models import (
+    Jarabe,
+    MateriaPrima,
+    PlanillaEnvasePrimario,
+    PlanillaEnvaseSecundarioEmpaque,
+    PlanillaFabricacion,
+)
+
+# lotes por consulta (SQLite admite ~999 parámetros)
+LOTE_CONSULTA = 500
+
+CAMPOS_MATERIA = ("id", "nombre", "batch", "estado_aprobacion")
+CAMPOS_PLANILLA = (
+    "id", "serie", "numero_planilla", "batch_standart", "fecha_emision",
+    "estado_aprobacion",
+)
+CAMPOS_PLANILLA_ENVASE = ("id", "fecha_emision", "estado_aprobacion")
+CAMPOS_JARABE = ("id", "lote", "fecha_inicio", "fecha_fin")
+
+
+def _relacionada(fila, prefijo, campos):
+    """Extrae de una fila de values() la relación con ese prefijo."""
+    datos = {c: fila.pop(f"{prefijo}__{c}") for c in campos}
+    return datos if datos["id"] is not None else None
+
+
+def _planillas_envase(modelo, pares):
+    """Planillas cuyo (producto_id, batch_standart) está en `pares`."""
+    lotes = sorted({lote for _, lote in pares})
+    productos = {producto for producto, _ in pares}
+    filas = []
+    for inicio in range(0, len(lotes), LOTE_CONSULTA):
+        filas.extend(
+            fila for fila in modelo.objects.filter(
+                batch_standart__in=lotes[inicio:inicio + LOTE_CONSULTA],
+                producto_id__in=productos,
+            ).order_by("id").values(*CAMPOS_PLANILLA, "producto_id")
+            if (fila["producto_id"], fila["batch_standart"]) in pares
+        )
+    return filas
+
+
+def trazar_lote(batch):
+    """
+    Árbol de todo lo que consumió el batch de materia prima, o None si
+    no hay materias primas con ese batch. Ver el docstring del módulo.
+    """
+    materias = list(
+        MateriaPrima.objects.filter(batch=batch)
+        .order_by("id").values(*CAMPOS_MATERIA)
+    )
+    if not materias:
+        return None
+
+    planillas = list(
+        PlanillaFabricacion.objects.filter(materia_prima__batch=batch)
+        .order_by("id")
+        .values(
+            *CAMPOS_PLANILLA, "materia_prima_id", "producto_id",
+            "producto__nombre",
+        )
+    )
+    jarabes = list(
+        Jarabe.objects.filter(
+            planilla_fabricacion__materia_prima__batch=batch
+        ).order_by("id").values(
+            *CAMPOS_JARABE, "producto_id", "planilla_fabricacion_id",
+            *(f"planilla_envase__{c}" for c in CAMPOS_PLANILLA_ENVASE),
+            *(f"planilla_envase_primario__{c}" for c in CAMPOS_PLANILLA),
+        )
+    )
+
+    # (producto, lote) de cada planilla de fabricación y de sus jarabes
+    pares_por_planilla = {
+        p["id"]: {(p["producto_id"], p["batch_standart"])} for p in planillas
+    }
+    jarabes_por_planilla = {}
+    for jarabe in jarabes:
+        planilla_id = jarabe.pop("planilla_fabricacion_id")
+        pares_por_planilla[planilla_id].add(
+            (jarabe.pop("producto_id"), jarabe["lote"])
+        )
+        jarabe["planilla_envase"] = _relacionada(
+            jarabe, "planilla_envase", CAMPOS_PLANILLA_ENVASE
+        )
+        jarabe["planilla_envase_primario"] = _relacionada(
+            jarabe, "planilla_envase_primario", CAMPOS_PLANILLA
+        )
+        jarabes_por_planilla.setdefault(planilla_id, []).append(jarabe)
+
+    pares = {
+        par for grupo in pares_por_planilla.values() for par in grupo
+        if par[1]
+    }
+    # planillas de envase primario y secundario por (producto, lote)
+    envases_por_par = {}
+    for clave, modelo in (
+        ("planillas_envase_primario", PlanillaEnvasePrimario),
+        ("planillas_envase_secundario_empaque",
+         PlanillaEnvaseSecundarioEmpaque),
+    ):
+        for fila in _planillas_envase(modelo, pares):
+            par = (fila.pop("producto_id"), fila["batch_standart"])
+            envases_por_par.setdefault(par, []).append((clave, fila))
+
+    afectadas = {
+        "planillas_envase": set(),
+        "planillas_envase_primario": set(),
+        "planillas_envase_secundario_empaque": set(),
+    }
+    planillas_por_materia = {}
+    for planilla in planillas:
+        materia_id = planilla.pop("materia_prima_id")
+        planilla["producto"] = {
+            "id": planilla.pop("producto_id"),
+            "nombre": planilla.pop("producto__nombre"),
+        }
+        planilla["jarabes"] = jarabes_por_planilla.get(planilla["id"], [])
+
+        # enlazadas por los jarabes más las del mismo producto y lote
+        por_id = {clave: {} for clave in afectadas}
+        for jarabe in planilla["jarabes"]:
+            for clave, campo in (
+                ("planillas_envase", "planilla_envase"),
+                ("planillas_envase_primario", "planilla_envase_primario"),
+            ):
+                if jarabe[campo]:
+                    por_id[clave][jarabe[campo]["id"]] = jarabe[campo]
+        for par in pares_por_planilla[planilla["id"]]:
+            for clave, fila in envases_por_par.get(par, ()):
+                por_id[clave][fila["id"]] = fila
+        for clave, filas in por_id.items():
+            planilla[clave] = [filas[i] for i in sorted(filas)]
+            afectadas[clave].update(filas)
+        planillas_por_materia.setdefault(materia_id, []).append(planilla)
+
+    for materia in materias:
+        materia["planillas_fabricacion"] = planillas_por_materia.get(
+            materia["id"], []
+        )
+    totales = {
+        "materias_primas": len(materias),
+        "planillas_fabricacion": len(planillas),
+        "jarabes": len(jarabes),
+        **{clave: len(ids) for clave, ids in afectadas.items()},
+    }
+    return {"batch": batch, "totales": totales, "materias_primas": materias}
@@ -5,6 +5,8 @@ from .views import (
     UsuarioPersonalizadoViewSet,
     PerfilUsuarioViewSet,
     RegistroFirmaViewSet,
+    SesionFirmaViewSet,
+    FirmaMasivaViewSet,
     ProductoViewSet,
     TipoProductoViewSet,
     MateriaPrimaViewSet,
@@ -19,7 +21,11 @@ from .views import (
     StockMateriaPrimaViewSet,
     StockMaterialEnvasePrimarioViewSet,
     StockMaterialEnvaseSecundarioEmpaqueViewSet,
-    PlanillaEnvaseSecundarioEmpaqueViewSet
+    MovimientoStockViewSet,
+    PlanillaEnvaseSecundarioEmpaqueViewSet,
+    buscar,
+    metricas,
+    tablero_resumen,
 )
 
 router = DefaultRouter()
@@ -27,6 +33,10 @@ router = DefaultRouter()
 router.register(r'usuarios', UsuarioPersonalizadoViewSet)
 router.register(r'perfiles', PerfilUsuarioViewSet)
 router.register(r'registro-firmas', RegistroFirmaViewSet)
+router.register(r'sesiones-firma', SesionFirmaViewSet)
+router.register(
+    r'firmas-masivas', FirmaMasivaViewSet, basename='firma-masiva'
+)
 router.register(r'productos', ProductoViewSet)
 router.register(r'tipos-producto', TipoProductoViewSet)
 router.register(r'materias-primas', MateriaPrimaViewSet)
@@ -53,9 +63,13 @@ router.register(
     r'stock-materiales-envase-secundario',
     StockMaterialEnvaseSecundarioEmpaqueViewSet
 )
+router.register(r'movimientos-stock', MovimientoStockViewSet)
 router.register(r'planilla-envase-Secundario-empaque',
                 PlanillaEnvaseSecundarioEmpaqueViewSet)
 
 urlpatterns = [
+    path('api/metrics/', metricas, name='metricas'),
+    path('api/buscar/', buscar, name='buscar'),
+    path('api/tablero/', tablero_resumen, name='tablero'),
     path('api/', include(router.urls)),
 ]
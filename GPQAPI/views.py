@@ -1,7 +1,17 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.utils.urls import replace_query_param
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import ProtectedError
+from django.http import HttpResponse, StreamingHttpResponse
+import codecs
 import hashlib
 import datetime
 from decimal import Decimal  # <-- IMPORTANTE
@@ -10,6 +20,7 @@ from .models import (
     UsuarioPersonalizado,
     PerfilUsuario,
     RegistroFirma,
+    SesionFirma,
     Producto,
     TipoProducto,
     MateriaPrima,
@@ -25,8 +36,19 @@ from .models import (
     StockMateriaPrima,
     StockMaterialEnvasePrimario,
     StockMaterialEnvaseSecundarioEmpaque,
+    MovimientoStock,
 )
 
+from . import bandeja, busqueda, dossier, exportacion, tablero
+from .filtros import Exacto, Presente, Rango, filtrar_rango
+from .importacion import importar_materias_primas
+from .metricas import almacen
+from .pagination import (
+    CursorFechaCreacionPagination,
+    CursorTimestampFirmaPagination,
+)
+from .trazabilidad import trazar_lote
+
 from .serializers import (
     UsuarioPersonalizadoSerializer,
     PerfilUsuarioSerializer,
@@ -43,10 +65,17 @@ from .serializers import (
     PlanillaEnvaseSecundarioEmpaqueSerializer,
     JarabeSerializer,
     FirmaSerializer,
+    FirmaMasivaSerializer,
+    BandejaFirmasSerializer,
+    SesionFirmaSerializer,
+    ExportacionSerializer,
+    BusquedaSerializer,
     BodegaSerializer,
     StockMateriaPrimaSerializer,
     StockMaterialEnvasePrimarioSerializer,
     StockMaterialEnvaseSecundarioEmpaqueSerializer,
+    MovimientoStockSerializer,
+    CamposDinamicosMixin,
 )
 
 User = get_user_model()
@@ -55,55 +84,349 @@ User = get_user_model()
 # ===========================================================
 # HELPERS
 # ===========================================================
-def obtener_bodega_principal(tipo, nombre_por_defecto):
+def nombre_usuario(request):
+    return request.user.username if request.user.is_authenticated else "Sistema"
+
+
+def registrar_movimiento(*args, **kwargs):
+    """MovimientoStock.registrar con los errores de negocio como 400."""
+    try:
+        return MovimientoStock.registrar(*args, **kwargs)
+    except DjangoValidationError as exc:
+        raise ValidationError(exc.message_dict)
+
+
+def ajustar_stock(*args, **kwargs):
+    """MovimientoStock.ajustar con los errores de negocio como 400."""
+    try:
+        return MovimientoStock.ajustar(*args, **kwargs)
+    except DjangoValidationError as exc:
+        raise ValidationError(exc.message_dict)
+
+
+def autenticar_firmante(data, alcance):
     """
-    Devuelve la bodega principal de un tipo (MP, EP, ES).
-    Si no existe, la crea con el nombre_por_defecto.
+    Usuario que firma, por el token de una sesión de firma (sin volver a
+    calcular el hash de la contraseña) o por RUT y contraseña.
+    Devuelve (usuario, sesion, None) o (None, None, respuesta 401).
     """
-    bodega = Bodega.objects.filter(tipo=tipo, es_principal=True).first()
-    if bodega:
-        return bodega
-
-    bodega, _ = Bodega.objects.get_or_create(
-        nombre=nombre_por_defecto,
-        defaults={
-            "tipo": tipo,
-            "ubicacion": "Principal",
-            "es_principal": True,
-        },
-    )
-    return bodega
+    if data.get("token"):
+        sesion = SesionFirma.validar(data["token"], alcance)
+        if sesion is None:
+            return None, None, Response(
+                {"error": "Sesión de firma inválida o expirada"},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+        return sesion.usuario, sesion, None
+
+    user = User.objects.filter(rut=data["rut"]).first()
+    if user is None or not user.check_password(data["password"]):
+        return None, None, Response(
+            {"error": "RUT o contraseña inválidos"},
+            status=status.HTTP_401_UNAUTHORIZED,
+        )
+    return user, None, None
+
+
+class EliminacionProtegidaMixin:
+    """
+    DELETE de registros que otros protegen (on_delete=PROTECT, p. ej. los
+    movimientos de stock de una bodega o un material): en vez de un 500,
+    responde 409 con lo que impide eliminarlo. El historial no se borra ni
+    se archiva; primero hay que dejar de referenciarlo.
+    """
+
+    def destroy(self, request, *args, **kwargs):
+        try:
+            return super().destroy(request, *args, **kwargs)
+        except ProtectedError as exc:
+            protegidos = list(exc.protected_objects)
+            return Response(
+                {
+                    "error": (
+                        "No se puede eliminar: tiene "
+                        f"{len(protegidos)} registros asociados."
+                    ),
+                    "relacionados": sorted({
+                        type(objeto).__name__ for objeto in protegidos
+                    }),
+                },
+                status=status.HTTP_409_CONFLICT,
+            )
+
+
+class PlanDeCargaMixin:
+    """
+    Ajusta el queryset a lo que el serializer va a renderizar según
+    ?fields= / ?expand=: solo se hace JOIN o prefetch de lo pedido.
+    Los prefetch se omiten al escribir, porque la respuesta se arma con
+    la instancia ya modificada.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer = self.get_serializer()
+        if isinstance(serializer, CamposDinamicosMixin):
+            queryset = serializer.cargar(
+                queryset, prefetch=self.request.method in SAFE_METHODS
+            )
+        return queryset
+
+
+def filtros_planilla(campo_material):
+    """Filtros comunes de las tres planillas con firmas."""
+    filtros = {
+        "estado": Exacto("estado_aprobacion"),
+        "tipo_movimiento": Exacto("tipo_movimiento"),
+        "producto": Exacto("producto"),
+        campo_material: Exacto(campo_material),
+        "control_calidad": Exacto("control_calidad"),
+        "fecha_emision": Rango("fecha_emision"),
+        "fecha_creacion": Rango("fecha_creacion"),
+    }
+    # ?firmado_jefe_seccion=false: planillas que aún esperan esa firma
+    for campo in RegistroFirma.CAMPOS_FIRMA_PLANILLA.values():
+        filtros[campo.replace("firma_", "firmado_", 1)] = Presente(campo)
+    return filtros
+
+
+class ExportacionMixin:
+    """
+    GET <ruta>/exportar/?formato=csv|xlsx&desde=&hasta= entrega todas las
+    filas del rango, sin paginar, como archivo descargable. Las filas se
+    leen y se escriben por bloques (ver GPQAPI.exportacion).
+    """
+
+    # fecha sobre la que se aplica desde/hasta; el orden es (fecha, id)
+    campo_fecha_exportacion = None
+    columnas_exportacion = ()
+
+    def queryset_exportacion(self, desde, hasta):
+        campo = self.campo_fecha_exportacion
+        queryset = filtrar_rango(
+            self.filter_queryset(self.queryset.all()), campo, desde, hasta
+        )
+        return queryset.order_by(campo, "id")
+
+    @action(detail=False, methods=["get"])
+    def exportar(self, request):
+        parametros = ExportacionSerializer(data=request.query_params)
+        parametros.is_valid(raise_exception=True)
+        formato = parametros.validated_data["formato"]
+        desde = parametros.validated_data.get("desde")
+        hasta = parametros.validated_data.get("hasta")
+
+        response = StreamingHttpResponse(
+            exportacion.generar(
+                formato,
+                self.columnas_exportacion,
+                self.queryset_exportacion(desde, hasta),
+                hoja=self.basename[:31],
+            ),
+            content_type=exportacion.FORMATOS[formato],
+        )
+        nombre = "-".join(
+            [self.basename] + [str(f) for f in (desde, hasta) if f]
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{nombre}.{formato}"'
+        )
+        return response
 
 
 # ===========================================================
 # USUARIOS
 # ===========================================================
-class UsuarioPersonalizadoViewSet(viewsets.ModelViewSet):
+class UsuarioPersonalizadoViewSet(
+    EliminacionProtegidaMixin, PlanDeCargaMixin, viewsets.ModelViewSet
+):
     queryset = UsuarioPersonalizado.objects.all()
     serializer_class = UsuarioPersonalizadoSerializer
+    filtros = {"rut": Exacto("rut"), "username": Exacto("username")}
+    ordenamientos = ("id", "username")
 
 
-class PerfilUsuarioViewSet(viewsets.ModelViewSet):
+class PerfilUsuarioViewSet(PlanDeCargaMixin, viewsets.ModelViewSet):
     queryset = PerfilUsuario.objects.all()
     serializer_class = PerfilUsuarioSerializer
+    filtros = {"rol": Exacto("rol"), "usuario": Exacto("usuario")}
+    ordenamientos = ("id",)
 
 
-class RegistroFirmaViewSet(viewsets.ModelViewSet):
+class RegistroFirmaViewSet(
+    ExportacionMixin, PlanDeCargaMixin, viewsets.ModelViewSet
+):
     queryset = RegistroFirma.objects.all()
     serializer_class = RegistroFirmaSerializer
+    pagination_class = CursorTimestampFirmaPagination
+    campo_fecha_exportacion = "timestamp_firma"
+    columnas_exportacion = exportacion.COLUMNAS_REGISTRO_FIRMA
+    filtros = {
+        "usuario": Exacto("usuario"),
+        "planilla_fabricacion": Exacto("planilla_fabricacion"),
+        "planilla_envase_primario": Exacto("planilla_envase_primario"),
+        "planilla_envase_secundario_empaque": Exacto(
+            "planilla_envase_secundario_empaque"
+        ),
+        "sesion_firma": Exacto("sesion_firma"),
+        "timestamp_firma": Rango("timestamp_firma"),
+    }
+    ordenamientos = ("timestamp_firma",)
+
+
+class SesionFirmaViewSet(viewsets.GenericViewSet):
+    """
+    Abre una sesión de firma: valida RUT y contraseña una vez y entrega
+    un token de corta duración que aceptan las acciones firmar.
+    """
+
+    queryset = SesionFirma.objects.all()
+    serializer_class = SesionFirmaSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        user, _, error = autenticar_firmante(
+            {"rut": data["rut"], "password": data["password"]}, None
+        )
+        if error:
+            return error
+
+        try:
+            rol = user.perfilusuario.rol
+        except PerfilUsuario.DoesNotExist:
+            rol = None
+        permitidos = SesionFirma.ALCANCES_POR_ROL.get(rol, set())
+        alcance = data.get("alcance") or permitidos
+        if not alcance or not set(alcance) <= permitidos:
+            return Response(
+                {"error": "No tiene permisos para firmar en ese alcance"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
+        sesion, token = SesionFirma.abrir(
+            user,
+            alcance,
+            ip_address=(
+                x_forwarded_for.split(",")[0]
+                if x_forwarded_for
+                else request.META.get("REMOTE_ADDR")
+            ),
+            user_agent=request.META.get("HTTP_USER_AGENT", ""),
+        )
+        return Response(
+            {
+                "token": token,
+                "expira": sesion.expira,
+                "alcance": sorted(sesion.alcances),
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class FirmaMasivaViewSet(viewsets.GenericViewSet):
+    """
+    Firma varias planillas (fabricación, envase primario y envase
+    secundario) con una sola validación de credenciales. Responde el
+    resultado de cada planilla; las que fallan no impiden las demás.
+    """
+
+    queryset = RegistroFirma.objects.all()
+    serializer_class = FirmaMasivaSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        user, sesion, error = autenticar_firmante(data, None)
+        if error:
+            return error
+
+        x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
+        resultados, _ = RegistroFirma.firmar_planillas(
+            user,
+            [(o["tipo"], o["id"]) for o in data["planillas"]],
+            sesion=sesion,
+            ip_address=(
+                x_forwarded_for.split(",")[0]
+                if x_forwarded_for
+                else request.META.get("REMOTE_ADDR")
+            ),
+            user_agent=request.META.get("HTTP_USER_AGENT", ""),
+        )
+
+        return Response({
+            "firmadas": sum(1 for r in resultados if r["ok"]),
+            "resultados": resultados,
+        })
+
+    @action(detail=False, methods=["get"])
+    def pendientes(self, request):
+        """
+        Bandeja del usuario autenticado: lo que su rol todavía no firmó, de
+        lo más antiguo a lo más nuevo, con el conteo por tipo. Los tipos de
+        planilla son los que acepta create. ?limite= y ?cursor= paginan
+        (ver bandeja.py).
+        """
+        parametros = BandejaFirmasSerializer(data=request.query_params)
+        parametros.is_valid(raise_exception=True)
+        datos = parametros.validated_data
+        try:
+            rol = request.user.perfilusuario.rol
+        except PerfilUsuario.DoesNotExist:
+            rol = ""
+
+        try:
+            filas, cursor = bandeja.pagina(
+                rol, limite=datos["limite"], cursor=datos.get("cursor")
+            )
+        except ValueError as exc:
+            raise ValidationError({"cursor": [str(exc)]})
+        modelos = {f.tipo: f.modelo for f in bandeja.fuentes(rol)}
+        for fila in filas:
+            fila["url"] = reverse(
+                f"{modelos[fila['tipo']].__name__.lower()}-detail",
+                args=[fila["id"]], request=request,
+            )
+        conteos = bandeja.conteos(rol)
+        return Response({
+            "rol": rol,
+            "conteos": conteos,
+            "total": sum(conteos.values()),
+            "siguiente": (
+                replace_query_param(
+                    request.build_absolute_uri(), "cursor", cursor
+                )
+                if cursor else None
+            ),
+            "resultados": filas,
+        })
 
 
 # ===========================================================
 # BODEGAS Y STOCK
 # ===========================================================
-class BodegaViewSet(viewsets.ModelViewSet):
+class BodegaViewSet(
+    EliminacionProtegidaMixin, PlanDeCargaMixin, viewsets.ModelViewSet
+):
     queryset = Bodega.objects.all()
     serializer_class = BodegaSerializer
+    filtros = {"tipo": Exacto("tipo"), "nombre": Exacto("nombre")}
+    ordenamientos = ("id", "nombre")
 
 
-class StockMateriaPrimaViewSet(viewsets.ModelViewSet):
+class StockMateriaPrimaViewSet(PlanDeCargaMixin, viewsets.ModelViewSet):
     queryset = StockMateriaPrima.objects.all()
     serializer_class = StockMateriaPrimaSerializer
+    filtros = {
+        "bodega": Exacto("bodega"),
+        "materia_prima": Exacto("materia_prima"),
+    }
+    ordenamientos = ("id",)
 
     def create(self, request, *args, **kwargs):
         """
@@ -111,10 +434,10 @@ class StockMateriaPrimaViewSet(viewsets.ModelViewSet):
         Si ya existe (Bodega MP principal, materia_prima) se ACTUALIZA
         cantidad_disponible en lugar de crear un nuevo registro.
         """
-        materia_id = request.data.get("materia_prima")
+        material_id = request.data.get("materia_prima")
         cantidad = request.data.get("cantidad_disponible")
 
-        if materia_id is None or cantidad is None:
+        if material_id is None or cantidad is None:
             return super().create(request, *args, **kwargs)
 
         try:
@@ -125,26 +448,47 @@ class StockMateriaPrimaViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        bodega_mp = obtener_bodega_principal("MP", "Bodega Materias Primas")
+        material = MateriaPrima.objects.filter(pk=material_id).first()
+        if material is None:
+            return Response(
+                {"detalle": "La materia prima no existe"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        stock, created = StockMateriaPrima.objects.get_or_create(
-            bodega=bodega_mp,
-            materia_prima_id=materia_id,
-            defaults={"cantidad_disponible": cantidad},
-        )
+        bodega_mp = Bodega.principal("MP")
 
-        if not created:
-            stock.cantidad_disponible = cantidad
-            stock.save()
+        stock, created = ajustar_stock(
+            bodega_mp, material, cantidad,
+            referencia="Carga de stock", usuario=nombre_usuario(request),
+        )
 
         serializer = self.get_serializer(stock)
         code = status.HTTP_201_CREATED if created else status.HTTP_200_OK
         return Response(serializer.data, status=code)
 
+    def perform_update(self, serializer):
+        # el saldo solo cambia a través del libro de movimientos
+        cantidad = serializer.validated_data.pop("cantidad_disponible", None)
+        stock = serializer.save()
+        if cantidad is not None:
+            ajustar_stock(
+                stock.bodega, stock.materia_prima, cantidad,
+                referencia="Edición de stock",
+                usuario=nombre_usuario(self.request),
+            )
+            stock.refresh_from_db()
 
-class StockMaterialEnvasePrimarioViewSet(viewsets.ModelViewSet):
+
+class StockMaterialEnvasePrimarioViewSet(
+    PlanDeCargaMixin, viewsets.ModelViewSet
+):
     queryset = StockMaterialEnvasePrimario.objects.all()
     serializer_class = StockMaterialEnvasePrimarioSerializer
+    filtros = {
+        "bodega": Exacto("bodega"),
+        "material_envase_primario": Exacto("material_envase_primario"),
+    }
+    ordenamientos = ("id",)
 
     def create(self, request, *args, **kwargs):
         """
@@ -166,26 +510,51 @@ class StockMaterialEnvasePrimarioViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        bodega_ep = obtener_bodega_principal("EP", "Bodega Envase Primario")
+        material = MaterialEnvasePrimario.objects.filter(
+            pk=material_id
+        ).first()
+        if material is None:
+            return Response(
+                {"detalle": "El material de envase primario no existe"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        stock, created = StockMaterialEnvasePrimario.objects.get_or_create(
-            bodega=bodega_ep,
-            material_envase_primario_id=material_id,
-            defaults={"cantidad_disponible": cantidad},
-        )
+        bodega_ep = Bodega.principal("EP")
 
-        if not created:
-            stock.cantidad_disponible = cantidad
-            stock.save()
+        stock, created = ajustar_stock(
+            bodega_ep, material, cantidad,
+            referencia="Carga de stock", usuario=nombre_usuario(request),
+        )
 
         serializer = self.get_serializer(stock)
         code = status.HTTP_201_CREATED if created else status.HTTP_200_OK
         return Response(serializer.data, status=code)
 
+    def perform_update(self, serializer):
+        # el saldo solo cambia a través del libro de movimientos
+        cantidad = serializer.validated_data.pop("cantidad_disponible", None)
+        stock = serializer.save()
+        if cantidad is not None:
+            ajustar_stock(
+                stock.bodega, stock.material_envase_primario, cantidad,
+                referencia="Edición de stock",
+                usuario=nombre_usuario(self.request),
+            )
+            stock.refresh_from_db()
 
-class StockMaterialEnvaseSecundarioEmpaqueViewSet(viewsets.ModelViewSet):
+
+class StockMaterialEnvaseSecundarioEmpaqueViewSet(
+    PlanDeCargaMixin, viewsets.ModelViewSet
+):
     queryset = StockMaterialEnvaseSecundarioEmpaque.objects.all()
     serializer_class = StockMaterialEnvaseSecundarioEmpaqueSerializer
+    filtros = {
+        "bodega": Exacto("bodega"),
+        "material_envase_secundario_empaque": Exacto(
+            "material_envase_secundario_empaque"
+        ),
+    }
+    ordenamientos = ("id",)
 
     def create(self, request, *args, **kwargs):
         """
@@ -207,64 +576,155 @@ class StockMaterialEnvaseSecundarioEmpaqueViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        bodega_es = obtener_bodega_principal("ES", "Bodega Envase Secundario")
+        material = MaterialEnvaseSecundarioEmpaque.objects.filter(
+            pk=material_id
+        ).first()
+        if material is None:
+            return Response(
+                {"detalle": "El material de envase secundario no existe"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        stock, created = StockMaterialEnvaseSecundarioEmpaque.objects.get_or_create(
-            bodega=bodega_es,
-            material_envase_secundario_empaque_id=material_id,
-            defaults={"cantidad_disponible": cantidad},
-        )
+        bodega_es = Bodega.principal("ES")
 
-        if not created:
-            stock.cantidad_disponible = cantidad
-            stock.save()
+        stock, created = ajustar_stock(
+            bodega_es, material, cantidad,
+            referencia="Carga de stock", usuario=nombre_usuario(request),
+        )
 
         serializer = self.get_serializer(stock)
         code = status.HTTP_201_CREATED if created else status.HTTP_200_OK
         return Response(serializer.data, status=code)
 
+    def perform_update(self, serializer):
+        # el saldo solo cambia a través del libro de movimientos
+        cantidad = serializer.validated_data.pop("cantidad_disponible", None)
+        stock = serializer.save()
+        if cantidad is not None:
+            ajustar_stock(
+                stock.bodega, stock.material_envase_secundario_empaque, cantidad,
+                referencia="Edición de stock",
+                usuario=nombre_usuario(self.request),
+            )
+            stock.refresh_from_db()
+
+
+class MovimientoStockViewSet(PlanDeCargaMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Libro de movimientos de stock: solo lectura. Los movimientos se
+    generan desde las cargas de stock y las planillas de pedido.
+    """
+
+    queryset = MovimientoStock.objects.all()
+    serializer_class = MovimientoStockSerializer
+    pagination_class = CursorFechaCreacionPagination
+    filtros = {
+        "bodega": Exacto("bodega"),
+        "materia_prima": Exacto("materia_prima"),
+        "material_envase_primario": Exacto("material_envase_primario"),
+        "material_envase_secundario_empaque": Exacto(
+            "material_envase_secundario_empaque"
+        ),
+        "fecha_creacion": Rango("fecha_creacion"),
+    }
+    ordenamientos = ("fecha_creacion",)
+
 
 # ===========================================================
 # PRODUCTOS
 # ===========================================================
-class ProductoViewSet(viewsets.ModelViewSet):
+class ProductoViewSet(PlanDeCargaMixin, viewsets.ModelViewSet):
     queryset = Producto.objects.all()
     serializer_class = ProductoSerializer
+    ordenamientos = ("id",)
 
 
-class TipoProductoViewSet(viewsets.ModelViewSet):
+class TipoProductoViewSet(PlanDeCargaMixin, viewsets.ModelViewSet):
     queryset = TipoProducto.objects.all()
     serializer_class = TipoProductoSerializer
+    filtros = {"nombre": Exacto("nombre")}
+    ordenamientos = ("id", "nombre")
 
 
-class MateriaPrimaViewSet(viewsets.ModelViewSet):
+class MateriaPrimaViewSet(
+    EliminacionProtegidaMixin, PlanDeCargaMixin, viewsets.ModelViewSet
+):
     queryset = MateriaPrima.objects.all()
     serializer_class = MateriaPrimaSerializer
+    filtros = {
+        "estado": Exacto("estado_aprobacion"),
+        "batch": Exacto("batch"),
+    }
+    ordenamientos = ("id", "batch")
 
+    @transaction.atomic
     def perform_create(self, serializer):
         materia = serializer.save()
 
-        bodega_mp = obtener_bodega_principal("MP", "Bodega Materias Primas")
+        bodega_mp = Bodega.principal("MP")
 
-        # Upsert inicial: si ya existiera, se suma la cantidad
-        stock, created = StockMateriaPrima.objects.get_or_create(
-            bodega=bodega_mp,
-            materia_prima=materia,
-            defaults={"cantidad_disponible": materia.cantidad},
+        # Ingreso inicial: entrada en el libro de movimientos
+        registrar_movimiento(
+            bodega_mp, materia, materia.cantidad, "ENTRADA",
+            referencia=f"MateriaPrima:{materia.id}",
+            usuario=nombre_usuario(self.request),
         )
-        if not created:
-            stock.cantidad_disponible = stock.cantidad_disponible + materia.cantidad
-            stock.save()
 
+    @action(
+        detail=False, methods=["post"],
+        parser_classes=[MultiPartParser, FormParser],
+    )
+    def importar(self, request):
+        """
+        CSV de recepción en el campo "archivo" (multipart): crea todas las
+        materias primas con su stock inicial, o ninguna si alguna fila
+        tiene errores. Ver GPQAPI.importacion.
+        """
+        archivo = request.FILES.get("archivo")
+        if archivo is None:
+            return Response(
+                {"archivo": ["Adjunte el CSV en el campo archivo."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        reporte = importar_materias_primas(
+            codecs.iterdecode(archivo, "utf-8-sig"),
+            usuario=nombre_usuario(request),
+        )
+        return Response(
+            reporte,
+            status=(
+                status.HTTP_400_BAD_REQUEST
+                if reporte["errores"]
+                else status.HTTP_201_CREATED
+            ),
+        )
 
-class MaterialEnvasePrimarioViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=["get"])
+    def trazabilidad(self, request, pk=None):
+        """
+        Retiro de lote: todo lo que consumió el batch de esta materia
+        prima (planillas de fabricación, jarabes y planillas de envase del
+        mismo producto y lote) en un solo árbol. Ver GPQAPI.trazabilidad.
+        """
+        materia = self.get_object()
+        return Response(trazar_lote(materia.batch))
+
+
+class MaterialEnvasePrimarioViewSet(
+    EliminacionProtegidaMixin, PlanDeCargaMixin, viewsets.ModelViewSet
+):
     queryset = MaterialEnvasePrimario.objects.all()
     serializer_class = MaterialEnvasePrimarioSerializer
+    filtros = {
+        "estado": Exacto("estado_aprobacion"),
+        "codigo": Exacto("codigo"),
+    }
+    ordenamientos = ("id", "codigo")
 
     def perform_create(self, serializer):
         material = serializer.save()
 
-        bodega_ep = obtener_bodega_principal("EP", "Bodega Envase Primario")
+        bodega_ep = Bodega.principal("EP")
 
         # Upsert inicial (queda en 0 hasta que lo ajustes por API de stock)
         StockMaterialEnvasePrimario.objects.get_or_create(
@@ -274,14 +734,21 @@ class MaterialEnvasePrimarioViewSet(viewsets.ModelViewSet):
         )
 
 
-class MaterialEnvaseSecundarioEmpaqueViewSet(viewsets.ModelViewSet):
+class MaterialEnvaseSecundarioEmpaqueViewSet(
+    EliminacionProtegidaMixin, PlanDeCargaMixin, viewsets.ModelViewSet
+):
     queryset = MaterialEnvaseSecundarioEmpaque.objects.all()
     serializer_class = MaterialEnvaseSecundarioEmpaqueSerializer
+    filtros = {
+        "estado": Exacto("estado_aprobacion"),
+        "codigo": Exacto("codigo"),
+    }
+    ordenamientos = ("id", "codigo")
 
     def perform_create(self, serializer):
         material = serializer.save()
 
-        bodega_es = obtener_bodega_principal("ES", "Bodega Envase Secundario")
+        bodega_es = Bodega.principal("ES")
 
         StockMaterialEnvaseSecundarioEmpaque.objects.get_or_create(
             bodega=bodega_es,
@@ -293,18 +760,26 @@ class MaterialEnvaseSecundarioEmpaqueViewSet(viewsets.ModelViewSet):
 # ===========================================================
 # CONTROL DE CALIDAD
 # ===========================================================
-class ControlCalidadViewSet(viewsets.ModelViewSet):
+class ControlCalidadViewSet(PlanDeCargaMixin, viewsets.ModelViewSet):
     queryset = ControlCalidad.objects.all()
     serializer_class = ControlCalidadSerializer
+    filtros = {
+        "codigo": Exacto("codigo_control_calidad"),
+        "producto": Exacto("producto"),
+        "inspector": Exacto("inspector"),
+        "materia_prima": Exacto("materia_prima"),
+        "material_envase_primario": Exacto("material_envase_primario"),
+        "material_envase_secundario_empaque": Exacto(
+            "material_envase_secundario_empaque"
+        ),
+    }
+    ordenamientos = ("id",)
 
     def get_serializer_class(self):
         if getattr(self, "action", None) == "firmar":
             return FirmaSerializer
         return super().get_serializer_class()
 
-    def get_queryset(self):
-        return ControlCalidad.objects.all()
-
     @action(detail=True, methods=["post"])
     def firmar(self, request, pk=None):
         control_calidad = self.get_object()
@@ -316,20 +791,11 @@ class ControlCalidadViewSet(viewsets.ModelViewSet):
             )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @transaction.atomic
     def _procesar_firma_control_calidad(self, control_calidad, data, request):
-        try:
-            user = User.objects.get(rut=data["rut"])
-        except User.DoesNotExist:
-            return Response(
-                {"error": "RUT o contraseña inválidos"},
-                status=status.HTTP_401_UNAUTHORIZED,
-            )
-
-        if not user.check_password(data["password"]):
-            return Response(
-                {"error": "RUT o contraseña inválidos"},
-                status=status.HTTP_401_UNAUTHORIZED,
-            )
+        user, sesion, error = autenticar_firmante(data, "control_calidad")
+        if error:
+            return error
 
         if not self._tiene_permiso_firma(user, control_calidad):
             return Response(
@@ -344,6 +810,7 @@ class ControlCalidadViewSet(viewsets.ModelViewSet):
             firma_hash=firma_hash,
             ip_address=self._get_client_ip(request),
             user_agent=request.META.get("HTTP_USER_AGENT", ""),
+            sesion_firma=sesion,
         )
 
         control_calidad.firma_control_calidad = registro_firma
@@ -400,10 +867,18 @@ class ControlCalidadViewSet(viewsets.ModelViewSet):
 # ===========================================================
 # PLANILLA FABRICACIÓN
 # ===========================================================
-class PlanillaFabricacionViewSet(viewsets.ModelViewSet):
+class PlanillaFabricacionViewSet(
+    ExportacionMixin, PlanDeCargaMixin, viewsets.ModelViewSet
+):
     queryset = PlanillaFabricacion.objects.all()
     serializer_class = PlanillaFabricacionSerializer
+    pagination_class = CursorFechaCreacionPagination
+    campo_fecha_exportacion = "fecha_emision"
+    columnas_exportacion = exportacion.COLUMNAS_PLANILLA_FABRICACION
+    filtros = filtros_planilla("materia_prima")
+    ordenamientos = ("fecha_creacion", "fecha_emision")
 
+    @transaction.atomic
     def perform_create(self, serializer):
         usuario = (
             self.request.user.username
@@ -437,19 +912,9 @@ class PlanillaFabricacionViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def _procesar_firma(self, planilla, data, request):
-        try:
-            user = User.objects.get(rut=data["rut"])
-        except User.DoesNotExist:
-            return Response(
-                {"error": "RUT o contraseña inválidos"},
-                status=status.HTTP_401_UNAUTHORIZED,
-            )
-
-        if not user.check_password(data["password"]):
-            return Response(
-                {"error": "RUT o contraseña inválidos"},
-                status=status.HTTP_401_UNAUTHORIZED,
-            )
+        user, sesion, error = autenticar_firmante(data, "planilla_fabricacion")
+        if error:
+            return error
 
         if not self._tiene_permiso_firma(user):
             return Response(
@@ -465,6 +930,7 @@ class PlanillaFabricacionViewSet(viewsets.ModelViewSet):
             firma_hash=firma_hash,
             ip_address=self._get_client_ip(request),
             user_agent=request.META.get("HTTP_USER_AGENT", ""),
+            sesion_firma=sesion,
         )
 
         planilla.refresh_from_db()
@@ -495,21 +961,15 @@ class PlanillaFabricacionViewSet(viewsets.ModelViewSet):
         if planilla.cantidad_entregada is None or planilla.cantidad_entregada <= 0:
             return
 
-        bodega_mp = obtener_bodega_principal("MP", "Bodega Materias Primas")
+        bodega_mp = Bodega.principal("MP")
 
-        stock, _ = StockMateriaPrima.objects.get_or_create(
-            bodega=bodega_mp,
-            materia_prima=planilla.materia_prima,
-            defaults={"cantidad_disponible": 0},
+        registrar_movimiento(
+            bodega_mp, planilla.materia_prima, -planilla.cantidad_entregada,
+            "SALIDA",
+            referencia=f"PlanillaFabricacion:{planilla.id}",
+            usuario=planilla.usuario_creacion,
         )
 
-        nueva_cantidad = stock.cantidad_disponible - planilla.cantidad_entregada
-        if nueva_cantidad < 0:
-            nueva_cantidad = 0
-
-        stock.cantidad_disponible = nueva_cantidad
-        stock.save()
-
     def _generar_hash_firma(self, user, planilla):
         data = (
             f"{user.rut}{planilla.id}{datetime.datetime.now().isoformat()}"
@@ -528,9 +988,16 @@ class PlanillaFabricacionViewSet(viewsets.ModelViewSet):
 # ===========================================================
 # PLANILLA ENVASE
 # ===========================================================
-class PlanillaEnvaseViewSet(viewsets.ModelViewSet):
+class PlanillaEnvaseViewSet(PlanDeCargaMixin, viewsets.ModelViewSet):
     queryset = PlanillaEnvase.objects.all()
     serializer_class = PlanillaEnvaseSerializer
+    filtros = {
+        "estado": Exacto("estado_aprobacion"),
+        "producto": Exacto("producto"),
+        "firmado_jefe_seccion": Presente("firma_jefe_seccion"),
+        "firmado_jefe_produccion": Presente("firma_jefe_produccion"),
+    }
+    ordenamientos = ("id",)
 
     def perform_create(self, serializer):
         usuario = (
@@ -555,10 +1022,18 @@ class PlanillaEnvaseViewSet(viewsets.ModelViewSet):
 # ===========================================================
 # PLANILLA ENVASE PRIMARIO
 # ===========================================================
-class PlanillaEnvasePrimarioViewSet(viewsets.ModelViewSet):
+class PlanillaEnvasePrimarioViewSet(
+    ExportacionMixin, PlanDeCargaMixin, viewsets.ModelViewSet
+):
     queryset = PlanillaEnvasePrimario.objects.all()
     serializer_class = PlanillaEnvasePrimarioSerializer
+    pagination_class = CursorFechaCreacionPagination
+    campo_fecha_exportacion = "fecha_emision"
+    columnas_exportacion = exportacion.COLUMNAS_PLANILLA_ENVASE_PRIMARIO
+    filtros = filtros_planilla("material_envase_primario")
+    ordenamientos = ("fecha_creacion", "fecha_emision")
 
+    @transaction.atomic
     def perform_create(self, serializer):
         usuario = (
             self.request.user.username
@@ -592,19 +1067,9 @@ class PlanillaEnvasePrimarioViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def _procesar_firma(self, planilla, data, request):
-        try:
-            user = User.objects.get(rut=data["rut"])
-        except User.DoesNotExist:
-            return Response(
-                {"error": "RUT o contraseña inválidos"},
-                status=status.HTTP_401_UNAUTHORIZED,
-            )
-
-        if not user.check_password(data["password"]):
-            return Response(
-                {"error": "RUT o contraseña inválidos"},
-                status=status.HTTP_401_UNAUTHORIZED,
-            )
+        user, sesion, error = autenticar_firmante(data, "planilla_envase_primario")
+        if error:
+            return error
 
         if not self._tiene_permiso_firma(user):
             return Response(
@@ -620,6 +1085,7 @@ class PlanillaEnvasePrimarioViewSet(viewsets.ModelViewSet):
             firma_hash=firma_hash,
             ip_address=self._get_client_ip(request),
             user_agent=request.META.get("HTTP_USER_AGENT", ""),
+            sesion_firma=sesion,
         )
 
         planilla.refresh_from_db()
@@ -650,21 +1116,15 @@ class PlanillaEnvasePrimarioViewSet(viewsets.ModelViewSet):
         if planilla.cantidad_entregada is None or planilla.cantidad_entregada <= 0:
             return
 
-        bodega_ep = obtener_bodega_principal("EP", "Bodega Envase Primario")
+        bodega_ep = Bodega.principal("EP")
 
-        stock, _ = StockMaterialEnvasePrimario.objects.get_or_create(
-            bodega=bodega_ep,
-            material_envase_primario=planilla.material_envase_primario,
-            defaults={"cantidad_disponible": 0},
+        registrar_movimiento(
+            bodega_ep, planilla.material_envase_primario,
+            -planilla.cantidad_entregada, "SALIDA",
+            referencia=f"PlanillaEnvasePrimario:{planilla.id}",
+            usuario=planilla.usuario_creacion,
         )
 
-        nueva_cantidad = stock.cantidad_disponible - planilla.cantidad_entregada
-        if nueva_cantidad < 0:
-            nueva_cantidad = 0
-
-        stock.cantidad_disponible = nueva_cantidad
-        stock.save()
-
     def _generar_hash_firma(self, user, planilla):
         data = (
             f"{user.rut}{planilla.id}{datetime.datetime.now().isoformat()}"
@@ -683,9 +1143,16 @@ class PlanillaEnvasePrimarioViewSet(viewsets.ModelViewSet):
 # ===========================================================
 # PLANILLA ENVASE SECUNDARIO Y EMPAQUE
 # ===========================================================
-class PlanillaEnvaseSecundarioEmpaqueViewSet(viewsets.ModelViewSet):
+class PlanillaEnvaseSecundarioEmpaqueViewSet(
+    ExportacionMixin, PlanDeCargaMixin, viewsets.ModelViewSet
+):
     queryset = PlanillaEnvaseSecundarioEmpaque.objects.all()
     serializer_class = PlanillaEnvaseSecundarioEmpaqueSerializer
+    pagination_class = CursorFechaCreacionPagination
+    campo_fecha_exportacion = "fecha_emision"
+    columnas_exportacion = exportacion.COLUMNAS_PLANILLA_ENVASE_SECUNDARIO
+    filtros = filtros_planilla("material_envase_secundario_empaque")
+    ordenamientos = ("fecha_creacion", "fecha_emision")
 
     def perform_create(self, serializer):
         usuario = (
@@ -719,19 +1186,11 @@ class PlanillaEnvaseSecundarioEmpaqueViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def _procesar_firma(self, planilla, data, request):
-        try:
-            user = User.objects.get(rut=data["rut"])
-        except User.DoesNotExist:
-            return Response(
-                {"error": "RUT o contraseña inválidos"},
-                status=status.HTTP_401_UNAUTHORIZED,
-            )
-
-        if not user.check_password(data["password"]):
-            return Response(
-                {"error": "RUT o contraseña inválidos"},
-                status=status.HTTP_401_UNAUTHORIZED,
-            )
+        user, sesion, error = autenticar_firmante(
+            data, "planilla_envase_secundario_empaque"
+        )
+        if error:
+            return error
 
         if not self._tiene_permiso_firma(user):
             return Response(
@@ -743,21 +1202,23 @@ class PlanillaEnvaseSecundarioEmpaqueViewSet(viewsets.ModelViewSet):
 
         firma_hash = self._generar_hash_firma(user, planilla)
 
-        registro_firma = RegistroFirma.objects.create(
-            usuario=user,
-            planilla_envase_secundario_empaque=planilla,
-            firma_hash=firma_hash,
-            ip_address=self._get_client_ip(request),
-            user_agent=request.META.get("HTTP_USER_AGENT", ""),
-        )
+        with transaction.atomic():
+            registro_firma = RegistroFirma.objects.create(
+                usuario=user,
+                planilla_envase_secundario_empaque=planilla,
+                firma_hash=firma_hash,
+                ip_address=self._get_client_ip(request),
+                user_agent=request.META.get("HTTP_USER_AGENT", ""),
+                sesion_firma=sesion,
+            )
 
-        planilla.refresh_from_db()
+            planilla.refresh_from_db()
 
-        if (
-            estado_inicial != "APROBADO"
-            and planilla.estado_aprobacion == "APROBADO"
-        ):
-            self._aplicar_movimiento_bodega(planilla)
+            if (
+                estado_inicial != "APROBADO"
+                and planilla.estado_aprobacion == "APROBADO"
+            ):
+                planilla.descontar_stock_aprobado()
 
         return Response(
             {
@@ -779,33 +1240,6 @@ class PlanillaEnvaseSecundarioEmpaqueViewSet(viewsets.ModelViewSet):
             "QUIMICO_FARMACEUTICO",
         }
 
-    def _aplicar_movimiento_bodega(self, planilla: PlanillaEnvaseSecundarioEmpaque):
-        if planilla.tipo_movimiento != "PEDIDO_BODEGA":
-            return
-
-        if planilla.cantidad_entregada is None or planilla.cantidad_entregada <= 0:
-            return
-
-        bodega_es = obtener_bodega_principal("ES", "Bodega Envase Secundario")
-
-        stock, _ = StockMaterialEnvaseSecundarioEmpaque.objects.get_or_create(
-            bodega=bodega_es,
-            material_envase_secundario_empaque=planilla.material_envase_secundario_empaque,
-            defaults={"cantidad_disponible": 0},
-        )
-
-        if stock.cantidad_disponible < planilla.cantidad_entregada:
-            print(
-                f"DEBUG: No se descuenta stock ES; disponible={stock.cantidad_disponible}, "
-                f"solicitado={planilla.cantidad_entregada}"
-            )
-            return
-
-        stock.cantidad_disponible = (
-            stock.cantidad_disponible - planilla.cantidad_entregada
-        )
-        stock.save()
-
     def _generar_hash_firma(self, user, planilla):
         data = (
             f"{user.rut}{planilla.id}{datetime.datetime.now().isoformat()}"
@@ -824,47 +1258,126 @@ class PlanillaEnvaseSecundarioEmpaqueViewSet(viewsets.ModelViewSet):
 # ===========================================================
 # JARABE (CONTENEDOR DE PLANILLAS)
 # ===========================================================
-class JarabeViewSet(viewsets.ModelViewSet):
+class JarabeViewSet(PlanDeCargaMixin, viewsets.ModelViewSet):
     queryset = Jarabe.objects.all()
     serializer_class = JarabeSerializer
+    filtros = {
+        "producto": Exacto("producto"),
+        "lote": Exacto("lote"),
+        "planilla_fabricacion": Exacto("planilla_fabricacion"),
+        "planilla_envase_primario": Exacto("planilla_envase_primario"),
+    }
+    ordenamientos = ("id", "lote")
+
+    def _serializar_planilla(self, modelo, pk, serializer_class):
+        serializer = serializer_class(context=self.get_serializer_context())
+        planilla = serializer.cargar(modelo.objects.all()).get(pk=pk)
+        return serializer_class(
+            planilla, context=self.get_serializer_context()
+        ).data
 
     @action(detail=True, methods=["get"])
     def fabricacion(self, request, pk=None):
         jarabe = self.get_object()
 
-        if not jarabe.planilla_fabricacion:
+        if not jarabe.planilla_fabricacion_id:
             return Response(
                 {"detalle": "No existe planilla de fabricación asociada."},
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        serializer = PlanillaFabricacionSerializer(jarabe.planilla_fabricacion)
-        return Response(serializer.data)
+        return Response(self._serializar_planilla(
+            PlanillaFabricacion,
+            jarabe.planilla_fabricacion_id,
+            PlanillaFabricacionSerializer,
+        ))
 
     @action(detail=True, methods=["get"])
     def envase(self, request, pk=None):
         jarabe = self.get_object()
 
-        if not jarabe.planilla_envase:
+        if not jarabe.planilla_envase_id:
             return Response(
                 {"detalle": "No existe planilla de envase asociada."},
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        serializer = PlanillaEnvaseSerializer(jarabe.planilla_envase)
-        return Response(serializer.data)
+        return Response(self._serializar_planilla(
+            PlanillaEnvase,
+            jarabe.planilla_envase_id,
+            PlanillaEnvaseSerializer,
+        ))
 
     @action(detail=True, methods=["get"], url_path="envase-primario")
     def envase_primario(self, request, pk=None):
         jarabe = self.get_object()
 
-        if not jarabe.planilla_envase_primario:
+        if not jarabe.planilla_envase_primario_id:
             return Response(
                 {"detalle": "No existe planilla de envase primario asociada."},
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        serializer = PlanillaEnvasePrimarioSerializer(
-            jarabe.planilla_envase_primario
+        return Response(self._serializar_planilla(
+            PlanillaEnvasePrimario,
+            jarabe.planilla_envase_primario_id,
+            PlanillaEnvasePrimarioSerializer,
+        ))
+
+    @action(detail=True, methods=["get"])
+    def dossier(self, request, pk=None):
+        """
+        Todo el lote para la revisión de liberación: jarabe, planillas,
+        materiales, controles de calidad y firmas con su firmante. Ver
+        GPQAPI.dossier.
+        """
+        return Response(dossier.obtener(self.get_object()))
+
+
+# ===========================================================
+# BÚSQUEDA
+# ===========================================================
+@api_view(["GET"])
+def buscar(request):
+    """
+    Búsqueda de texto completo: ?q=acido cit&tipo=materia_prima,producto.
+    Cada resultado trae su tipo, id, título, rango y la URL del detalle.
+    """
+    parametros = BusquedaSerializer(data=request.query_params)
+    parametros.is_valid(raise_exception=True)
+    datos = parametros.validated_data
+    resultados = busqueda.buscar(
+        datos["q"], tipos=datos.get("tipo"), limite=datos["limite"]
+    )
+    for resultado in resultados:
+        fuente = busqueda.FUENTE_POR_TIPO[resultado["tipo"]]
+        resultado["url"] = reverse(
+            f"{fuente.modelo.lower()}-detail",
+            args=[resultado["id"]], request=request,
         )
-        return Response(serializer.data)
+    return Response({"q": datos["q"], "resultados": resultados})
+
+
+# ===========================================================
+# TABLERO
+# ===========================================================
+@api_view(["GET"])
+def tablero_resumen(request):
+    """
+    Conteos de planillas y materiales por estado, controles de calidad por
+    aprobado y stock por bodega, desde la caché (ver tablero.py).
+    """
+    return Response(tablero.resumen())
+
+
+# ===========================================================
+# MÉTRICAS
+# ===========================================================
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def metricas(request):
+    """Métricas de todos los workers en formato de texto de Prometheus."""
+    return HttpResponse(
+        almacen.exportar(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )